@@ -0,0 +1,222 @@
+from typing import Dict, Iterator, List
+import mmap
+import struct
+
+# An AAF is a Microsoft compound file (structured storage). Every object is a
+# storage holding a "properties" stream, so the locators can be read straight
+# from the storages below Header/Content/Mobs/EssenceDescription/Locator
+# without building the aaf2 object model.
+
+SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+NOSTREAM = 0xFFFFFFFF
+STORAGE = 1
+STREAM = 2
+ROOT = 5
+
+HEADER = struct.Struct("<8s16sHHHHH6sIIIIIIIII")
+DIRECTORY_ENTRY = struct.Struct("<64sHBBIII16sIQQIQ")
+PROPERTY_HEADER = struct.Struct("<BBH")
+PROPERTY_ENTRY = struct.Struct("<HHH")
+
+# storage names aaf2 and Avid write, "<property name>-<pid>"
+HEADER_STORAGE = "Header-2"
+CONTENT_STORAGE = "Content-3b03"
+MOBS_PREFIX = "Mobs-1901{"
+DESCRIPTOR_STORAGE = "EssenceDescription-4701"
+LOCATOR_PREFIX = "Locator-2f01{"
+URL_STRING_PID = 0x4001
+
+
+class UnsupportedAAF(ValueError):
+    """The file can't be read by the fast scanner, use aaf2 instead."""
+
+
+class CompoundFile:
+    """Minimal read-only compound file reader over a memory-mapped file."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            self._file.close()
+            raise UnsupportedAAF(f"cannot map {path}: {e}") from e
+
+        try:
+            self._read_header()
+        except (struct.error, IndexError) as e:
+            self.close()
+            raise UnsupportedAAF(f"damaged compound file header: {e}") from e
+        except UnsupportedAAF:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _read_header(self):
+        (signature, _, _, major_version, byte_order, sector_shift, mini_sector_shift, _,
+         _, fat_sector_count, first_dir_sector, _, self.mini_cutoff, first_minifat_sector,
+         minifat_sector_count, first_difat_sector, difat_sector_count) = HEADER.unpack_from(self._map, 0)
+        if signature != SIGNATURE:
+            raise UnsupportedAAF("not a compound file")
+        if byte_order != 0xFFFE or major_version not in (3, 4):
+            raise UnsupportedAAF("unsupported compound file version")
+
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_sector_shift
+        self.major_version = major_version
+
+        # the FAT sector list starts in the header and continues through the DIFAT chain
+        fat_sectors = list(struct.unpack_from("<109I", self._map, HEADER.size))
+        per_difat = self.sector_size // 4 - 1
+        sid = first_difat_sector
+        for _ in range(difat_sector_count):
+            if sid in (ENDOFCHAIN, FREESECT):
+                break
+            values = struct.unpack_from(f"<{per_difat + 1}I", self._map, self._offset(sid))
+            fat_sectors.extend(values[:per_difat])
+            sid = values[per_difat]
+        fat_sectors = [sid for sid in fat_sectors[:fat_sector_count] if sid not in (ENDOFCHAIN, FREESECT)]
+
+        per_sector = self.sector_size // 4
+        self.fat: List[int] = []
+        for sid in fat_sectors:
+            self.fat.extend(struct.unpack_from(f"<{per_sector}I", self._map, self._offset(sid)))
+
+        self.minifat: List[int] = []
+        for sid in self._chain(first_minifat_sector):
+            self.minifat.extend(struct.unpack_from(f"<{per_sector}I", self._map, self._offset(sid)))
+
+        self.entries = []
+        per_dir_sector = self.sector_size // DIRECTORY_ENTRY.size
+        for sid in self._chain(first_dir_sector):
+            offset = self._offset(sid)
+            for i in range(per_dir_sector):
+                self.entries.append(DIRECTORY_ENTRY.unpack_from(self._map, offset + i * DIRECTORY_ENTRY.size))
+        if not self.entries or self.entries[0][2] != ROOT:
+            raise UnsupportedAAF("compound file has no root entry")
+
+        # the mini stream lives in the root entry's sector chain
+        self.mini_stream_sectors = self._chain(self.entries[0][11])
+
+    def _offset(self, sid: int) -> int:
+        return (sid + 1) * self.sector_size
+
+    def _chain(self, start: int, table: List[int] = None) -> List[int]:
+        table = self.fat if table is None else table
+        chain = []
+        sid = start
+        while sid not in (ENDOFCHAIN, FREESECT):
+            if sid >= len(table) or len(chain) > len(table):
+                raise UnsupportedAAF("broken sector chain")
+            chain.append(sid)
+            sid = table[sid]
+        return chain
+
+    def name(self, entry_id: int) -> str:
+        raw, length = self.entries[entry_id][0], self.entries[entry_id][1]
+        return raw[:max(0, length - 2)].decode("utf-16-le")
+
+    def children(self, entry_id: int) -> Dict[str, int]:
+        """Names and entry ids of everything directly inside a storage."""
+        children = {}
+        stack = [self.entries[entry_id][6]]
+        while stack:
+            child = stack.pop()
+            if child == NOSTREAM:
+                continue
+            if child >= len(self.entries) or len(children) > len(self.entries):
+                raise UnsupportedAAF("broken directory tree")
+            children[self.name(child)] = child
+            stack.append(self.entries[child][4])
+            stack.append(self.entries[child][5])
+        return children
+
+    def read_stream(self, entry_id: int) -> bytes:
+        entry = self.entries[entry_id]
+        start, size = entry[11], entry[12]
+        if self.major_version == 3:
+            size &= 0xFFFFFFFF
+
+        chunks = []
+        if size < self.mini_cutoff:
+            for msid in self._chain(start, self.minifat):
+                position = msid * self.mini_sector_size
+                sector = self.mini_stream_sectors[position // self.sector_size]
+                offset = self._offset(sector) + position % self.sector_size
+                chunks.append(self._map[offset:offset + self.mini_sector_size])
+        else:
+            for sid in self._chain(start):
+                offset = self._offset(sid)
+                chunks.append(self._map[offset:offset + self.sector_size])
+        return b"".join(chunks)[:size]
+
+
+def vector_index(name: str) -> int:
+    """The element index from a storage name such as Mobs-1901{1a}."""
+    try:
+        return int(name[name.index("{") + 1:name.index("}")], 16)
+    except ValueError:
+        return 0
+
+
+def url_string(properties: bytes) -> str:
+    """The URLString value from an AAF properties stream, or an empty string."""
+    byte_order, _, entry_count = PROPERTY_HEADER.unpack_from(properties, 0)
+    if byte_order != 0x4C:
+        raise UnsupportedAAF("big-endian property stream")
+
+    data_offset = PROPERTY_HEADER.size + entry_count * PROPERTY_ENTRY.size
+    for i in range(entry_count):
+        pid, _, length = PROPERTY_ENTRY.unpack_from(properties, PROPERTY_HEADER.size + i * PROPERTY_ENTRY.size)
+        if pid == URL_STRING_PID:
+            return properties[data_offset:data_offset + length].decode("utf-16-le").rstrip("\x00")
+        data_offset += length
+    return ""
+
+
+def locator_urls(aaf_path: str) -> Iterator[str]:
+    """Yield the URLString of every locator on a SourceMob's essence descriptor.
+
+    Only mobs that carry an essence descriptor, which are the source mobs, are
+    opened. Raises UnsupportedAAF if the file isn't laid out as expected,
+    including damaged sectors, properties or strings found part way through.
+    """
+    try:
+        yield from _locator_urls(aaf_path)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise UnsupportedAAF(f"damaged compound file: {e}") from e
+
+
+def _locator_urls(aaf_path: str) -> Iterator[str]:
+    with CompoundFile(aaf_path) as cfb:
+        header = cfb.children(0).get(HEADER_STORAGE)
+        content = cfb.children(header).get(CONTENT_STORAGE) if header is not None else None
+        if content is None:
+            raise UnsupportedAAF("no content storage")
+
+        mobs = [(name, i) for name, i in cfb.children(content).items() if name.startswith(MOBS_PREFIX)]
+        for _, mob in sorted(mobs, key=lambda item: vector_index(item[0])):
+            descriptor = cfb.children(mob).get(DESCRIPTOR_STORAGE)
+            if descriptor is None:
+                continue
+            locators = [
+                (name, i) for name, i in cfb.children(descriptor).items() if name.startswith(LOCATOR_PREFIX)
+            ]
+            for _, locator in sorted(locators, key=lambda item: vector_index(item[0])):
+                properties = cfb.children(locator).get("properties")
+                if properties is None:
+                    continue
+                url = url_string(cfb.read_stream(properties))
+                if url:
+                    yield url
@@ -0,0 +1,165 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from pathlib import Path
+import logging
+import math
+import os
+import threading
+import time
+
+
+def mount_point(path: Path) -> Path:
+    """The mount a path lives on, found by walking up until os.path.ismount."""
+    path = Path(os.path.abspath(path))
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    while not os.path.ismount(path) and path != path.parent:
+        path = path.parent
+    return path
+
+
+class AdaptiveConcurrency:
+    """Tunes the number of copies in flight to one destination from its measured throughput.
+
+    Throughput is measured over each `interval` while the limit is in use.
+    If it beat the best seen so far, one more copy is allowed (additive
+    increase). If it fell well short, the limit is cut to `decrease` of
+    itself (multiplicative decrease). The best rate slowly decays so the
+    limit is probed again when conditions change.
+    """
+
+    def __init__(
+        self,
+        name: str = "",
+        start: int = 2,
+        maximum: int = 16,
+        interval: float = 5.0,
+        decrease: float = 0.75,
+        tolerance: float = 0.05,
+        decay: float = 0.98,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.maximum = max(1, maximum)
+        self.limit = min(max(1, start), self.maximum)
+        self.interval = interval
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.decay = decay
+        self.clock = clock
+        self.best_rate = 0.0
+        self.peak_rate = 0.0
+        self.in_flight = 0
+        self.reached = 0
+        self.history: List[Tuple[float, int, float]] = []
+        self._condition = threading.Condition()
+        self._bytes = 0
+        self._saturated = True
+        self._window_start = clock()
+        self._limit_since = self._window_start
+        self._time_at_limit: Dict[int, float] = {}
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the copy slots, waiting for one to free up."""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, copied: int):
+        """Count bytes written, adjusting the limit at the end of each interval."""
+        with self._condition:
+            self._bytes += copied
+            self.reached = max(self.reached, self.in_flight)
+            # a window only says something about the limit if the limit was actually reached
+            self._saturated = self._saturated and self.in_flight >= self.limit
+            now = self.clock()
+            elapsed = now - self._window_start
+            if elapsed < self.interval:
+                return
+            rate = self._bytes / elapsed
+            if self._saturated:
+                self._adjust(rate, now)
+            self._bytes = 0
+            self._saturated = True
+            self._window_start = now
+
+    def _adjust(self, rate: float, now: float):
+        previous = self.limit
+        self.peak_rate = max(self.peak_rate, rate)
+        if rate > self.best_rate * (1 + self.tolerance):
+            self.best_rate = rate
+            self.limit = min(self.maximum, self.limit + 1)
+        elif rate < self.best_rate * (1 - 2 * self.tolerance):
+            self.limit = max(1, math.floor(self.limit * self.decrease))
+            self.best_rate = rate
+        else:
+            self.best_rate *= self.decay
+
+        self.history.append((now, self.limit, rate))
+        if self.limit != previous:
+            self._time_at_limit[previous] = self._time_at_limit.get(previous, 0.0) + now - self._limit_since
+            self._limit_since = now
+            logging.info(
+                f"adaptive streams {self.name}: {previous} -> {self.limit} at {rate / 1024 / 1024:.1f} MB/s"
+            )
+            # let waiting copies start if the limit went up
+            self._condition.notify_all()
+
+    def settled(self) -> int:
+        """The limit the run spent the most time at, but no more copies than were ever in flight at once."""
+        with self._condition:
+            times = dict(self._time_at_limit)
+            times[self.limit] = times.get(self.limit, 0.0) + self.clock() - self._limit_since
+        level = max(times, key=times.get)
+        return min(level, self.reached) if self.reached else level
+
+
+class AdaptiveScheduler:
+    """One AdaptiveConcurrency per destination mount.
+
+    `cap` may give a lower maximum for a destination, e.g. a stream limit
+    set for its volume.
+    """
+
+    def __init__(
+        self,
+        maximum: int = 16,
+        start: int = 2,
+        interval: float = 5.0,
+        cap: Optional[Callable[[Path], Optional[int]]] = None,
+    ):
+        self.maximum = maximum
+        self.cap = cap
+        self.start = start
+        self.interval = interval
+        self.mounts: Dict[Path, AdaptiveConcurrency] = {}
+        self._folders: Dict[Path, Path] = {}
+        self._lock = threading.Lock()
+
+    def for_destination(self, dst: Path) -> AdaptiveConcurrency:
+        folder = Path(dst).parent
+        with self._lock:
+            mount = self._folders.get(folder)
+            if mount is None:
+                mount = self._folders[folder] = mount_point(folder)
+            if mount not in self.mounts:
+                limit = self.cap(dst) if self.cap else None
+                maximum = min(self.maximum, limit) if limit else self.maximum
+                self.mounts[mount] = AdaptiveConcurrency(
+                    str(mount), start=self.start, maximum=maximum, interval=self.interval
+                )
+            return self.mounts[mount]
+
+    def summary(self) -> List[str]:
+        return [
+            f"{mount}: settled on {gate.settled()} streams (peak {gate.peak_rate / 1024 / 1024:.1f} MB/s)"
+            for mount, gate in self.mounts.items()
+        ]
@@ -1,9 +1,29 @@
-from typing import List, Sequence
-import os, math, argparse
-from shutil import copy2
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+import os, math, argparse, sys
 import search
+from journal import CopyJournal, PlannedFile
+from destination_index import DestinationIndex
+from timeline_cache import TimelineCache, decode_clip, encode_clip
+from metrics import Metrics
+import packing
+from content_store import ContentStore
+from failures import FailureReport, JobPaused
+from adaptive import AdaptiveScheduler
+from capacity import CapacityPlan, allocated_size, free_space, plan_capacity, split_across
+import audit
+import failures
+from throttle import BandwidthLimiter
+import throttle
+import timeline_cache
+from fnmatch import fnmatchcase
+import fixity
+import fastcopy
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager, nullcontext
+import heapq
+import threading
 import time
 
 import logging
@@ -24,16 +44,26 @@ def convert_size(size_bytes: int):
     return "%s %s" % (s, size_name[i])
 
 
-def filenames_in_path(path: Path, extensions: List[str]):
-    dst_files = set()
-    for ext in extensions:
-        dst_files.update(p.name for p in path.rglob(f"*.{ext}"))
-    return dst_files
+def filenames_in_path(path: Path, extensions: List[str], index: Optional[DestinationIndex] = None):
+    if index is not None:
+        # answer from the cached destination index instead of walking the tree
+        names = index.names(under=path)
+        pack_indexes = [file for file, _ in index.files(under=path) if packing.is_pack_index(file.name)]
+    else:
+        names = {p.name for p in path.rglob("*")}
+        pack_indexes = list(path.rglob(f"{packing.PACK_PREFIX}*{packing.INDEX_SUFFIX}"))
+
+    # files packed into tars count as copied
+    for pack_index in pack_indexes:
+        names.update(row["name"] for row in packing.read_index(pack_index))
+    return {name for name in names if any(fnmatchcase(name, f"*.{ext}") for ext in extensions)}
 
 
-def uncopiedfiles_directoryagnostic(src_paths: Sequence[Path | str], dst_path: Path) -> List[Path]:
+def uncopiedfiles_directoryagnostic(
+    src_paths: Sequence[Path | str], dst_path: Path, index: Optional[DestinationIndex] = None
+) -> List[Path]:
     # Get all files in the destination base path
-    dst = filenames_in_path(dst_path, ["*"])
+    dst = filenames_in_path(dst_path, ["*"], index=index)
 
     # Ensure src_paths contains Path objects
     source_paths = [Path(src) for src in src_paths]
@@ -59,15 +89,81 @@ def file_exists(dst_file: Path) -> bool:
     return dst_file.exists()
 
 
-def uncopied_files(src_files: Sequence[Path | str], dst_path: Path) -> List[Path]:
-    """Get a list of source files that have not been copied."""
+def directory_listing(folder: Path) -> Set[str]:
+    """Names of everything in a folder, empty if the folder doesn't exist."""
+    try:
+        with os.scandir(folder) as entries:
+            names = {entry.name for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+    # files packed into tars in the folder count as present
+    return names | packing.packed_names(folder, names)
+
+
+def uncopied_files(src_files: Sequence[Path | str], dst_path: Path, jobs: int = 16) -> List[Path]:
+    """Get a list of source files that have not been copied.
+
+    Destinations are grouped by folder so each folder is listed once, with
+    up to `jobs` folders listed at a time, rather than checking every file.
+    """
+    sources = [Path(src_path) for src_path in src_files]
+    destinations = [destination_path(src, dst_path) for src in sources]
+
+    folders = list({dst.parent for dst in destinations})
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        listings = dict(zip(folders, executor.map(directory_listing, folders)))
+
     files_to_copy = [
-        Path(src_path)
-        for src_path in src_files
-        if not file_exists(destination_path(Path(src_path), dst_path))
+        src
+        for src, dst in zip(sources, destinations)
+        if dst.name not in listings[dst.parent]
     ]
     return files_to_copy
 
+class SourceStat(NamedTuple):
+    """Size, mtime, existence and inode of a source file, gathered once per run."""
+    size: int
+    mtime: float
+    exists: bool
+    inode: int = 0
+
+
+MISSING = SourceStat(size=0, mtime=0.0, exists=False)
+
+
+def stat_with_retry(file_path: Path | str, retries: int = 3, delay: float = 0.5) -> SourceStat:
+    """Stat a file, retrying with backoff to handle potential file system latency.
+
+    Only transient errors from a flaky share are retried, a missing file is
+    reported straight away. Any file that can't be read counts as missing.
+    """
+    for attempt in range(retries):
+        try:
+            stat = os.stat(file_path)
+            return SourceStat(size=stat.st_size, mtime=stat.st_mtime, exists=True, inode=stat.st_ino)
+        except OSError as e:
+            if failures.classify(e) == failures.TRANSIENT and attempt < retries - 1:
+                time.sleep(delay * 2 ** attempt)
+            else:
+                report(f"{e}")
+                break
+    return MISSING
+
+
+def stat_sources(
+    src_paths: Sequence[Path | str], jobs: int = 16, retries: int = 3, delay: float = 0.5
+) -> Dict[Path, SourceStat]:
+    """Stat every source file concurrently, returning a cache keyed by path.
+
+    Retries happen inside the worker threads, so one slow file doesn't hold
+    up the rest.
+    """
+    paths = list({Path(src) for src in src_paths})
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = executor.map(lambda path: stat_with_retry(path, retries, delay), paths)
+        return dict(zip(paths, results))
+
+
 def ensure_folder_exists(folder: Path):
     """Creates folder if it doesn't exist."""
     folder.mkdir(parents=True, exist_ok=True)
@@ -80,13 +176,166 @@ def determine_destination(src: Path, base_dst: Path, flat: bool) -> Path:
     return base_dst / src.relative_to("/Volumes")
 
 
-def copy_file(src: Path, dst: Path, placeholder: bool = False):
-    """Copies file or creates a placeholder file at destination."""
+def volume_name(path: Path) -> str:
+    """Returns the volume a path lives on, the first component after /Volumes/."""
+    parts = Path(path).parts
+    if len(parts) > 2 and parts[1] == "Volumes":
+        return parts[2]
+    return parts[0] if parts else ""
+
+
+def top_folder(path: Path) -> str:
+    """Returns the volume and first folder a path lives in, e.g. RAID/Show for /Volumes/RAID/Show/A001.mov."""
+    parts = Path(path).parts
+    start = 2 if len(parts) > 2 and parts[1] == "Volumes" else 1
+    return "/".join(parts[start:min(start + 2, len(parts) - 1)]) or volume_name(path)
+
+
+COPY_ORDERS = ("locality", "extent", "largest", "none")
+
+
+def order_copies(
+    src_paths: Sequence[Path | str],
+    stats: Optional[Dict[Path, SourceStat]] = None,
+    order: str = "locality",
+    jobs: int = 16,
+) -> List[Path | str]:
+    """Orders the copy list so source disks read sequentially.
+
+    "locality" groups files by volume, then directory, then inode, which on
+    most filesystems follows allocation order. "extent" sorts each volume by
+    the on-disk offset of each file's first extent where FIEMAP works, and
+    by directory and inode otherwise. Volumes are interleaved so parallel
+    copies spread across them. "largest" copies the biggest files first,
+    which keeps parallel copies from finishing on one long file, and "none"
+    keeps the order given.
+    """
+    if order not in COPY_ORDERS:
+        raise ValueError(f"Unknown copy order: {order}")
+    stats = stats or {}
+    if order == "none":
+        return list(src_paths)
+    if order == "largest":
+        return sorted(src_paths, key=lambda src: stats.get(Path(src), MISSING).size, reverse=True)
+
+    offsets: Dict[Path | str, Optional[int]] = {}
+    if order == "extent":
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            offsets = dict(zip(src_paths, executor.map(fastcopy.physical_offset, src_paths)))
+
+    def locality(src: Path | str):
+        path = Path(src)
+        offset = offsets.get(src)
+        return (offset is None, offset or 0, str(path.parent), stats.get(path, MISSING).inode, path.name)
+
+    volumes: Dict[str, List[Path | str]] = {}
+    for src in src_paths:
+        volumes.setdefault(volume_name(Path(src)), []).append(src)
+    queues = [sorted(files, key=locality) for _, files in sorted(volumes.items())]
+
+    ordered = []
+    for i in range(max(map(len, queues), default=0)):
+        ordered.extend(queue[i] for queue in queues if i < len(queue))
+    return ordered
+
+
+class VolumeLimiter:
+    """Caps the number of simultaneous copy streams touching each volume."""
+
+    def __init__(self, default: int = 2, limits: Optional[Dict[str, int]] = None):
+        self.default = default
+        self.limits = limits or {}
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def semaphore(self, volume: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if volume not in self._semaphores:
+                limit = max(1, self.limits.get(volume, self.default))
+                self._semaphores[volume] = threading.BoundedSemaphore(limit)
+            return self._semaphores[volume]
+
+    @contextmanager
+    def streams(self, src: Path, dst: Path, destination: bool = True):
+        """Hold a stream on the source and destination volumes for the duration.
+
+        With `destination` off only the source volume is limited, for copies
+        whose destination concurrency is managed elsewhere.
+        """
+        # acquire in a fixed order so two copies can never wait on each other
+        volumes = sorted({volume_name(src), volume_name(dst)} if destination else {volume_name(src)})
+        with ExitStack() as stack:
+            for volume in volumes:
+                stack.enter_context(self.semaphore(volume))
+            yield
+
+
+_output_lock = threading.Lock()
+
+
+def report(message: str):
+    """Print a message without interleaving output from other copy threads."""
+    with _output_lock:
+        print(message)
+
+
+failure_report = FailureReport()
+
+
+def log_failed_copy(src: Path, dst: Path, error: Exception | str, attempts: int = 1):
+    """Record a failed copy, classified, in the failure report (failed.jsonl)."""
+    failure_report.record(src, dst, error, attempts)
+
+
+def chunk_callbacks(*callbacks: Optional[fastcopy.Throttle]) -> Optional[fastcopy.Throttle]:
+    """Combine the per-chunk callbacks given to a copy loop into one."""
+    callbacks = [callback for callback in callbacks if callback]
+    if len(callbacks) <= 1:
+        return callbacks[0] if callbacks else None
+
+    def each(copied: int):
+        for callback in callbacks:
+            callback(copied)
+
+    return each
+
+
+class CopyResult(NamedTuple):
+    """How a file was copied, and its source checksum if one was taken."""
+    strategy: str
+    digest: Optional[str] = None
+
+
+def copy_file(
+    src: Path,
+    dst: Path,
+    placeholder: bool = False,
+    checksum: Optional[str] = None,
+    buffer_size: int = fastcopy.BUFFER_SIZE,
+    throttle: Optional[fastcopy.Throttle] = None,
+    store: Optional[ContentStore] = None,
+) -> CopyResult:
+    """Copies file or creates a placeholder file at destination.
+
+    Uses the fastest kernel copy available (reflink, copy_file_range,
+    sendfile) before falling back to a buffered loop. With a checksum
+    algorithm the source is hashed in the same loop that writes the copy.
+    `throttle` is called after each chunk to hold the copy to a bandwidth cap.
+    With a content store, dst is linked to the stored copy of the file.
+    """
     ensure_folder_exists(dst.parent)
     if placeholder:
         dst.touch(exist_ok=True)
-        return
-    copy2(src, dst)
+        return CopyResult("placeholder")
+    if store is not None:
+        placed = store.place(src, dst, buffer_size, throttle)
+        log_file_operation(dst, f"{placed.strategy} by {placed.link}")
+        if checksum and checksum != store.algorithm:
+            return CopyResult(placed.strategy, fixity.hash_file(dst, checksum))
+        return CopyResult(placed.strategy, placed.digest if checksum else None)
+    if checksum:
+        return CopyResult("hashed", fixity.copy_with_checksum(src, dst, checksum, buffer_size, throttle))
+    return CopyResult(fastcopy.fast_copy(src, dst, buffer_size, throttle))
 
 
 def copy_files_shutil(
@@ -94,32 +343,525 @@ def copy_files_shutil(
     dst_path: Path,
     flat: bool = False,
     placeholder: bool = False,
-):
-    """Performs copy to new location."""
+    jobs: int = 1,
+    limiter: Optional[VolumeLimiter] = None,
+    journal: Optional[CopyJournal] = None,
+    checksum: Optional[str] = None,
+    stats: Optional[Dict[Path, SourceStat]] = None,
+    buffer_size: int = fastcopy.BUFFER_SIZE,
+    metrics: Optional[Metrics] = None,
+    verbose: bool = True,
+    bandwidth: Optional[BandwidthLimiter] = None,
+    pack_threshold: int = 0,
+    pack_bytes: int = packing.DEFAULT_PACK_BYTES,
+    store: Optional[ContentStore] = None,
+    retries: int = 0,
+    retry_delay: float = 10.0,
+    adaptive: Optional[AdaptiveScheduler] = None,
+    written: Optional[List[Path]] = None,
+) -> Path:
+    """Performs copy to new location, running up to `jobs` copies at once.
+
+    When a journal is given, every file is recorded as it starts, completes
+    or fails so an interrupted run can be resumed. With a checksum algorithm,
+    source hashes are written to a fixity manifest at the archive root.
+    Sizes and mtimes are taken from `stats` when the source is in it.
+    The copy strategy used for each file is logged and totalled at the end.
+    With metrics, each file's size and copy time are recorded; when
+    `verbose` is off a single progress line replaces the per-file output.
+    A bandwidth limiter caps the throughput overall and per source volume.
+    Files smaller than `pack_threshold` bytes are packed into tars of up to
+    `pack_bytes` in the folder they would have been copied to, one set of
+    tars per source folder, with their checksums kept in the pack index.
+    With a content store, files are linked to their stored copies, and
+    only media the store doesn't already hold is copied.
+    Transient errors (EIO, ETIMEDOUT, ESTALE...) are retried up to `retries`
+    times, backing off from `retry_delay` seconds, while other copies carry
+    on. Running out of space stops new copies and raises JobPaused once the
+    running ones finish. With an adaptive scheduler, the copies in flight to
+    each destination mount are tuned from its measured throughput, up to `jobs`.
+    Destination files and packs this run writes are appended to `written`.
+    Returns the archive root the files were copied into.
+    """
     # Revise the destination folder path if structure is flat
     date = datetime.now().strftime("%y%m%d%H%M%S")
     dst_path = dst_path / date if flat else dst_path
 
-    for src in src_paths:
+    checksum = None if placeholder else checksum
+    manifest = fixity.FixityManifest(dst_path / fixity.MANIFEST_NAME) if checksum else None
+
+    limiter = limiter or VolumeLimiter(default=jobs)
+    claimed = set()
+    claimed_lock = threading.Lock()
+    strategies: Dict[str, int] = {}
+    if bandwidth and bandwidth.enabled:
+        # smaller chunks keep a throttled copy smooth instead of bursting
+        buffer_size = min(buffer_size, throttle.CHUNK_SIZE)
+    else:
+        bandwidth = None
+
+    def source_stat(src: Path) -> SourceStat:
+        stat = stats.get(src) if stats else None
+        if stat is None or not stat.exists:
+            stat = stat_with_retry(src)
+        return stat
+
+    def skip_existing(src: Path, dst: Path, packed: Set[str] = frozenset()) -> bool:
+        # skip files that already exist, or that another thread is already writing.
+        with claimed_lock:
+            duplicate = dst in claimed
+            claimed.add(dst)
+        if not (duplicate or dst.name in packed or dst.exists()):
+            return False
+        if verbose:
+            report("File exists, skipping.")
+        if journal and not duplicate:
+            journal.complete(src, dst)
+        if metrics:
+            metrics.record_skip(stats.get(src, MISSING).size if stats else 0)
+        return True
+
+    paused = threading.Event()
+    not_started: List[Path] = []
+
+    def handle_failure(src: Path, dst: Path, error: Exception, attempt: int) -> List[Tuple[Path, int]]:
+        """Record a failed file. Returns it with its next attempt if the error is worth retrying."""
+        if journal:
+            journal.fail(src, dst, error)
+        kind = failures.classify(error)
+        if kind == failures.SPACE:
+            paused.set()
+        if kind == failures.TRANSIENT and attempt < retries:
+            report(f"{error}, retrying {src} later (attempt {attempt + 2} of {retries + 1})")
+            return [(src, attempt + 1)]
+        log_failed_copy(src, dst, error, attempts=attempt + 1)
+        if metrics:
+            metrics.record_failure()
+        return []
+
+    def copy_task(src: Path | str, attempt: int = 0) -> List[Tuple[Path, int]]:
+        """Copy one file. Returns the file and its next attempt if it should be retried."""
         src = Path(src)
         dst = determine_destination(src, dst_path, flat)
+        if paused.is_set():
+            with claimed_lock:
+                not_started.append(src)
+            return []
+        # a retry already holds its claim on the destination
+        if not attempt and skip_existing(src, dst):
+            return []
+
+        if verbose and placeholder:
+            report(f"creating placeholder from : {src}\ncreating placeholder at   : {dst}")
+        elif verbose:
+            report(f"copying from : {src}\ncopying to   : {dst}")
 
-        # skip files that already exist.
-        if dst.exists():
-            print("File exists, skipping.")
+        try:
+            if journal:
+                journal.start(src, dst)
+            gate = adaptive.for_destination(dst) if adaptive else None
+            # the adaptive gate decides how many copies write to the destination
+            with limiter.streams(src, dst, destination=gate is None), gate.slot() if gate else nullcontext():
+                started = time.perf_counter()
+                result = copy_file(
+                    src,
+                    dst,
+                    placeholder=placeholder,
+                    checksum=checksum,
+                    buffer_size=buffer_size,
+                    throttle=chunk_callbacks(
+                        bandwidth.throttle(volume_name(src)) if bandwidth else None,
+                        gate.record if gate else None,
+                    ),
+                    store=store,
+                )
+                seconds = time.perf_counter() - started
+            with claimed_lock:
+                strategies[result.strategy] = strategies.get(result.strategy, 0) + 1
+            if journal or manifest or metrics:
+                stat = source_stat(src)
+            log_file_operation(dst, f"copied ({result.strategy}) in {seconds:.3f}s")
+            if journal:
+                journal.complete(src, dst, size=stat.size, mtime=stat.mtime)
+            if manifest and result.digest:
+                manifest.add(dst, src, stat.size, checksum, result.digest)
+            if written is not None:
+                with claimed_lock:
+                    written.append(dst)
+            if metrics:
+                metrics.record_copy(dst, stat.size, seconds, result.strategy)
+        except Exception as e:
+            # don't leave a partial copy that looks finished
+            if not placeholder:
+                dst.unlink(missing_ok=True)
+            return handle_failure(src, dst, e, attempt)
+        finally:
+            if metrics:
+                metrics.update(display=not verbose, convert_size=convert_size)
+        return []
+
+    def pack_task(folder: Path, group: List[Path]) -> List[Tuple[Path, int]]:
+        """Pack a group of small files. Returns the files to retry, which are copied on their own."""
+        retry: List[Tuple[Path, int]] = []
+        packed = packing.packed_names(folder)
+        # files are only completed in the journal once the pack holding them is finished
+        finished = []
+        error = None
+        writer = packing.PackWriter(folder, pack_bytes, checksum)
+        try:
+            with limiter.streams(group[0], folder), writer:
+                for i, src in enumerate(group):
+                    if paused.is_set():
+                        with claimed_lock:
+                            not_started.extend(group[i:])
+                        break
+                    dst = determine_destination(src, dst_path, flat)
+                    if skip_existing(src, dst, packed):
+                        continue
+                    if verbose:
+                        report(f"packing from : {src}\npacking into : {folder}")
+                    stat = source_stat(src)
+                    try:
+                        if journal:
+                            journal.start(src, dst)
+                        started = time.perf_counter()
+                        writer.add(src, dst.name, throttle=bandwidth.throttle(volume_name(src)) if bandwidth else None)
+                        seconds = time.perf_counter() - started
+                    except Exception as e:
+                        # a failed rollover also loses the pack before, so remember what caused it
+                        error = e
+                        retry.extend(handle_failure(src, dst, e, 0))
+                        continue
+                    finished.append((src, dst, stat))
+                    log_file_operation(dst, f"packed in {seconds:.3f}s")
+                    if metrics:
+                        metrics.record_copy(dst, stat.size, seconds, "packed")
+                        metrics.update(display=not verbose, convert_size=convert_size)
+        except Exception as e:
+            # finishing a pack failed, and the files in it were lost with it
+            report(f"could not finish a pack in {folder}: {e}")
+            error = e
+
+        in_packs = {src for sources in writer.sources.values() for src in sources}
+        completed = [(src, dst, stat) for src, dst, stat in finished if str(src) in in_packs]
+        for src, dst, _ in finished:
+            if str(src) not in in_packs:
+                retry.extend(handle_failure(src, dst, error, 0))
+        with claimed_lock:
+            strategies["packed"] = strategies.get("packed", 0) + len(completed)
+            if written is not None:
+                written.extend(writer.packs)
+        if journal:
+            for src, dst, stat in completed:
+                journal.complete(src, dst, size=stat.size, mtime=stat.mtime)
+        return retry
+
+    # small files are grouped by the folder they came from and the folder they go to
+    groups: Dict[Tuple[Path, Path], List[Path]] = {}
+    singles: List[Path | str] = []
+    for src in src_paths:
+        stat = source_stat(Path(src)) if pack_threshold and not placeholder else MISSING
+        if stat.exists and stat.size < pack_threshold:
+            src = Path(src)
+            groups.setdefault((determine_destination(src, dst_path, flat).parent, src.parent), []).append(src)
         else:
-            if placeholder:
-                print(f"creating placeholder from : {src}\ncreating placeholder at   : {dst}")
-            else:
-                print(f"copying from : {src}\ncopying to   : {dst}")
+            singles.append(src)
 
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        running = {executor.submit(pack_task, folder, group) for (folder, _), group in groups.items()}
+        running.update(executor.submit(copy_task, src) for src in singles)
+
+        # files to retry wait in a queue ordered by when they're due, and are
+        # resubmitted as they come due without holding up the other copies
+        retry_queue: List[Tuple[float, Path, int]] = []
+        while running or retry_queue:
+            timeout = max(0.0, retry_queue[0][0] - time.monotonic()) if retry_queue else None
+            done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for task in done:
+                for src, attempt in task.result():
+                    heapq.heappush(retry_queue, (time.monotonic() + retry_delay * 2 ** (attempt - 1), src, attempt))
+            while retry_queue and retry_queue[0][0] <= time.monotonic():
+                _, src, attempt = heapq.heappop(retry_queue)
+                running.add(executor.submit(copy_task, src, attempt))
+
+    if metrics:
+        metrics.update(display=not verbose, convert_size=convert_size, force=True)
+    if strategies:
+        print("Copy strategies used:", ", ".join(f"{name} {count}" for name, count in sorted(strategies.items())))
+    if adaptive:
+        for line in adaptive.summary():
+            print("Adaptive streams", line)
+            logging.info(f"adaptive streams {line}")
+    if paused.is_set():
+        raise JobPaused(dst_path, not_started)
+    return dst_path
+
+
+def verify_archive(
+    archive_root: Path, journal: Optional[CopyJournal] = None, written: Optional[Sequence[Path]] = None
+) -> List[Path]:
+    """Re-hashes the destination against the fixity manifest.
+
+    With `written`, only those files and packs are checked, so verifying an
+    incremental run doesn't re-read the whole archive. Files that don't
+    match are removed so the next run copies them again.
+    """
+    manifest = fixity.FixityManifest(archive_root / fixity.MANIFEST_NAME)
+    entries = manifest.entries()
+    paths = packs = None
+    if written is not None:
+        paths = [rel for rel in (os.path.relpath(dst, archive_root) for dst in written) if rel in entries]
+        packs = [dst for dst in written if packing.PACK_PATTERN.match(dst.name)]
+    mismatched = manifest.verify(paths)
+    for dst in mismatched:
+        src = Path(entries[os.path.relpath(dst, archive_root)]["source"])
+        report(f"checksum mismatch: {dst}")
+        log_failed_copy(src, dst, "destination does not match source checksum")
+        if journal:
+            journal.fail(src, dst, "destination does not match source checksum")
+        dst.unlink(missing_ok=True)
+
+    # packed files are dropped from their pack's index instead, so they're packed again
+    for pack_index, rows in packing.verify_packs(archive_root, packs).items():
+        for row in rows:
+            src, dst = Path(row["source"]), pack_index.parent / row["name"]
+            report(f"checksum mismatch: {dst} (packed)")
+            log_failed_copy(src, dst, "packed file does not match source checksum")
+            if journal:
+                journal.fail(src, dst, "packed file does not match source checksum")
+            mismatched.append(dst)
+    return mismatched
+
+
+def is_archive_metadata(rel_path: str) -> bool:
+    """Files archive_nle keeps in the destination for itself, which are never pruned."""
+    name = os.path.basename(rel_path)
+    return (
+        rel_path.startswith(".archive_nle")
+        or name == fixity.MANIFEST_NAME
+        or name.startswith(packing.PACK_PREFIX)
+    )
+
+
+def prune_candidates(
+    index: DestinationIndex, src_paths: Sequence[Path | str], ignore_paths: Sequence[str] = ()
+) -> List[Tuple[str, int]]:
+    """Destination files that none of the planned sources map to, relative to the destination, with sizes.
+
+    The planned sources are mapped to their destinations once, and compared
+    against the destination index in one set difference. Only the top-level
+    folders the plan copies into are considered, so other volumes and flat
+    AAF runs in the same destination are left alone. Files under the ignore
+    paths are left alone too, since the timelines may still use them.
+    """
+    expected = {os.path.normpath(str(src).split("/Volumes/", 1)[-1]) for src in src_paths}
+    tops = {rel.split("/", 1)[0] for rel in expected}
+    matcher = search.IgnoreMatcher(ignore_paths)
+    return [
+        (rel, size)
+        for rel, size in index.relative_files()
+        if rel not in expected and rel.split("/", 1)[0] in tops and "/" in rel and not is_archive_metadata(rel)
+        and not matcher.matches("/Volumes/" + rel)
+    ]
+
+
+def reclaimable_size(root: Path, candidates: Sequence[Tuple[str, int]]) -> int:
+    """Bytes deleting the candidates would free. Files with other hardlinks, like
+    those linked from a content store, free nothing."""
+    total = 0
+    for rel, size in candidates:
+        try:
+            if os.stat(root / rel).st_nlink == 1:
+                total += size
+        except OSError:
+            continue
+    return total
+
+
+def prune_files(
+    root: Path, candidates: Sequence[Tuple[str, int]], journal: Optional[CopyJournal] = None
+) -> int:
+    """Delete the given destination files and any folders left empty. Returns the bytes freed.
+
+    Files with other hardlinks are deleted but don't count, since their data
+    stays on disk. The deleted files are dropped from the fixity manifest and
+    the journal, so a later timeline that uses them again copies them again.
+    """
+    removed = 0
+    deleted = []
+    folders = set()
+    for rel, size in candidates:
+        path = root / rel
+        try:
+            links = path.stat().st_nlink
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            report(f"could not remove {path}: {e}")
+            continue
+        if links == 1:
+            removed += size
+        deleted.append(rel)
+        folders.add(path.parent)
+
+    fixity.FixityManifest(root / fixity.MANIFEST_NAME).remove(deleted)
+    if journal:
+        journal.forget(root / rel for rel in deleted)
+
+    # deepest first, so a folder's empty subfolders are gone before it's tried
+    for folder in sorted(folders, key=lambda folder: len(folder.parts), reverse=True):
+        while folder != root and root in folder.parents:
             try:
-                copy_file(src, dst, placeholder=placeholder)
-            except Exception as e:
-                with open("failed.log", "a") as f:
-                    f.write(f"failed to write from: {src}\n")
-                    f.write(f"failed to write from: {dst}\n")
-                    f.write(f"why: {e}\n\n")
+                folder.rmdir()
+            except OSError:
+                break
+            folder = folder.parent
+    return removed
+
+
+TIMELINE_SUFFIXES = (".xml", ".aaf")
+
+
+def timeline_paths(sources: Sequence[Path], source_dirs: Sequence[Path | str] = ()) -> List[Path]:
+    """Source timelines plus every XML and AAF directly inside the given folders."""
+    timelines = [Path(source) for source in sources]
+    for folder in source_dirs:
+        timelines.extend(
+            sorted(p for p in Path(folder).iterdir() if p.is_file() and p.suffix.lower() in TIMELINE_SUFFIXES)
+        )
+    # drop repeats but keep the order they were given in
+    return list(dict.fromkeys(timelines))
+
+
+def timeline_filepaths(
+    source: Path,
+    ignore_paths: Optional[List[str]] = None,
+    frame_ranges: bool = False,
+    handles: int = 0,
+    cache_path: Optional[Path] = None,
+    cache_entries: int = 50,
+    cache_bytes: int = 1024 * 1024 * 1024,
+) -> List[str]:
+    """Media paths used by one XML or AAF, excluding ignored paths.
+
+    With a cache path, the extracted paths are reused for as long as the
+    timeline is unchanged, and only the ignore filter is re-applied. For
+    frame ranges the clips are cached instead, and expanded to frames on
+    every run since that depends on which sequences are on disk.
+    """
+    if cache_path is None:
+        if source.suffix.lower() == ".aaf":
+            return search.filepaths_from_aaf(aaf_path=source, ignore_paths=ignore_paths)
+        return search.filepaths_from_xml(
+            xml_path=source,
+            ignore_paths=ignore_paths,
+            frame_ranges=frame_ranges,
+            handles=handles,
+        )
+
+    cache = TimelineCache(cache_path, max_entries=cache_entries, max_bytes=cache_bytes)
+    try:
+        if frame_ranges and source.suffix.lower() == ".xml":
+            clips = cache.paths(
+                source,
+                lambda: [encode_clip(clip) for clip in dict.fromkeys(search.iter_clip_media_from_xml(str(source)))],
+                "clips",
+            )
+            src_files = list(search.expand_frames(map(decode_clip, clips), handles=handles))
+        else:
+            src_files = cache.paths(source, lambda: search.extract_filepaths(str(source)))
+    finally:
+        cache.close()
+    return list(set(search.filter_ignored_paths(src_files, ignore_paths or [])))
+
+
+def plan_timelines(
+    sources: Sequence[Path],
+    ignore_paths: Optional[List[str]] = None,
+    frame_ranges: bool = False,
+    handles: int = 0,
+    processes: Optional[int] = None,
+    **cache_options,
+) -> Dict[Path, List[str]]:
+    """Parse every timeline, in parallel processes when there is more than one.
+
+    Extra keyword arguments are passed to timeline_filepaths to configure the cache.
+    """
+    if len(sources) == 1:
+        return {sources[0]: timeline_filepaths(sources[0], ignore_paths, frame_ranges, handles, **cache_options)}
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {
+            source: executor.submit(timeline_filepaths, source, ignore_paths, frame_ranges, handles, **cache_options)
+            for source in sources
+        }
+        return {source: future.result() for source, future in futures.items()}
+
+
+def print_timeline_summary(
+    timelines: Dict[Path, List[str]], stats: Dict[Path, SourceStat], uncopied: Set[Path]
+):
+    """Print file count, total size and size left to copy for each timeline."""
+    for source, src_files in timelines.items():
+        paths = {Path(src) for src in src_files}
+        total = sum(stats.get(path, MISSING).size for path in paths)
+        left = sum(stats.get(path, MISSING).size for path in paths if path in uncopied)
+        print(
+            f"{source.name}: {len(paths)} files, {convert_size(total)} total, "
+            f"{convert_size(left)} left to copy"
+        )
+
+
+def print_capacity(plan: CapacityPlan, destination: Path):
+    """Print what's left to copy per source volume and top-level folder, against the destination's free space."""
+    for title, groups in (("volume", plan.volumes), ("folder", plan.folders)):
+        print(f"By source {title}:")
+        for name, usage in sorted(groups.items(), key=lambda item: item[1].allocated, reverse=True):
+            print(f"  {name}: {usage.files} files, {convert_size(usage.bytes)}")
+    print(
+        f"Space needed on {destination}: {convert_size(plan.total.allocated)} in "
+        f"{convert_size(plan.block_size)} blocks"
+        + (f" plus {convert_size(plan.reserve)} reserved" if plan.reserve else "")
+        + f", {convert_size(plan.free)} free"
+    )
+
+
+def plan_space(
+    src_paths: Sequence[Path | str],
+    stats: Dict[Path, SourceStat],
+    destination: Path,
+    overflow: Sequence[Path] = (),
+    pack_threshold: int = 0,
+    reserve: int = 0,
+    store: Optional[ContentStore] = None,
+) -> Tuple[CapacityPlan, Optional[Dict[Path, List[Path]]]]:
+    """Checks the files left to copy fit on the destination, splitting them across overflow destinations if not.
+
+    Returns the plan for the destination and the files to copy to each
+    destination, or None for the files if they can't all fit.
+    """
+    # with a store, media it's known to hold already is linked for free
+    sizes = {}
+    for src in src_paths:
+        stat = stats.get(Path(src), MISSING)
+        sizes[Path(src)] = 0 if store and store.stored(Path(src), stat.size, stat.mtime) else stat.size
+    plan = plan_capacity(src_paths, sizes, destination, volume_name, top_folder, pack_threshold, reserve)
+    if plan.fits:
+        return plan, {destination: [Path(src) for src in src_paths]}
+    if not overflow:
+        return plan, None
+
+    destinations = [destination, *overflow]
+    spaces = [free_space(path) for path in destinations]
+    # size everything for the coarsest filesystem, so no destination is overfilled
+    block_size = max(block for _, block in spaces)
+    allocated = {}
+    for src in src_paths:
+        size = sizes.get(Path(src), 0)
+        allocated[Path(src)] = allocated_size(size, block_size, packed=size < pack_threshold)
+    available = [(path, free - reserve) for path, (free, _) in zip(destinations, spaces)]
+    return plan, split_across(src_paths, allocated, top_folder, available)
 
 
 def dir_path(string):
@@ -131,6 +873,39 @@ def dir_path(string):
         raise NotADirectoryError(export)
 
 
+def volume_limit(string) -> Tuple[str, int]:
+    # Parse a VOLUME=STREAMS pair
+    volume, sep, streams = string.rpartition("=")
+    if not sep or not volume or not streams.isdigit() or int(streams) < 1:
+        raise argparse.ArgumentTypeError(f"Expected VOLUME=STREAMS, got: {string}")
+    return volume, int(streams)
+
+
+def volume_bandwidth(string) -> Tuple[str, float]:
+    # Parse a VOLUME=MBPS pair, in bytes per second
+    volume, sep, rate = string.rpartition("=")
+    try:
+        if not sep or not volume:
+            raise ValueError
+        return volume, throttle.parse_rate(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected VOLUME=MBPS, got: {string}")
+
+
+def bandwidth_rule(string) -> throttle.ScheduleRule:
+    try:
+        return throttle.parse_schedule_rule(string)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def ignore_path(string):
+    # Glob patterns are matched later, plain paths must be existing directories
+    if search.GLOB_CHARS.search(string):
+        return string
+    return dir_path(string)
+
+
 def parse_arguments():
     # CLI interface
 
@@ -143,8 +918,17 @@ def parse_arguments():
         "-s",
         "--source",
         type=Path,
-        required=True,
-        help="XML or AAF file containing project that needs archiving.",
+        nargs="+",
+        default=[],
+        help="one or more XML or AAF files containing projects that need archiving.",
+    )
+
+    parser.add_argument(
+        "--source_dir",
+        type=dir_path,
+        nargs="*",
+        default=[],
+        help="folders of XML and AAF files to archive together with any --source files.",
     )
 
     parser.add_argument(
@@ -158,9 +942,9 @@ def parse_arguments():
     parser.add_argument(
         "-e",
         "--exclude_directories",
-        type=dir_path,
+        type=ignore_path,
         nargs="*",
-        help="paths to exclude from copy.",
+        help="paths to exclude from copy, glob patterns such as '/Volumes/Media/*/Camera Roll*' are allowed.",
     )
 
     parser.add_argument(
@@ -170,16 +954,272 @@ def parse_arguments():
         help="create destination structure with placeholder files instead of copying media.",
     )
 
+    parser.add_argument(
+        "--frame_ranges",
+        action="store_true",
+        help="XML only: archive just the image sequence frames used by the cut instead of whole sequences.",
+    )
+
+    parser.add_argument(
+        "--handles",
+        type=int,
+        default=0,
+        help="frames to keep either side of each cut when using --frame_ranges.",
+    )
+
+    parser.add_argument(
+        "--timeline_cache",
+        type=Path,
+        default=timeline_cache.DEFAULT_PATH,
+        help="cache of media paths extracted from each timeline, reused while the timeline is unchanged.",
+    )
+
+    parser.add_argument(
+        "--no_timeline_cache",
+        action="store_true",
+        help="always re-parse the timelines.",
+    )
+
+    parser.add_argument(
+        "--timeline_cache_entries",
+        type=int,
+        default=50,
+        help="maximum number of timelines kept in the cache.",
+    )
+
+    parser.add_argument(
+        "--timeline_cache_mb",
+        type=int,
+        default=1024,
+        help="maximum size of the timeline cache in MB.",
+    )
+
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="show a single live progress line with throughput and ETA instead of a line per file.",
+    )
+
+    parser.add_argument(
+        "--metrics_json",
+        type=Path,
+        help="write run metrics (phase times, throughput, ETA, recent files) to this JSON file.",
+    )
+
+    parser.add_argument(
+        "--metrics_prometheus",
+        type=Path,
+        help="write run metrics to this file in the Prometheus textfile collector format.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of files to copy at once (default 1). With --adaptive, the most it may go up to.",
+    )
+
+    parser.add_argument(
+        "--copy_order",
+        choices=COPY_ORDERS,
+        default="locality",
+        help="order to copy in: by volume, directory and inode (locality), by on-disk extent where FIEMAP "
+        "is available (extent), biggest files first for parallel copies (largest), or as found (none).",
+    )
+
+    parser.add_argument(
+        "--unattended",
+        action="store_true",
+        help="run without prompts: copy without asking, and only report what --prune would delete. "
+        "Exits 2 if any files failed, 3 if the destination ran out of space and 4 if the job won't fit.",
+    )
+
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="times to retry a file after a transient error such as EIO, ETIMEDOUT or ESTALE.",
+    )
+
+    parser.add_argument(
+        "--retry_delay",
+        type=float,
+        default=10.0,
+        help="seconds before the first retry, doubling for each one after.",
+    )
+
+    parser.add_argument(
+        "--failure_report",
+        type=Path,
+        default=Path("failure_report.json"),
+        help="JSON report of this run's failures, written when anything fails. "
+        "Every failure is also appended to failed.jsonl as it happens.",
+    )
+
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="after copying, list destination files the XML timelines no longer use and the space they take, "
+        "and offer to delete them.",
+    )
+
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="keep media in a content-addressed store at the destination root and build each archive from "
+        "hardlinks into it, so media that's already archived isn't copied or stored again.",
+    )
+
+    parser.add_argument(
+        "--pack_small_files",
+        type=float,
+        nargs="?",
+        const=packing.DEFAULT_THRESHOLD / 1024 / 1024,
+        default=0,
+        metavar="MB",
+        help="pack files smaller than this (default 1 MB) into tar archives, one set per source folder, "
+        "placed where the files would have been copied to.",
+    )
+
+    parser.add_argument(
+        "--pack_size",
+        type=float,
+        default=packing.DEFAULT_PACK_BYTES / 1024 / 1024 / 1024,
+        metavar="GB",
+        help="start a new tar once a pack reaches this size.",
+    )
+
+    parser.add_argument(
+        "--overflow_destinations",
+        type=Path,
+        nargs="+",
+        default=[],
+        help="more destinations to split the job across if it won't fit on --destination, "
+        "keeping top-level folders together where they fit.",
+    )
+
+    parser.add_argument(
+        "--reserve_gb",
+        type=float,
+        default=1.0,
+        help="free space to leave on each destination when checking the job fits (default 1 GB).",
+    )
+
+    parser.add_argument(
+        "--skip_space_check",
+        action="store_true",
+        help="start copying even if the job doesn't look like it will fit.",
+    )
+
+    parser.add_argument(
+        "--adaptive",
+        type=int,
+        nargs="?",
+        const=16,
+        default=0,
+        metavar="MAX",
+        help="tune the number of copies in flight to each destination mount from its measured throughput, "
+        "up to MAX (default 16). The level each mount settled on is printed and logged.",
+    )
+
+    parser.add_argument(
+        "--streams_per_volume",
+        type=int,
+        default=None,
+        help="maximum simultaneous copies reading from or writing to any one volume (default 2). With --adaptive, "
+        "destinations are only limited when this or --volume_limits is given.",
+    )
+
+    parser.add_argument(
+        "--volume_limits",
+        type=volume_limit,
+        nargs="*",
+        default=[],
+        help="per-volume stream limits as VOLUME=STREAMS, e.g. RAID1=4 NAS=1.",
+    )
+
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0,
+        help="overall copy bandwidth cap in MB/s, 0 for unlimited.",
+    )
+
+    parser.add_argument(
+        "--volume_bandwidth",
+        type=volume_bandwidth,
+        nargs="*",
+        default=[],
+        help="per source volume bandwidth caps as VOLUME=MBPS, e.g. EDIT_SAN=80.",
+    )
+
+    parser.add_argument(
+        "--bandwidth_schedule",
+        type=bandwidth_rule,
+        nargs="*",
+        default=[],
+        help="time of day caps as [VOLUME@]HH:MM-HH:MM=MBPS, e.g. 09:00-19:00=100 EDIT_SAN@09:00-19:00=40. "
+        "Windows may wrap past midnight, and 0 means unlimited.",
+    )
+
+    parser.add_argument(
+        "--bandwidth_control",
+        type=Path,
+        help="file of VOLUME=MBPS lines (* for the overall cap) that is re-read while copying, to change the caps mid-run.",
+    )
+
+    parser.add_argument(
+        "--journal",
+        type=Path,
+        default=Path("archive_journal.sqlite"),
+        help="SQLite journal used to resume interrupted jobs.",
+    )
+
+    parser.add_argument(
+        "--checksum",
+        nargs="?",
+        const=fixity.default_algorithm(),
+        choices=fixity.ALGORITHMS,
+        help="hash files while copying and write a fixity manifest (xxhash64 if installed, otherwise md5).",
+    )
+
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="after copying, re-hash the destination and compare against the fixity manifest.",
+    )
+
+    parser.add_argument(
+        "--buffer_size",
+        type=int,
+        default=fastcopy.BUFFER_SIZE // (1024 * 1024),
+        help="copy buffer size in MB, used for kernel copy chunks and the buffered fallback.",
+    )
+
     args = parser.parse_args()
 
-    if args.source.is_file() == False:
+    if not args.source and not args.source_dir:
+        parser.error("A source XML or AAF is required.")
+    elif any(source.is_file() == False for source in args.source):
         parser.error("The source must be a file.")
     elif args.destination.is_dir() == False:
         parser.error("The destination must be a directory.")
+    elif any(overflow.is_dir() == False for overflow in args.overflow_destinations):
+        parser.error("The overflow destinations must be directories.")
+    elif args.overflow_destinations and args.dedupe:
+        parser.error("--dedupe keeps media in one store, it can't be split with --overflow_destinations.")
+    elif args.checksum and not fixity.available(args.checksum):
+        parser.error(f"--checksum {args.checksum} needs the xxhash package, pip install xxhash or use md5 or sha1.")
     else:
         return parser.parse_args()
 
 
+EXIT_FAILURES = 2
+EXIT_PAUSED = 3
+EXIT_NO_SPACE = 4
+
+
 def ask_user_to_continue_or_exit(error: Exception):
     """Ask the user if they'd like to exit or continue."""
     while True:
@@ -194,79 +1234,274 @@ def ask_user_to_continue_or_exit(error: Exception):
 
 def get_file_size_with_retry(file_path: str, retries: int = 3, delay: float = 1.0) -> int:
     """Get file size with retries to handle potential file system latency."""
-    for attempt in range(retries):
-        try:
-            return os.path.getsize(file_path)
-        except FileNotFoundError as e:
-            if attempt < retries - 1:
-                time.sleep(delay)
-            else:
-                print (f"{e}")
-                return 0
-    
-    return 0  # Return 0 if all retries fail
+    return stat_with_retry(file_path, retries, delay).size
 
 def main():
+    # python archive_nle.py audit ROOT ... re-verifies an existing archive
+    if sys.argv[1:2] == ["audit"]:
+        sys.exit(audit.main(sys.argv[2:]))
+
     args = parse_arguments()
 
-    source = args.source
+    sources = timeline_paths(args.source, args.source_dir)
     destination = args.destination
     ignore_paths = args.exclude_directories
     placeholder = args.placeholder
+    # with adaptive streams, an explicit -j lowers the ceiling
+    jobs = min(args.jobs or args.adaptive, args.adaptive) if args.adaptive else args.jobs or 1
+    volume_limits = dict(args.volume_limits)
+    limiter = VolumeLimiter(default=args.streams_per_volume or 2, limits=volume_limits)
+    # the gate owns each destination's concurrency, kept inside any limit given for its volume
+    adaptive = AdaptiveScheduler(
+        maximum=jobs, cap=lambda dst: volume_limits.get(volume_name(dst), args.streams_per_volume)
+    ) if args.adaptive else None
+    metrics = Metrics(json_path=args.metrics_json, prometheus_path=args.metrics_prometheus)
+    store = ContentStore(destination) if args.dedupe and not placeholder else None
+    bandwidth = BandwidthLimiter(
+        rate=args.bandwidth * throttle.MB,
+        volume_rates=dict(args.volume_bandwidth),
+        schedule=args.bandwidth_schedule,
+        control_file=args.bandwidth_control,
+    )
 
-    source_paths_to_process = []
-    source_uncopied = []
-    flat = False
+    # one journal row per source file copied to this destination, shared by every timeline
+    job = f"{destination.resolve()}"
+    if placeholder:
+        job += " (placeholder)"
+    journal = CopyJournal(args.journal, job=job)
+    reset = journal.reset_interrupted()
+    if reset:
+        print(f"Restarting {reset} partially copied files from an interrupted run.")
 
-    if source.suffix == ".xml":
-        # source paths excluding ignored pathes
-        source_paths_to_process = search.filepaths_from_xml(
-            xml_path=source, ignore_paths=ignore_paths
+    # source paths excluding ignored pathes, per timeline
+    with metrics.phase("parse"):
+        timelines = plan_timelines(
+            sources,
+            ignore_paths=ignore_paths,
+            frame_ranges=args.frame_ranges,
+            handles=args.handles,
+            cache_path=None if args.no_timeline_cache else args.timeline_cache,
+            cache_entries=args.timeline_cache_entries,
+            cache_bytes=args.timeline_cache_mb * 1024 * 1024,
         )
 
+    # XMLs rebuild the folder structure, AAFs copy flat, so each kind is planned on its own
+    xml_paths = list(dict.fromkeys(
+        src for source, paths in timelines.items() if source.suffix.lower() == ".xml" for src in paths
+    ))
+    aaf_paths = list(dict.fromkeys(
+        src for source, paths in timelines.items() if source.suffix.lower() == ".aaf" for src in paths
+    ))
+    completed = journal.completed()
+
+    xml_uncopied = []
+    if xml_paths:
         # source paths of only files that need to be copied
-        source_uncopied = uncopied_files(
-            src_files=source_paths_to_process, dst_path=destination
-        )
+        with metrics.phase("diff"):
+            xml_uncopied = uncopied_files(
+                src_files=[src for src in xml_paths if str(Path(src)) not in completed],
+                dst_path=destination,
+            )
 
-    elif source.suffix == ".aaf":
-        # source paths excluding ignored pathes
-        source_paths_to_process = search.filepaths_from_aaf(
-            aaf_path=source, ignore_paths=ignore_paths
-        )
+    aaf_uncopied = []
+    if aaf_paths and store:
+        # each run gets a complete tree, media the store already holds is linked instead of copied
+        aaf_uncopied = list(dict.fromkeys(Path(src) for src in aaf_paths))
+    elif aaf_paths:
+        # the destination index only re-lists folders that changed since the last run
+        with metrics.phase("index"):
+            index = DestinationIndex(destination)
+            rescanned = index.refresh()
+        print(f"Destination index refreshed ({rescanned} folders re-scanned).")
 
-        source_uncopied = uncopiedfiles_directoryagnostic(
-            src_paths=source_paths_to_process, dst_path=destination
-        )
-        flat = True
+        with metrics.phase("diff"):
+            aaf_uncopied = uncopiedfiles_directoryagnostic(
+                src_paths=[src for src in aaf_paths if str(Path(src)) not in completed],
+                dst_path=destination,
+                index=index,
+            )
 
-    src_size_with_ignored = sum(
-        [get_file_size_with_retry(str(src_file), 1, 0) for src_file in source_paths_to_process]
-    )
+    source_uncopied = xml_uncopied + aaf_uncopied
+
+    # one concurrent stat pass, shared by the totals, the copy and the journal
+    with metrics.phase("stat"):
+        # offline clips are common in a timeline, so planning doesn't wait on them
+        stats = stat_sources(xml_paths + aaf_paths)
+
+    # read each source disk as sequentially as possible
+    with metrics.phase("schedule"):
+        xml_uncopied = order_copies(xml_uncopied, stats, args.copy_order)
+        aaf_uncopied = order_copies(aaf_uncopied, stats, args.copy_order)
+
+    if len(timelines) > 1:
+        print_timeline_summary(timelines, stats, set(source_uncopied))
+
+    src_size_with_ignored = sum(stat.size for stat in stats.values())
     print("Total Media (excluding ignored paths):", convert_size(src_size_with_ignored))
 
     # print(source_uncopied)
-    uncopied_size = sum([get_file_size_with_retry(str(src_file), 1, 0) for src_file in source_uncopied])
+    uncopied_size = sum(stats.get(Path(src_file), MISSING).size for src_file in source_uncopied)
 
     # get total size of source files but exclude what's already been copied.
     print("Media Left to Copy:", convert_size(uncopied_size))
 
-    ready = False
+    # check the job fits before anything is copied, splitting it across destinations if it has to be
+    split = {destination: [Path(src) for src in source_uncopied]}
+    if source_uncopied and not placeholder and not args.skip_space_check:
+        with metrics.phase("capacity"):
+            capacity, split = plan_space(
+                source_uncopied,
+                stats,
+                destination,
+                overflow=args.overflow_destinations,
+                pack_threshold=int(args.pack_small_files * 1024 * 1024),
+                reserve=int(args.reserve_gb * 1024 ** 3),
+                store=store,
+            )
+        print_capacity(capacity, destination)
+        if split is None:
+            if args.overflow_destinations:
+                print("Not enough space, the job doesn't fit even across the overflow destinations.")
+            else:
+                print(
+                    f"Not enough space, {convert_size(capacity.shortfall)} more is needed. Free up space, "
+                    "split the job with --overflow_destinations, or copy anyway with --skip_space_check."
+                )
+            sys.exit(EXIT_NO_SPACE)
+        if len(split) > 1:
+            print("The job doesn't fit on one destination, it will be split:")
+            for dst_path, files in split.items():
+                size = sum(stats.get(src, MISSING).size for src in files)
+                print(f"  {dst_path}: {len(files)} files, {convert_size(size)}")
+
+    # XML destinations are known once the split is, flat ones get a dated folder when the copy starts
+    xml_planned = {Path(src) for src in xml_uncopied}
+    planned = []
+    for dst_path, files in split.items():
+        for src in files:
+            dst = determine_destination(src, dst_path, False) if src in xml_planned else None
+            stat = stats.get(src, MISSING)
+            if stat.exists:
+                planned.append(PlannedFile(src, dst, stat.size, stat.mtime))
+            else:
+                planned.append(PlannedFile(src, dst))
+    journal.plan(planned)
+
+    metrics.begin_copy(uncopied_size, len(source_uncopied))
+    metrics.export()
+
+    ready = args.unattended
     while ready == False:
         name = input("Okay to proceed? Y / N: ")
         if name.lower() == "y":
-            copy_files_shutil(
-                src_paths=source_uncopied,
-                dst_path=destination,
-                flat=flat,
-                placeholder=placeholder,
-            )
             ready = True
         elif name.lower() == "n":
             exit()
 
-    # TODO add a section that goes back over and compares the source file against the destination file to make sure they are the same size.  If they are not, then it will copy the file again.  This will be useful for when the copy fails for some reason.
-    # TODO add a section that goes back over and compares the source file against the destination files and allows the user to choose if they want to remove files on the destination not present in the source file, this is for storage purposes only.
+    # each archive root with the files written into it this run, so only those are verified
+    archive_roots: List[Tuple[Path, List[Path]]] = []
+    not_started: List[Path] = []
+    paused = False
+    parts = []
+    for dst_path, files in split.items():
+        assigned = set(files)
+        parts.append(([src for src in xml_uncopied if Path(src) in assigned], False, dst_path))
+        parts.append(([src for src in aaf_uncopied if Path(src) in assigned], True, dst_path))
+    for uncopied, flat, dst_path in parts:
+        if paused:
+            not_started.extend(Path(src) for src in uncopied)
+        if not uncopied or paused:
+            continue
+        written: List[Path] = []
+        with metrics.phase("copy"):
+            try:
+                archive_root = copy_files_shutil(
+                    src_paths=uncopied,
+                    dst_path=dst_path,
+                    flat=flat,
+                    placeholder=placeholder,
+                    jobs=jobs,
+                    limiter=limiter,
+                    journal=journal,
+                    checksum=args.checksum,
+                    stats=stats,
+                    buffer_size=args.buffer_size * 1024 * 1024,
+                    metrics=metrics,
+                    verbose=not args.progress,
+                    bandwidth=bandwidth,
+                    pack_threshold=int(args.pack_small_files * 1024 * 1024),
+                    pack_bytes=int(args.pack_size * 1024 * 1024 * 1024),
+                    store=store,
+                    retries=args.retries,
+                    retry_delay=args.retry_delay,
+                    adaptive=adaptive,
+                    written=written,
+                )
+                archive_roots.append((archive_root, written))
+            except JobPaused as e:
+                archive_roots.append((e.archive_root, written))
+                not_started.extend(e.remaining)
+                paused = True
+
+    if args.verify:
+        mismatched = []
+        with metrics.phase("verify"):
+            for archive_root, written in archive_roots:
+                mismatched.extend(verify_archive(archive_root, journal=journal, written=written))
+        if mismatched:
+            print(f"{len(mismatched)} files failed verification and were removed, run again to recopy them.")
+        else:
+            print("All checksums verified.")
+
+    # remove destination files the timelines no longer use, for storage purposes only
+    if args.prune and not xml_paths:
+        print("Nothing to prune, AAF media is archived flat so it can't be matched back to a timeline.")
+    elif args.prune:
+        with metrics.phase("prune"):
+            prune_index = DestinationIndex(destination)
+            prune_index.refresh()
+            candidates = prune_candidates(prune_index, xml_paths, ignore_paths or [])
+            prune_index.close()
+            reclaimable = reclaimable_size(destination, candidates)
+        shared = sum(size for _, size in candidates) - reclaimable
+        print(f"{len(candidates)} destination files are not in the timelines, {convert_size(reclaimable)} reclaimable.")
+        if shared:
+            holder = "the content store" if store else "other hardlinks"
+            print(f"  {convert_size(shared)} more stays on disk, {holder} still holds it.")
+        for rel, _ in candidates[:20]:
+            print(f"  {rel}")
+        if len(candidates) > 20:
+            print(f"  ... and {len(candidates) - 20} more")
+        # deleting always needs someone to confirm it, so unattended runs only report
+        if args.unattended and candidates:
+            print("Unattended run, nothing was deleted.")
+        elif candidates and input("Delete them? Y / N: ").lower() == "y":
+            with metrics.phase("prune"):
+                removed = prune_files(destination, candidates, journal=journal)
+            print(f"Pruned {convert_size(removed)}.")
+
+    counts = failure_report.counts()
+    if counts or paused:
+        failure_report.write(args.failure_report, paused=paused, remaining=len(not_started))
+        print(
+            "Failures:",
+            ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items())) or "none",
+            f"(report written to {args.failure_report})",
+        )
+    if paused:
+        print(
+            f"Paused, the destination is out of space. {len(not_started)} files were not started, "
+            "free up space and run again to resume."
+        )
+
+    print("Phase times:", ", ".join(f"{name} {seconds:.1f}s" for name, seconds in metrics.phases.items()))
+    metrics.export()
+
+    # let schedulers tell a clean run from one that needs attention
+    if paused:
+        sys.exit(EXIT_PAUSED)
+    if counts:
+        sys.exit(EXIT_FAILURES)
 
 
 if __name__ == "__main__":
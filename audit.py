@@ -0,0 +1,250 @@
+"""Re-verify an archive against its fixity manifests, a slice at a time.
+
+    python archive_nle.py audit /Volumes/Archive --max_age 90 --budget_gb 20000
+
+Every file recorded in a fixity.csv or a pack index below the archive is
+re-hashed in a process pool. The time each file was last verified is kept in the archive,
+so nightly runs can work through the files that are due, oldest first.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+from destination_index import DestinationIndex
+import fixity
+import packing
+
+AUDIT_NAME = ".archive_nle_audit.sqlite"
+DAY = 24 * 60 * 60
+
+
+class AuditLog:
+    """When each archived file was last verified, and whether it passed.
+
+    Lives in the archive root, with paths relative to it, so the record
+    moves with the archive.
+    """
+
+    def __init__(self, root: Path, db_path: Optional[Path] = None):
+        self.root = Path(root)
+        self.db_path = Path(db_path) if db_path else self.root / AUDIT_NAME
+        self._conn = sqlite3.connect(str(self.db_path))
+        # keep the rollback journal in place so auditing doesn't change the root's mtime
+        self._conn.execute("PRAGMA journal_mode=PERSIST")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS verified (
+                path TEXT PRIMARY KEY,
+                verified REAL NOT NULL,
+                ok INTEGER NOT NULL,
+                error TEXT
+            )"""
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def last_verified(self) -> Dict[str, float]:
+        """When each path last passed. Files that failed count as never verified."""
+        return {
+            path: verified
+            for path, verified in self._conn.execute("SELECT path, verified FROM verified WHERE ok=1")
+        }
+
+    def record(self, results: Iterable[Tuple[str, Optional[str]]], when: Optional[float] = None):
+        when = time.time() if when is None else when
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO verified (path, verified, ok, error) VALUES (?, ?, ?, ?)",
+            [(path, when, error is None, error) for path, error in results],
+        )
+        self._conn.commit()
+
+    def failures(self) -> Dict[str, str]:
+        return dict(self._conn.execute("SELECT path, error FROM verified WHERE ok=0"))
+
+
+def manifest_entries(root: Path) -> Dict[str, dict]:
+    """Every file in the fixity manifests and pack indexes below root, keyed by its path relative to root.
+
+    Packed files are keyed as if the pack were a folder, and their rows
+    carry the pack's path. The manifests are found through the destination
+    index, so only folders that changed since the last run are listed again.
+    """
+    root = Path(root)
+    index = DestinationIndex(root)
+    try:
+        index.refresh()
+        manifests = list(index.named(fixity.MANIFEST_NAME))
+        pack_indexes = [root / rel for rel, _ in index.relative_files() if packing.is_pack_index(os.path.basename(rel))]
+    finally:
+        index.close()
+
+    entries = {}
+    for manifest_path in sorted(manifests):
+        manifest = fixity.FixityManifest(manifest_path)
+        for rel_path, row in manifest.entries().items():
+            entries[os.path.normpath(os.path.relpath(manifest.root / rel_path, root))] = row
+    for pack_index in sorted(pack_indexes):
+        pack = pack_index.with_name(pack_index.name.removesuffix(packing.INDEX_SUFFIX))
+        rel_pack = os.path.relpath(pack, root)
+        for row in packing.read_index(pack_index):
+            # files packed without a checksum have nothing to check against
+            if row["hash"]:
+                entries[f"{rel_pack}/{row['name']}"] = dict(row, pack=str(pack))
+    return entries
+
+
+def select_files(
+    entries: Dict[str, dict],
+    last_verified: Dict[str, float],
+    max_age_days: float = 0,
+    sample: float = 0,
+    budget_bytes: Optional[int] = None,
+    now: Optional[float] = None,
+    rng: Optional[random.Random] = None,
+) -> List[str]:
+    """Choose the files to verify this run.
+
+    Files not verified in the last `max_age_days` are due, oldest (or never
+    verified) first. A `sample` percentage of the rest is added at random,
+    to catch rot early. `budget_bytes` stops the list once that much data
+    would be read, always keeping at least one file so a rolling audit
+    always moves forward.
+    """
+    now = time.time() if now is None else now
+    rng = rng or random.Random()
+    cutoff = now - max_age_days * DAY
+
+    due = sorted(
+        (path for path in entries if last_verified.get(path, 0.0) <= cutoff),
+        key=lambda path: (last_verified.get(path, 0.0), path),
+    )
+    rest = sorted(path for path in entries if last_verified.get(path, 0.0) > cutoff)
+    sampled = rng.sample(rest, round(len(rest) * sample / 100)) if sample else []
+
+    selected = []
+    total = 0
+    for path in due + sampled:
+        size = int(entries[path]["size"])
+        if budget_bytes is not None and selected and total + size > budget_bytes:
+            break
+        selected.append(path)
+        total += size
+    return selected
+
+
+def _check(job: Tuple[str, str, int, str, str, Optional[str]]) -> Tuple[str, Optional[str]]:
+    # runs in the worker processes, packed files are read from their pack at the offset
+    rel_path, path, size, algorithm, digest, offset = job
+    if offset is not None:
+        row = {"offset": offset, "size": size, "algorithm": algorithm, "hash": digest}
+        return rel_path, packing.check_packed(Path(path), row)
+    return rel_path, fixity.check_file(Path(path), size, algorithm, digest)
+
+
+def audit(
+    root: Path,
+    max_age_days: float = 0,
+    sample: float = 0,
+    budget_bytes: Optional[int] = None,
+    processes: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> Tuple[List[str], Dict[str, str]]:
+    """Re-hash the selected files and record the results.
+
+    Returns the paths that were checked and the failures among them, with
+    the reason each failed.
+    """
+    root = Path(root)
+    entries = manifest_entries(root)
+    log = AuditLog(root)
+    try:
+        selected = select_files(
+            entries, log.last_verified(), max_age_days, sample, budget_bytes, rng=random.Random(seed)
+        )
+        jobs = [
+            (
+                path,
+                entries[path].get("pack") or str(root / path),
+                int(entries[path]["size"]),
+                entries[path]["algorithm"],
+                entries[path]["hash"],
+                entries[path].get("offset"),
+            )
+            for path in selected
+        ]
+        failed: Dict[str, str] = {}
+        results = []
+        # small files are handed out in batches so the pool isn't busy with overhead
+        chunksize = max(1, len(jobs) // (8 * (processes or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for rel_path, error in executor.map(_check, jobs, chunksize=chunksize):
+                results.append((rel_path, error))
+                if error:
+                    failed[rel_path] = error
+                # save progress as it goes, so an interrupted audit isn't wasted
+                if len(results) >= 1000:
+                    log.record(results)
+                    results = []
+        log.record(results)
+    finally:
+        log.close()
+    return selected, failed
+
+
+def parse_arguments(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="archive_nle.py audit",
+        description="Re-verify an archive against its fixity manifests.",
+    )
+    parser.add_argument("root", type=Path, help="archive root to audit.")
+    parser.add_argument(
+        "--max_age",
+        type=float,
+        default=0,
+        help="only re-hash files not verified in this many days (default 0, everything).",
+    )
+    parser.add_argument(
+        "--sample",
+        type=float,
+        default=0,
+        help="also re-hash this percentage of the files that aren't due yet, chosen at random.",
+    )
+    parser.add_argument(
+        "--budget_gb",
+        type=float,
+        default=None,
+        help="stop after this many GB have been selected, oldest first, for rolling nightly audits.",
+    )
+    parser.add_argument("-j", "--processes", type=int, default=None, help="hashing processes (default one per CPU).")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for --sample.")
+    args = parser.parse_args(argv)
+    if not args.root.is_dir():
+        parser.error("The archive root must be a directory.")
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_arguments(argv)
+    started = time.perf_counter()
+    checked, failed = audit(
+        args.root,
+        max_age_days=args.max_age,
+        sample=args.sample,
+        budget_bytes=int(args.budget_gb * 1024 ** 3) if args.budget_gb is not None else None,
+        processes=args.processes,
+        seed=args.seed,
+    )
+    for path, error in sorted(failed.items()):
+        print(f"FAILED {path}: {error}")
+    print(f"Audited {len(checked)} files in {time.perf_counter() - started:.1f}s, {len(failed)} failed.")
+    return 2 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+"""Synthetic Premiere XMLs and media trees for benchmarking."""
+from typing import List
+from pathlib import Path
+from urllib.parse import quote
+
+
+def make_media_tree(root: Path, files: int, dirs: int, file_size: int = 0, extension: str = "mov") -> List[Path]:
+    """Create `files` sparse media files spread over `dirs` folders under root.
+
+    Files are truncated to `file_size` rather than written, so large trees
+    cost almost no disk space.
+    """
+    paths = []
+    for i in range(files):
+        folder = root / f"Day{(i % dirs) // 100:03d}" / f"Roll{i % dirs:05d}"
+        paths.append(folder / f"A{i:07d}_clip.{extension}")
+
+    for folder in {path.parent for path in paths}:
+        folder.mkdir(parents=True, exist_ok=True)
+    for path in paths:
+        with open(path, "wb") as f:
+            f.truncate(file_size)
+    return paths
+
+
+def pathurl(path: Path | str) -> str:
+    return "file://localhost" + quote(str(path))
+
+
+def write_premiere_xml(
+    xml_path: Path,
+    media: List[Path | str],
+    clips: int,
+    nesting: int = 0,
+    malformed: bool = False,
+    filter_blocks: int = 2,
+):
+    """Write a Premiere-style XML with `clips` clipitems cycling through `media`.
+
+    Each file is defined the first time it is used and referenced by id after
+    that, as Premiere does. `nesting` wraps every clipitem in that many nested
+    sequence clipitems, `filter_blocks` pads each clip with effect filters,
+    and `malformed` leaves an unclosed tag so the fallback scanner is used.
+    """
+    filters = (
+        "<filter><effect><name>Basic Motion</name><parameter><value>100</value></parameter>"
+        "<appspecificdata><appname>Final Cut Pro</appname><data>" + "0" * 64 + "</data></appspecificdata>"
+        "</effect></filter>"
+    ) * filter_blocks
+
+    with open(xml_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE xmeml>\n<xmeml version="4">\n')
+        f.write("<sequence id=\"sequence-1\"><name>BENCH</name><media><video><track>\n")
+        defined = set()
+        for i in range(clips):
+            index = i % len(media)
+            if index in defined:
+                file_element = f'<file id="file-{index}"/>'
+            else:
+                defined.add(index)
+                file_element = (
+                    f'<file id="file-{index}"><name>{Path(media[index]).name}</name>'
+                    f"<pathurl>{pathurl(media[index])}</pathurl><duration>240</duration></file>"
+                )
+            clip = (
+                f'<clipitem id="clipitem-{i}"><name>clip {i}</name><duration>240</duration>'
+                f"<start>{i * 24}</start><end>{i * 24 + 24}</end><in>0</in><out>24</out>"
+                f"{file_element}{filters}</clipitem>"
+            )
+            for depth in range(nesting):
+                clip = (
+                    f'<clipitem id="nest-{i}-{depth}"><sequence id="nest-seq-{i}-{depth}">'
+                    f"<media><video><track>{clip}</track></video></media></sequence></clipitem>"
+                )
+            f.write(clip + "\n")
+        f.write("</track></video></media></sequence>\n")
+        f.write("<broken>\n" if malformed else "</xmeml>\n")
+
+
+def fill_destination(src_paths: List[Path], dst_root: Path, fraction: float) -> int:
+    """Pre-copy (as empty files) a fraction of the sources into the destination layout."""
+    count = int(len(src_paths) * fraction)
+    for src in src_paths[:count]:
+        dst = dst_root / str(src).split("/Volumes/", 1)[-1]
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.touch()
+    return count
@@ -0,0 +1,129 @@
+"""Compare the mmap malformed-XML scanner against the original line-based one.
+
+    python -m benchmarks.malformed_xml --clips 200000
+"""
+from typing import List
+from pathlib import Path
+import argparse
+import tempfile
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import search
+
+
+def legacy_pathurls_from_malformed_xml(xml_path: str) -> List[str]:
+    """The original text-mode, line-by-line scanner, kept as the baseline."""
+    start_tag = "<pathurl>"
+    end_tag = "</pathurl>"
+
+    extracted_paths = []
+    collecting = False
+    current_value = ""
+
+    with open(xml_path, "r", encoding="utf-8", errors="ignore") as xml_file:
+        for line in xml_file:
+            cursor = 0
+
+            while cursor < len(line):
+                if collecting:
+                    end_index = line.find(end_tag, cursor)
+                    if end_index == -1:
+                        current_value += line[cursor:]
+                        break
+
+                    current_value += line[cursor:end_index]
+                    value = current_value.strip()
+                    if value:
+                        extracted_paths.append(search.unquoted_path_from_url(value))
+
+                    current_value = ""
+                    collecting = False
+                    cursor = end_index + len(end_tag)
+                    continue
+
+                start_index = line.find(start_tag, cursor)
+                if start_index == -1:
+                    break
+
+                value_start = start_index + len(start_tag)
+                end_index = line.find(end_tag, value_start)
+
+                if end_index == -1:
+                    collecting = True
+                    current_value = line[value_start:]
+                    break
+
+                value = line[value_start:end_index].strip()
+                if value:
+                    extracted_paths.append(search.unquoted_path_from_url(value))
+
+                cursor = end_index + len(end_tag)
+
+    return extracted_paths
+
+
+def write_malformed_xml(path: Path, clips: int, single_line: bool = False):
+    """A broken export with `clips` pathurls and a filter block of padding around each."""
+    separator = "" if single_line else "\n"
+    padding = "<filter><effect><parameter><value>0</value></parameter></effect></filter>" * 4
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>{separator}<xmeml>{separator}')
+        for i in range(clips):
+            f.write(
+                f"<clipitem><file><pathurl>file://localhost/Volumes/Media/Day{i % 40:02d}/"
+                f"A{i:06d}%20clip.mov</pathurl></file>{padding}</clipitem>{separator}"
+            )
+        f.write("<broken>")
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(function, *args) -> float:
+    """Peak Python allocation while running function, in MB."""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clips", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for single_line in (False, True):
+            xml_path = Path(folder) / "malformed.xml"
+            write_malformed_xml(xml_path, args.clips, single_line=single_line)
+            size_mb = xml_path.stat().st_size / 1024 / 1024
+
+            legacy, legacy_time = timed(legacy_pathurls_from_malformed_xml, str(xml_path))
+            current, current_time = timed(search.extract_pathurls_from_malformed_xml, str(xml_path))
+            assert current == legacy, "scanners disagree"
+            legacy_peak = peak_memory(legacy_pathurls_from_malformed_xml, str(xml_path))
+            current_peak = peak_memory(search.extract_pathurls_from_malformed_xml, str(xml_path))
+
+            # the same again without URL decoding, which otherwise dominates both
+            with patch("search.unquoted_path_from_url", lambda url: url):
+                _, legacy_scan = timed(legacy_pathurls_from_malformed_xml, str(xml_path))
+                _, current_scan = timed(search.extract_pathurls_from_malformed_xml, str(xml_path))
+
+            layout = "single line" if single_line else "multi line"
+            print(
+                f"{layout:12} {size_mb:8.1f} MB  legacy {legacy_time:7.3f}s {legacy_peak:7.1f} MB peak  "
+                f"mmap {current_time:7.3f}s {current_peak:7.1f} MB peak  "
+                f"speedup {legacy_time / current_time:5.1f}x  "
+                f"scan only {legacy_scan:6.3f}s vs {current_scan:6.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Time each phase of an archive run against synthetic timelines and media.
+
+    python -m benchmarks.run --clips 100000 --files 20000 --dirs 500
+
+Every run appends a record to the results file, and is compared with the
+last record that used the same parameters so regressions show up between
+versions.
+"""
+from typing import Dict
+from pathlib import Path
+from contextlib import redirect_stdout
+from datetime import datetime
+import argparse
+import io
+import json
+import platform
+import subprocess
+import tempfile
+import time
+
+import archive_nle
+from destination_index import DestinationIndex
+import search
+from benchmarks import generators
+
+DEFAULT_RESULTS = Path(__file__).parent / "results.jsonl"
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_phases(args, work: Path) -> Dict[str, float]:
+    phases: Dict[str, float] = {}
+
+    def timed(name, function, *function_args, **kwargs):
+        start = time.perf_counter()
+        result = function(*function_args, **kwargs)
+        phases[name] = round(time.perf_counter() - start, 4)
+        return result
+
+    # media lives under a "Volumes" folder so destination_path maps it like a real volume
+    media_root = work / "Volumes" / "BenchMedia"
+    media = timed("generate_media", generators.make_media_tree, media_root, args.files, args.dirs, args.file_size)
+
+    xml_path = work / "bench.xml"
+    timed(
+        "generate_xml", generators.write_premiere_xml, xml_path, media, args.clips,
+        nesting=args.nesting, malformed=args.malformed,
+    )
+
+    # unquoted_path_from_url prefixes /Volumes to paths outside it, which the
+    # temporary media root is, so strip that back off outside the timed phase
+    parsed = timed("parse", search.extract_filepaths, str(xml_path))
+    paths = [path[len("/Volumes"):] if path.startswith("/Volumes" + str(work)) else path for path in parsed]
+
+    # always leave at least one roll unignored, so there's something to plan
+    ignored = min(args.ignore_paths, args.dirs - 1)
+    rolls = list(range(0, args.dirs, max(1, args.dirs // max(1, ignored))))[:ignored]
+    ignore_paths = [str(media_root / f"Day{roll // 100:03d}" / f"Roll{roll:05d}") for roll in rolls]
+    kept = timed("filter", search.filter_ignored_paths, paths, ignore_paths)
+
+    dst_root = work / "destination"
+    dst_root.mkdir()
+    generators.fill_destination([Path(path) for path in kept], dst_root, args.copied_fraction)
+    uncopied = timed("uncopied", archive_nle.uncopied_files, kept, dst_root)
+
+    stats = timed("sizing", archive_nle.stat_sources, kept)
+
+    # drop a tenth of the plan so the pre-filled destination has something to prune
+    index = DestinationIndex(dst_root)
+    timed("index", index.refresh)
+    timed("prune_diff", archive_nle.prune_candidates, index, kept[len(kept) // 10:])
+    index.close()
+
+    to_copy = uncopied[:args.copy_files]
+    # flat mode, since hierarchical copies need sources that really are under /Volumes
+    with redirect_stdout(io.StringIO()):
+        timed(
+            "copy", archive_nle.copy_files_shutil, to_copy, work / "copied",
+            flat=True, jobs=args.jobs, stats=stats,
+        )
+    return phases
+
+
+def compare(record: dict, results_path: Path):
+    """Print each phase against the last run with the same parameters."""
+    previous = None
+    if results_path.exists():
+        for line in results_path.read_text().splitlines():
+            past = json.loads(line)
+            if past["params"] == record["params"]:
+                previous = past
+
+    for phase, seconds in record["phases"].items():
+        line = f"{phase:16} {seconds:9.3f}s"
+        if previous and phase in previous["phases"] and previous["phases"][phase]:
+            before = previous["phases"][phase]
+            line += f"   was {before:9.3f}s ({(seconds - before) / before * 100:+6.1f}%) at {previous['commit']}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clips", type=int, default=10000, help="clipitems in the XML (10k to 1M).")
+    parser.add_argument("--nesting", type=int, default=0, help="nested sequence depth around each clip.")
+    parser.add_argument("--malformed", action="store_true", help="leave the XML unclosed to time the fallback scanner.")
+    parser.add_argument("--files", type=int, default=5000, help="unique media files.")
+    parser.add_argument("--dirs", type=int, default=200, help="folders the media is spread over.")
+    parser.add_argument("--file_size", type=int, default=1024 * 1024, help="size of each sparse media file in bytes.")
+    parser.add_argument("--ignore_paths", type=int, default=20, help="number of ignore paths to filter with.")
+    parser.add_argument("--copied_fraction", type=float, default=0.5, help="share of media already in the destination.")
+    parser.add_argument("--copy_files", type=int, default=200, help="number of files to actually copy.")
+    parser.add_argument("--jobs", type=int, default=4, help="parallel copies.")
+    parser.add_argument("--work_dir", type=Path, default=None, help="where to build the trees, a temp folder by default.")
+    parser.add_argument("--results", type=Path, default=DEFAULT_RESULTS, help="JSON lines file the results are appended to.")
+    args = parser.parse_args()
+
+    params = {
+        key: value for key, value in vars(args).items() if key not in ("work_dir", "results")
+    }
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work:
+        phases = run_phases(args, Path(work))
+
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "phases": phases,
+    }
+    compare(record, args.results)
+    with open(args.results, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from pathlib import Path
+import os
+import tarfile
+
+
+class Usage(NamedTuple):
+    """Bytes, bytes once rounded up to whole blocks on the destination, and file count."""
+    bytes: int = 0
+    allocated: int = 0
+    files: int = 0
+
+    def add(self, size: int, allocated: int) -> "Usage":
+        return Usage(self.bytes + size, self.allocated + allocated, self.files + 1)
+
+
+class CapacityPlan(NamedTuple):
+    """What a copy needs from its destination, broken down by source volume and top-level folder."""
+    volumes: Dict[str, Usage]
+    folders: Dict[str, Usage]
+    total: Usage
+    free: int
+    block_size: int
+    reserve: int = 0
+
+    @property
+    def needed(self) -> int:
+        return self.total.allocated + self.reserve
+
+    @property
+    def fits(self) -> bool:
+        return self.needed <= self.free
+
+    @property
+    def shortfall(self) -> int:
+        return max(0, self.needed - self.free)
+
+
+def allocated_size(size: int, block_size: int, packed: bool = False) -> int:
+    """Space a file takes on disk, rounded up to whole blocks.
+
+    Packed files are rounded to tar blocks instead, plus their member header.
+    """
+    if packed:
+        return tarfile.BLOCKSIZE + -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+    return -(-size // block_size) * block_size
+
+
+def free_space(path: Path) -> Tuple[int, int]:
+    """Bytes free to an unprivileged user at path, and the filesystem's allocation unit."""
+    stat = os.statvfs(path)
+    block_size = stat.f_frsize or stat.f_bsize
+    return stat.f_bavail * block_size, block_size
+
+
+def plan_capacity(
+    src_paths: Sequence[Path | str],
+    sizes: Dict[Path, int],
+    destination: Path,
+    volume_of: Callable[[Path], str],
+    folder_of: Callable[[Path], str],
+    pack_threshold: int = 0,
+    reserve: int = 0,
+) -> CapacityPlan:
+    """Total up what copying src_paths to destination will take, from sizes already gathered."""
+    free, block_size = free_space(destination)
+    volumes: Dict[str, Usage] = {}
+    folders: Dict[str, Usage] = {}
+    total = Usage()
+    for src in src_paths:
+        src = Path(src)
+        size = sizes.get(src, 0)
+        allocated = allocated_size(size, block_size, packed=size < pack_threshold)
+        volume, folder = volume_of(src), folder_of(src)
+        volumes[volume] = volumes.get(volume, Usage()).add(size, allocated)
+        folders[folder] = folders.get(folder, Usage()).add(size, allocated)
+        total = total.add(size, allocated)
+    return CapacityPlan(volumes, folders, total, free, block_size, reserve)
+
+
+def split_across(
+    src_paths: Sequence[Path | str],
+    allocated: Dict[Path, int],
+    folder_of: Callable[[Path], str],
+    destinations: Sequence[Tuple[Path, int]],
+) -> Optional[Dict[Path, List[Path]]]:
+    """Share files between destinations with (path, bytes available) each.
+
+    Top-level folders are kept together where they fit, biggest first, each
+    going to the first destination with room. A folder too big for any one
+    destination is split file by file. Returns None if something doesn't fit
+    anywhere.
+    """
+    folders: Dict[str, List[Path]] = {}
+    for src in src_paths:
+        folders.setdefault(folder_of(Path(src)), []).append(Path(src))
+
+    room = {path: available for path, available in destinations}
+    split: Dict[Path, List[Path]] = {path: [] for path, _ in destinations}
+
+    def place(files: List[Path]) -> bool:
+        needed = sum(allocated.get(src, 0) for src in files)
+        for path, _ in destinations:
+            if needed <= room[path]:
+                room[path] -= needed
+                split[path].extend(files)
+                return True
+        return False
+
+    by_size = sorted(folders.values(), key=lambda files: sum(allocated.get(src, 0) for src in files), reverse=True)
+    for files in by_size:
+        if place(files):
+            continue
+        for src in sorted(files, key=lambda src: allocated.get(src, 0), reverse=True):
+            if not place([src]):
+                return None
+    return split
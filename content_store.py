@@ -0,0 +1,175 @@
+from typing import Callable, NamedTuple, Optional, Set
+from pathlib import Path
+import errno
+import os
+import sqlite3
+import threading
+import uuid
+
+import fastcopy
+import fixity
+
+STORE_NAME = ".archive_nle_store"
+
+# errors that mean the object can't be linked from here and has to be copied
+UNLINKABLE = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+class StoredFile(NamedTuple):
+    """How a file was placed: "linked" to an existing object or "stored" as a new one,
+    and how its tree entry points at the object."""
+    strategy: str
+    digest: str
+    link: str
+
+
+class ContentStore:
+    """Content-addressed store of media under the destination root.
+
+    Each object is named by its size and hash, and every archive tree is
+    made of hardlinks (or reflinks) into the store, so media that's already
+    archived costs no space and no copy time. Sources are only hashed when
+    the store already holds an object of the same size; anything else is
+    copied straight in, hashed on the way. Source hashes are remembered
+    against their size and mtime, so unchanged media isn't read again.
+    """
+
+    def __init__(self, root: Path, algorithm: Optional[str] = None):
+        self.path = Path(root) / STORE_NAME
+        self.objects = self.path / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # anything still incoming was left by an interrupted run
+        for temp in self.path.glob("incoming-*"):
+            temp.unlink(missing_ok=True)
+
+        self._conn = sqlite3.connect(str(self.path / "store.sqlite"), check_same_thread=False)
+        # keep the journal file in place so it doesn't touch the folder's mtime
+        self._conn.execute("PRAGMA journal_mode=PERSIST")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS objects (
+                size INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (size, digest)
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL
+            )"""
+        )
+        # the hash is fixed when the store is created, mixing algorithms would break matching
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('algorithm', ?)",
+            (algorithm or fixity.default_algorithm(),),
+        )
+        self._conn.commit()
+        self.algorithm = self._conn.execute("SELECT value FROM meta WHERE key='algorithm'").fetchone()[0]
+        if algorithm and algorithm != self.algorithm:
+            raise ValueError(f"The store at {self.path} uses {self.algorithm}, not {algorithm}")
+        self.sizes: Set[int] = {size for (size,) in self._conn.execute("SELECT DISTINCT size FROM objects")}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def object_path(self, size: int, digest: str) -> Path:
+        return self.objects / digest[:2] / f"{digest}-{size}"
+
+    def has(self, size: int, digest: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM objects WHERE size=? AND digest=?", (size, digest)).fetchone()
+        return row is not None and self.object_path(size, digest).exists()
+
+    def stored(self, src: Path, size: int, mtime: float) -> bool:
+        """True if an earlier run already put this exact source in the store.
+
+        Only the digest remembered against the source's size and mtime is
+        used, nothing is hashed, so a source the store hasn't seen counts as
+        not stored even if identical media is.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT sources.mtime_ns FROM sources JOIN objects
+                   ON objects.size = sources.size AND objects.digest = sources.digest
+                   WHERE sources.path=? AND sources.size=?""",
+                (str(src), size),
+            ).fetchone()
+        # stats hold the mtime as float seconds, which can't keep every nanosecond
+        return row is not None and abs(row[0] / 1e9 - mtime) < 1e-6
+
+    def _add(self, size: int, digest: str):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO objects (size, digest) VALUES (?, ?)", (size, digest))
+            self._conn.commit()
+            self.sizes.add(size)
+
+    def _remember(self, src: Path, stat: os.stat_result, digest: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                (str(src), stat.st_size, stat.st_mtime_ns, digest),
+            )
+            self._conn.commit()
+
+    def source_digest(self, src: Path, stat: os.stat_result) -> str:
+        """Hash of a source, reused from an earlier run while its size and mtime are unchanged."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM sources WHERE path=? AND size=? AND mtime_ns=?",
+                (str(src), stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        if row:
+            return row[0]
+        digest = fixity.hash_file(src, self.algorithm)
+        self._remember(src, stat, digest)
+        return digest
+
+    def _store(self, src: Path, buffer_size: int, throttle: Optional[Callable[[int], None]]) -> Path:
+        """Copy a source into the store, hashing it on the way. Returns the object."""
+        temp = self.path / f"incoming-{uuid.uuid4().hex}"
+        try:
+            digest = fixity.copy_with_checksum(src, temp, self.algorithm, buffer_size, throttle)
+            size = temp.stat().st_size
+            target = self.object_path(size, digest)
+            target.parent.mkdir(exist_ok=True)
+            # identical content from another thread may land first, either copy will do
+            os.replace(temp, target)
+        finally:
+            temp.unlink(missing_ok=True)
+        self._add(size, digest)
+        return target
+
+    def link(self, target: Path, dst: Path) -> str:
+        """Make dst a hardlink to a stored object, or a reflink or copy where that isn't possible."""
+        try:
+            os.link(target, dst)
+            return "hardlink"
+        except OSError as e:
+            if e.errno not in UNLINKABLE:
+                raise
+        # fast_copy tries a reflink first when both are on the same filesystem
+        return fastcopy.fast_copy(target, dst)
+
+    def place(
+        self,
+        src: Path,
+        dst: Path,
+        buffer_size: int = fastcopy.BUFFER_SIZE,
+        throttle: Optional[Callable[[int], None]] = None,
+    ) -> StoredFile:
+        """Put src at dst through the store, reusing an identical object if there is one."""
+        stat = os.stat(src)
+        # no object has this size, so nothing can match and hashing first would be wasted
+        if stat.st_size in self.sizes:
+            digest = self.source_digest(src, stat)
+            if self.has(stat.st_size, digest):
+                return StoredFile("linked", digest, self.link(self.object_path(stat.st_size, digest), dst))
+        target = self._store(src, buffer_size, throttle)
+        digest = target.name.rsplit("-", 1)[0]
+        self._remember(src, stat, digest)
+        return StoredFile("stored", digest, self.link(target, dst))
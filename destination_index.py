@@ -0,0 +1,141 @@
+from typing import Iterator, Optional, Set, Tuple
+from pathlib import Path
+import os
+import sqlite3
+import time
+
+INDEX_NAME = ".archive_nle_index.sqlite"
+# a folder modified this close to a refresh may change again within the same
+# mtime tick on filesystems with coarse timestamps, so it is re-listed next time
+MTIME_SLACK_NS = 2_000_000_000
+
+
+class DestinationIndex:
+    """Cached listing of every file under an archive destination.
+
+    The index lives in the destination root and stores file names and sizes
+    per directory along with each directory's mtime. A refresh only lists
+    directories whose mtime has changed since the last run; unchanged
+    directories are answered from the cache. Directories that can't be read
+    are skipped and left out of the cache.
+    """
+
+    def __init__(self, root: Path, db_path: Optional[Path] = None):
+        self.root = Path(root)
+        self.db_path = Path(db_path) if db_path else self.root / INDEX_NAME
+        self._conn = sqlite3.connect(str(self.db_path))
+        # keep the rollback journal file around between commits so writing the
+        # index doesn't bump the mtime of the folder it lives in
+        self._conn.execute("PRAGMA journal_mode=PERSIST")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                mtime INTEGER NOT NULL,
+                subdirs TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (dir, name)
+            )"""
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def _scan_dir(self, rel_dir: str, mtime: int) -> list:
+        """List one directory, replacing its cached files. Returns its subdirectories."""
+        files = []
+        subdirs = []
+        with os.scandir(self.root / rel_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(INDEX_NAME):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    try:
+                        files.append((rel_dir, entry.name, entry.stat().st_size))
+                    except FileNotFoundError:
+                        continue
+        self._conn.execute("DELETE FROM files WHERE dir=?", (rel_dir,))
+        self._conn.executemany("INSERT INTO files (dir, name, size) VALUES (?, ?, ?)", files)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, mtime, subdirs) VALUES (?, ?, ?)",
+            (rel_dir, mtime, "\n".join(subdirs)),
+        )
+        return subdirs
+
+    def refresh(self) -> int:
+        """Bring the index up to date. Returns the number of directories re-listed."""
+        cached = {
+            path: (mtime, subdirs)
+            for path, mtime, subdirs in self._conn.execute("SELECT path, mtime, subdirs FROM dirs")
+        }
+        visited = set()
+        rescanned = 0
+        recent = time.time_ns() - MTIME_SLACK_NS
+        stack = ["."]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                mtime = os.stat(self.root / rel_dir).st_mtime_ns
+                if rel_dir in cached and cached[rel_dir][0] == mtime:
+                    subdirs = [name for name in cached[rel_dir][1].split("\n") if name]
+                else:
+                    # -1 never matches a real mtime, so a recently changed folder is listed again
+                    subdirs = self._scan_dir(rel_dir, mtime if mtime < recent else -1)
+                    rescanned += 1
+            except OSError:
+                # unreadable or vanished: leave it out so the next refresh tries again
+                continue
+            visited.add(rel_dir)
+            stack.extend(os.path.normpath(os.path.join(rel_dir, name)) for name in subdirs)
+
+        # forget directories that have been removed since the last refresh
+        removed = [(path,) for path in cached if path not in visited]
+        self._conn.executemany("DELETE FROM dirs WHERE path=?", removed)
+        self._conn.executemany("DELETE FROM files WHERE dir=?", removed)
+        self._conn.commit()
+        return rescanned
+
+    def _under(self, path: Optional[Path]) -> Tuple[str, tuple]:
+        """SQL filter restricting results to files below path."""
+        if path is None:
+            return "", ()
+        rel_dir = os.path.normpath(os.path.relpath(path, self.root))
+        if rel_dir == ".":
+            return "", ()
+        return " WHERE dir=? OR dir LIKE ? ESCAPE '\\'", (
+            rel_dir,
+            rel_dir.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%",
+        )
+
+    def names(self, under: Optional[Path] = None) -> Set[str]:
+        """File names anywhere in the index, optionally only below a folder."""
+        where, params = self._under(under)
+        return {name for (name,) in self._conn.execute(f"SELECT name FROM files{where}", params)}
+
+    def files(self, under: Optional[Path] = None) -> Iterator[Tuple[Path, int]]:
+        """Full path and size of every indexed file."""
+        where, params = self._under(under)
+        for rel_dir, name, size in self._conn.execute(f"SELECT dir, name, size FROM files{where}", params):
+            yield self.root / rel_dir / name, size
+
+    def named(self, name: str) -> Iterator[Path]:
+        """Full path of every indexed file with this name."""
+        for (rel_dir,) in self._conn.execute("SELECT dir FROM files WHERE name=?", (name,)):
+            yield self.root / rel_dir / name
+
+    def relative_files(self, under: Optional[Path] = None) -> Iterator[Tuple[str, int]]:
+        """Path relative to the root and size of every indexed file, as plain strings.
+
+        Cheaper than files() when comparing millions of paths.
+        """
+        where, params = self._under(under)
+        for rel_dir, name, size in self._conn.execute(f"SELECT dir, name, size FROM files{where}", params):
+            yield (name if rel_dir == "." else f"{rel_dir}/{name}"), size
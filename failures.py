@@ -0,0 +1,105 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+from datetime import datetime
+import errno
+import json
+import threading
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+SPACE = "space"
+
+# errors a flaky network share or busy array recovers from on its own
+TRANSIENT_ERRNOS = {
+    errno.EIO,
+    errno.ETIMEDOUT,
+    errno.ESTALE,
+    errno.EAGAIN,
+    errno.EBUSY,
+    errno.EINTR,
+    errno.ECONNRESET,
+    errno.ECONNABORTED,
+    errno.ECONNREFUSED,
+    errno.ENETDOWN,
+    errno.ENETUNREACH,
+    errno.ENETRESET,
+    errno.EHOSTDOWN,
+    errno.EHOSTUNREACH,
+}
+SPACE_ERRNOS = {errno.ENOSPC, errno.EDQUOT}
+
+DEFAULT_LOG = Path("failed.jsonl")
+
+
+def classify(error: Exception | str) -> str:
+    """Sort a copy error into transient (worth retrying), space (stop copying) or permanent."""
+    if isinstance(error, OSError):
+        if error.errno in SPACE_ERRNOS:
+            return SPACE
+        if error.errno in TRANSIENT_ERRNOS or isinstance(error, (TimeoutError, ConnectionError)):
+            return TRANSIENT
+    return PERMANENT
+
+
+class JobPaused(Exception):
+    """Copying stopped because the destination ran out of space.
+
+    Files that weren't started are left planned in the journal, so the next
+    run picks up where this one stopped.
+    """
+
+    def __init__(self, archive_root: Path, remaining: List[Path]):
+        super().__init__(f"destination is out of space, {len(remaining)} files were not copied")
+        self.archive_root = archive_root
+        self.remaining = remaining
+
+
+class FailureReport:
+    """Structured record of every failed file.
+
+    Each failure is appended to a JSON lines log as it happens, so nothing
+    is lost if the run dies, and the failures from this run can be written
+    out as one JSON report at the end.
+    """
+
+    def __init__(self, log_path: Optional[Path] = DEFAULT_LOG):
+        self.log_path = Path(log_path) if log_path else None
+        self.failures: List[dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, src: Path | str, dst: Path | str, error: Exception | str, attempts: int = 1) -> dict:
+        failure = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "source": str(src),
+            "destination": str(dst),
+            "kind": classify(error),
+            "errno": getattr(error, "errno", None),
+            "error": str(error),
+            "attempts": attempts,
+        }
+        with self._lock:
+            self.failures.append(failure)
+            if self.log_path:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(failure) + "\n")
+        return failure
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for failure in self.failures:
+                counts[failure["kind"]] = counts.get(failure["kind"], 0) + 1
+        return counts
+
+    def write(self, path: Path, paused: bool = False, remaining: int = 0):
+        """Write this run's failures as one JSON document."""
+        with self._lock:
+            failures = list(self.failures)
+        report = {
+            "generated": datetime.now().isoformat(timespec="seconds"),
+            "paused_for_space": paused,
+            "not_started": remaining,
+            "counts": self.counts(),
+            "failures": failures,
+        }
+        Path(path).write_text(json.dumps(report, indent=2) + "\n")
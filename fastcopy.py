@@ -0,0 +1,184 @@
+from typing import Callable, Optional
+from pathlib import Path
+from shutil import copystat
+import errno
+import struct
+import os
+import sys
+
+BUFFER_SIZE = 8 * 1024 * 1024
+FICLONE = 0x40049409
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct("=QQIIII")
+FIEMAP_EXTENT = struct.Struct("=QQQQQIIII")
+
+# errors that mean "this strategy isn't available here", not "the copy failed"
+UNSUPPORTED = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EBADF,
+    errno.ENOTSOCK,
+    errno.EPERM,
+}
+
+
+# called with the size of each chunk once it's copied, and blocks to hold the copy to a rate
+Throttle = Callable[[int], None]
+
+
+class StrategyUnavailable(Exception):
+    """Raised when a copy strategy can't be used for this pair of files."""
+
+
+def _unavailable_or_raise(error: OSError, copied: int):
+    # only fall back if nothing has been written yet, otherwise it's a real failure
+    if copied == 0 and error.errno in UNSUPPORTED:
+        raise StrategyUnavailable(error) from error
+    raise error
+
+
+def _check_complete(copied: int, size: int):
+    if copied < size:
+        raise OSError(errno.EIO, f"short copy, {copied} of {size} bytes written")
+
+
+def copy_reflink(src_fd: int, dst_fd: int, size: int, buffer_size: int, throttle: Optional[Throttle] = None):
+    """Clone the source extents into the destination (Btrfs, XFS).
+
+    No data is moved, so the throttle doesn't apply.
+    """
+    if not sys.platform.startswith("linux"):
+        raise StrategyUnavailable("reflink is only supported on Linux")
+    import fcntl
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as e:
+        _unavailable_or_raise(e, 0)
+
+
+def copy_range(src_fd: int, dst_fd: int, size: int, buffer_size: int, throttle: Optional[Throttle] = None):
+    """Copy inside the kernel with copy_file_range."""
+    if not hasattr(os, "copy_file_range"):
+        raise StrategyUnavailable("copy_file_range is not available")
+    copied = 0
+    while copied < size:
+        try:
+            sent = os.copy_file_range(src_fd, dst_fd, min(buffer_size, size - copied))
+        except OSError as e:
+            _unavailable_or_raise(e, copied)
+        if sent == 0:
+            # some filesystems report 0 instead of an error when they can't do it
+            if copied == 0:
+                raise StrategyUnavailable("copy_file_range copied nothing")
+            break
+        copied += sent
+        if throttle:
+            throttle(sent)
+    _check_complete(copied, size)
+
+
+def copy_sendfile(src_fd: int, dst_fd: int, size: int, buffer_size: int, throttle: Optional[Throttle] = None):
+    """Copy inside the kernel with sendfile."""
+    if not hasattr(os, "sendfile"):
+        raise StrategyUnavailable("sendfile is not available")
+    copied = 0
+    while copied < size:
+        try:
+            sent = os.sendfile(dst_fd, src_fd, copied, min(buffer_size, size - copied))
+        except OSError as e:
+            _unavailable_or_raise(e, copied)
+        if sent == 0:
+            # some filesystems report 0 instead of an error when they can't do it
+            if copied == 0:
+                raise StrategyUnavailable("sendfile copied nothing")
+            break
+        copied += sent
+        if throttle:
+            throttle(sent)
+    _check_complete(copied, size)
+
+
+def copy_buffered(src_fd: int, dst_fd: int, size: int, buffer_size: int, throttle: Optional[Throttle] = None):
+    """Plain read/write loop with a large, reused buffer."""
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    copied = 0
+    with open(src_fd, "rb", buffering=0, closefd=False) as fsrc, \
+         open(dst_fd, "wb", buffering=0, closefd=False) as fdst:
+        while True:
+            read = fsrc.readinto(buffer)
+            if not read:
+                break
+            # unbuffered writes can be short, so keep writing the rest of the chunk
+            written = 0
+            while written < read:
+                sent = fdst.write(view[written:read])
+                if not sent:
+                    _check_complete(copied + written, size)
+                    break
+                written += sent
+            copied += written
+            if throttle:
+                throttle(read)
+    _check_complete(copied, size)
+
+
+STRATEGIES = {
+    "reflink": copy_reflink,
+    "copy_file_range": copy_range,
+    "sendfile": copy_sendfile,
+    "buffered": copy_buffered,
+}
+
+
+def fast_copy(src: Path, dst: Path, buffer_size: int = BUFFER_SIZE, throttle: Optional[Throttle] = None) -> str:
+    """Copies src to dst with the fastest strategy that works, then copies metadata like copy2.
+
+    Reflinks are only attempted when both files are on the same filesystem.
+    `throttle` is called with the size of each chunk after it is copied.
+    Returns the name of the strategy that did the copy.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        src_stat = os.fstat(src_fd)
+        same_filesystem = src_stat.st_dev == os.fstat(dst_fd).st_dev
+
+        for name, strategy in STRATEGIES.items():
+            if name == "reflink" and not same_filesystem:
+                continue
+            try:
+                strategy(src_fd, dst_fd, src_stat.st_size, buffer_size, throttle)
+                break
+            except StrategyUnavailable:
+                os.ftruncate(dst_fd, 0)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.lseek(src_fd, 0, os.SEEK_SET)
+    copystat(src, dst)
+    return name
+
+
+def physical_offset(path: Path | str) -> Optional[int]:
+    """Byte offset of a file's first extent on disk, from the FIEMAP ioctl.
+
+    Returns None where FIEMAP isn't available (not Linux, network and
+    some virtual filesystems) or the file has no extents yet.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    import fcntl
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    # map the whole file, but only ask for the first extent
+    FIEMAP_HEADER.pack_into(request, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    try:
+        with open(path, "rb") as f:
+            fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    mapped = FIEMAP_HEADER.unpack_from(request, 0)[3]
+    if not mapped:
+        return None
+    return FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)[1]
@@ -0,0 +1,163 @@
+from typing import Callable, Dict, Iterable, List, Optional
+from pathlib import Path
+from shutil import copystat
+from datetime import datetime
+import hashlib
+import csv
+import os
+import threading
+
+BUFFER_SIZE = 8 * 1024 * 1024
+MANIFEST_NAME = "fixity.csv"
+MANIFEST_FIELDS = ["path", "source", "size", "algorithm", "hash", "hashed"]
+ALGORITHMS = ("xxhash64", "md5", "sha1")
+
+
+def new_hasher(algorithm: str):
+    """Returns a fresh hash object for the named algorithm."""
+    if algorithm == "xxhash64":
+        # Import here just so we don't have to install xxhash if we don't need it
+        import xxhash
+        return xxhash.xxh64()
+    if algorithm in ("md5", "sha1"):
+        return hashlib.new(algorithm)
+    raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+
+
+def available(algorithm: str) -> bool:
+    """False if the algorithm needs a package that isn't installed."""
+    try:
+        new_hasher(algorithm)
+    except ImportError:
+        return False
+    return True
+
+
+def default_algorithm() -> str:
+    """xxhash64 when the xxhash package is installed, otherwise md5."""
+    try:
+        import xxhash  # noqa: F401
+        return "xxhash64"
+    except ImportError:
+        return "md5"
+
+
+def copy_with_checksum(
+    src: Path,
+    dst: Path,
+    algorithm: str,
+    buffer_size: int = BUFFER_SIZE,
+    throttle: Optional[Callable[[int], None]] = None,
+) -> str:
+    """Copies src to dst like copy2, hashing the data in the same read loop.
+
+    `throttle` is called with the size of each chunk after it is written.
+    Returns the hex digest of the source data.
+    """
+    hasher = new_hasher(algorithm)
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        while True:
+            chunk = fsrc.read(buffer_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            fdst.write(chunk)
+            if throttle:
+                throttle(len(chunk))
+    copystat(src, dst)
+    return hasher.hexdigest()
+
+
+def hash_file(path: Path, algorithm: str, buffer_size: int = BUFFER_SIZE) -> str:
+    """Returns the hex digest of a file."""
+    hasher = new_hasher(algorithm)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(buffer_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def check_file(path: Path, size: int, algorithm: str, digest: str) -> Optional[str]:
+    """Re-hash one archived file. Returns why it failed, or None if it matches."""
+    try:
+        if os.path.getsize(path) != size:
+            return "size does not match"
+        if hash_file(path, algorithm) != digest:
+            return "checksum does not match"
+    except OSError as e:
+        return str(e)
+    return None
+
+
+class FixityManifest:
+    """CSV sidecar of source hashes, kept at the root of the archive.
+
+    Paths are stored relative to the manifest's folder so the archive can be
+    moved and still verified.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.root = self.path.parent
+        self._lock = threading.Lock()
+
+    def add(self, dst: Path, src: Path, size: int, algorithm: str, digest: str):
+        row = {
+            "path": os.path.relpath(dst, self.root),
+            "source": str(src),
+            "size": size,
+            "algorithm": algorithm,
+            "hash": digest,
+            "hashed": datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            new_file = not self.path.exists()
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+
+    def entries(self) -> Dict[str, dict]:
+        """Latest manifest row for each archived path."""
+        entries: Dict[str, dict] = {}
+        if not self.path.exists():
+            return entries
+        with open(self.path, newline="") as f:
+            for row in csv.DictReader(f):
+                entries[row["path"]] = row
+        return entries
+
+    def remove(self, paths: Iterable[str]) -> int:
+        """Drop the rows for the given paths, e.g. once the files are deleted. Returns the rows removed."""
+        paths = set(paths)
+        with self._lock:
+            if not paths or not self.path.exists():
+                return 0
+            with open(self.path, newline="") as f:
+                rows = list(csv.DictReader(f))
+            kept = [row for row in rows if row["path"] not in paths]
+            if len(kept) == len(rows):
+                return 0
+            temp = self.path.with_name(self.path.name + ".tmp")
+            with open(temp, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+                writer.writeheader()
+                writer.writerows(kept)
+            os.replace(temp, self.path)
+        return len(rows) - len(kept)
+
+    def verify(self, paths: Optional[List[str]] = None) -> List[Path]:
+        """Re-hashes archived files and returns those that are missing or don't match."""
+        entries = self.entries()
+        mismatched = []
+        for rel_path in paths if paths is not None else entries:
+            row = entries[rel_path]
+            dst = self.root / rel_path
+            if check_file(dst, int(row["size"]), row["algorithm"], row["hash"]):
+                mismatched.append(dst)
+        return mismatched
@@ -0,0 +1,152 @@
+from typing import Iterable, NamedTuple, Optional, Set
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+import packing
+
+PLANNED = "planned"
+COPYING = "copying"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class PlannedFile(NamedTuple):
+    """A file a job is about to copy. dst is None where it's only decided at copy time."""
+    src: Path | str
+    dst: Optional[Path] = None
+    size: Optional[int] = None
+    mtime: Optional[float] = None
+
+
+class CopyJournal:
+    """SQLite record of every file in a job, so an interrupted run can resume.
+
+    Each row holds the source, destination, size, mtime and state
+    (planned, copying, completed or failed) of one file.
+    """
+
+    def __init__(self, db_path: Path, job: str):
+        self.db_path = Path(db_path)
+        self.job = job
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                job TEXT NOT NULL,
+                src TEXT NOT NULL,
+                dst TEXT,
+                size INTEGER,
+                mtime REAL,
+                state TEXT NOT NULL,
+                error TEXT,
+                updated REAL NOT NULL,
+                PRIMARY KEY (job, src)
+            )"""
+        )
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def plan(self, files: Iterable[PlannedFile]):
+        """Record files as planned with their destination, size and mtime.
+
+        Rows that already exist keep their state, and completed rows are left
+        alone, but the others take the new details.
+        """
+        now = time.time()
+        rows = [
+            (self.job, str(file.src), str(file.dst) if file.dst else None, file.size, file.mtime, PLANNED, now)
+            for file in files
+        ]
+        with self._lock:
+            self._conn.executemany(
+                """INSERT INTO files (job, src, dst, size, mtime, state, updated) VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (job, src) DO UPDATE SET dst=COALESCE(excluded.dst, dst), size=excluded.size,
+                   mtime=excluded.mtime, updated=excluded.updated WHERE state != 'completed'""",
+                rows,
+            )
+            self._conn.commit()
+
+    def start(self, src: Path, dst: Path):
+        self._execute(
+            """INSERT INTO files (job, src, dst, state, updated) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (job, src) DO UPDATE SET dst=excluded.dst, state=excluded.state,
+               error=NULL, updated=excluded.updated""",
+            (self.job, str(src), str(dst), COPYING, time.time()),
+        )
+
+    def complete(self, src: Path, dst: Path, size: Optional[int] = None, mtime: Optional[float] = None):
+        self._execute(
+            """INSERT INTO files (job, src, dst, size, mtime, state, updated) VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (job, src) DO UPDATE SET dst=excluded.dst, size=excluded.size,
+               mtime=excluded.mtime, state=excluded.state, error=NULL, updated=excluded.updated""",
+            (self.job, str(src), str(dst), size, mtime, COMPLETED, time.time()),
+        )
+
+    def fail(self, src: Path, dst: Path, error: Exception | str):
+        self._execute(
+            """INSERT INTO files (job, src, dst, state, error, updated) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (job, src) DO UPDATE SET dst=excluded.dst, state=excluded.state,
+               error=excluded.error, updated=excluded.updated""",
+            (self.job, str(src), str(dst), FAILED, str(error), time.time()),
+        )
+
+    def forget(self, dst_paths: Iterable[Path | str]) -> int:
+        """Remove the rows for files deleted from the destination, so they're copied again if needed."""
+        rows = [(self.job, str(dst)) for dst in dst_paths]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("DELETE FROM files WHERE job=? AND dst=?", rows)
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def state(self, src: Path | str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM files WHERE job=? AND src=?", (self.job, str(src))
+            ).fetchone()
+        return row[0] if row else None
+
+    def completed(self) -> Set[str]:
+        """Source paths that finished copying in this or a previous run."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT src FROM files WHERE job=? AND state=?", (self.job, COMPLETED)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def reset_interrupted(self) -> int:
+        """Remove partially-written destinations, and unfinished packs beside them, left by an interrupted run.
+
+        Returns the number of files that were reset back to planned.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT src, dst FROM files WHERE job=? AND state=?", (self.job, COPYING)
+            ).fetchall()
+        folders = set()
+        for _, dst in rows:
+            if dst:
+                Path(dst).unlink(missing_ok=True)
+                folders.add(Path(dst).parent)
+        # packed files were being written into a .partial tar that was never finished
+        for folder in folders:
+            packing.remove_partials(folder)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET state=?, updated=? WHERE job=? AND state=?",
+                (PLANNED, time.time(), self.job, COPYING),
+            )
+            self._conn.commit()
+        return len(rows)
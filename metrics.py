@@ -0,0 +1,205 @@
+from typing import Deque, Dict, Optional, Tuple
+from pathlib import Path
+from collections import deque
+from contextlib import contextmanager
+import json
+import math
+import os
+import threading
+import time
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None or math.isinf(seconds):
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Metrics:
+    """Phase timings and live copy throughput for one archive run.
+
+    Copy threads report each finished file; the rolling rate covers the last
+    `window` seconds and drives the ETA. Everything can be exported as JSON
+    or as a Prometheus textfile for node_exporter to pick up.
+    """
+
+    def __init__(
+        self,
+        total_bytes: int = 0,
+        total_files: int = 0,
+        window: float = 10.0,
+        recent: int = 100,
+        json_path: Optional[Path] = None,
+        prometheus_path: Optional[Path] = None,
+        update_interval: float = 1.0,
+    ):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.window = window
+        self.phases: Dict[str, float] = {}
+        self.bytes_done = 0
+        self.files_copied = 0
+        self.files_skipped = 0
+        self.files_failed = 0
+        self.copy_seconds = 0.0
+        self.slowest_copy = 0.0
+        self.started = time.time()
+        self.recent: Deque[dict] = deque(maxlen=recent)
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.update_interval = update_interval
+        self._last_update = 0.0
+        self._completions: Deque[Tuple[float, int]] = deque()
+        self._lock = threading.Lock()
+
+    def begin_copy(self, total_bytes: int, total_files: int):
+        """Set the copy totals and start the clock the rates are measured from."""
+        with self._lock:
+            self.total_bytes = total_bytes
+            self.total_files = total_files
+            self.started = time.time()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a phase of the run, e.g. parse, stat, diff or copy."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def record_copy(self, path: Path, size: int, seconds: float, strategy: str = ""):
+        now = time.time()
+        with self._lock:
+            self.files_copied += 1
+            self.bytes_done += size
+            self.copy_seconds += seconds
+            self.slowest_copy = max(self.slowest_copy, seconds)
+            self._completions.append((now, size))
+            self.recent.append({
+                "path": str(path),
+                "bytes": size,
+                "seconds": round(seconds, 4),
+                "bytes_per_second": round(size / seconds) if seconds > 0 else None,
+                "strategy": strategy,
+            })
+
+    def record_skip(self, size: int):
+        with self._lock:
+            self.files_skipped += 1
+            self.bytes_done += size
+
+    def record_failure(self):
+        with self._lock:
+            self.files_failed += 1
+
+    def rolling_rate(self) -> float:
+        """Bytes per second over the last `window` seconds."""
+        now = time.time()
+        with self._lock:
+            while self._completions and self._completions[0][0] < now - self.window:
+                self._completions.popleft()
+            copied = sum(size for _, size in self._completions)
+        span = min(self.window, now - self.started)
+        return copied / span if span > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        """Seconds left at the rolling rate, or the average rate if nothing finished recently."""
+        remaining = max(0, self.total_bytes - self.bytes_done)
+        if remaining == 0:
+            return 0.0
+        rate = self.rolling_rate()
+        if rate <= 0:
+            elapsed = time.time() - self.started
+            rate = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        return remaining / rate if rate > 0 else None
+
+    def progress_line(self, convert_size=None) -> str:
+        """One-line status, e.g. [ 42/1200 files] 1.2 TB of 3.4 TB  512.3 MB/s  ETA 01:12:33"""
+        size = convert_size or (lambda n: f"{n} B")
+        done = self.files_copied + self.files_skipped + self.files_failed
+        width = len(str(self.total_files))
+        return (
+            f"[{done:>{width}}/{self.total_files} files] {size(self.bytes_done)} of {size(self.total_bytes)}  "
+            f"{self.rolling_rate() / 1024 / 1024:.1f} MB/s  ETA {format_duration(self.eta())}"
+        )
+
+    def snapshot(self) -> dict:
+        rate = self.rolling_rate()
+        eta = self.eta()
+        with self._lock:
+            return {
+                "phases_seconds": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+                "bytes_total": self.total_bytes,
+                "bytes_done": self.bytes_done,
+                "files_total": self.total_files,
+                "files_copied": self.files_copied,
+                "files_skipped": self.files_skipped,
+                "files_failed": self.files_failed,
+                "copy_seconds_total": round(self.copy_seconds, 4),
+                "copy_seconds_max": round(self.slowest_copy, 4),
+                "rolling_bytes_per_second": round(rate),
+                "eta_seconds": round(eta) if eta is not None else None,
+                "recent_files": list(self.recent),
+            }
+
+    def write_json(self, path: Path):
+        _write_atomic(path, json.dumps(self.snapshot(), indent=2))
+
+    def write_prometheus(self, path: Path):
+        """Write a node_exporter textfile collector file."""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP archive_nle_phase_seconds Wall clock time spent in each phase.",
+            "# TYPE archive_nle_phase_seconds gauge",
+        ]
+        for name, seconds in snapshot["phases_seconds"].items():
+            lines.append(f'archive_nle_phase_seconds{{phase="{name}"}} {seconds}')
+        gauges = [
+            ("bytes_total", "Bytes planned for this run."),
+            ("bytes_done", "Bytes copied or already present."),
+            ("files_total", "Files planned for this run."),
+            ("files_copied", "Files copied."),
+            ("files_skipped", "Files skipped because they already existed."),
+            ("files_failed", "Files that failed to copy."),
+            ("copy_seconds_total", "Time spent copying files, summed across threads."),
+            ("copy_seconds_max", "Slowest single file copy."),
+            ("rolling_bytes_per_second", "Copy throughput over the rolling window."),
+            ("eta_seconds", "Estimated seconds until the copy finishes."),
+        ]
+        for name, help_text in gauges:
+            value = snapshot[name]
+            if value is None:
+                continue
+            lines.append(f"# HELP archive_nle_{name} {help_text}")
+            lines.append(f"# TYPE archive_nle_{name} gauge")
+            lines.append(f"archive_nle_{name} {value}")
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+    def export(self):
+        """Write the configured JSON and Prometheus files."""
+        if self.json_path:
+            self.write_json(self.json_path)
+        if self.prometheus_path:
+            self.write_prometheus(self.prometheus_path)
+
+    def update(self, display: bool = False, convert_size=None, force: bool = False):
+        """Refresh the progress line and exports, at most once per update_interval."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_update < self.update_interval:
+                return
+            self._last_update = now
+        if display:
+            print(f"\r{self.progress_line(convert_size)}", end="\n" if force else "", flush=True)
+        self.export()
+
+
+def _write_atomic(path: Path, text: str):
+    # write then rename, so scrapers never read a half-written file
+    path = Path(path)
+    temp = path.with_name(path.name + ".tmp")
+    temp.write_text(text)
+    os.replace(temp, path)
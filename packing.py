@@ -0,0 +1,308 @@
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from pathlib import Path
+import csv
+import os
+import re
+import tarfile
+
+import fixity
+
+# Small files from one source folder are packed into tars that sit in the
+# folder they would have been copied to. Members are stored under their
+# plain file names, so extracting a pack in place rebuilds the reconnect
+# structure exactly. Each pack has a CSV index of where every member's data
+# starts, so one file can be pulled out without reading the whole tar.
+
+PACK_PREFIX = "archive_nle_pack_"
+PACK_PATTERN = re.compile(rf"^{PACK_PREFIX}(\d+)\.tar$")
+INDEX_SUFFIX = ".index.csv"
+PARTIAL_SUFFIX = ".partial"
+INDEX_FIELDS = ["name", "offset", "size", "mtime", "source", "algorithm", "hash"]
+DEFAULT_THRESHOLD = 1024 * 1024
+DEFAULT_PACK_BYTES = 4 * 1024 * 1024 * 1024
+
+
+def index_path(pack: Path) -> Path:
+    return pack.with_name(pack.name + INDEX_SUFFIX)
+
+
+def is_pack_index(name: str) -> bool:
+    return name.startswith(PACK_PREFIX) and name.endswith(INDEX_SUFFIX)
+
+
+def read_index(path: Path) -> List[dict]:
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def write_index(path: Path, rows: List[dict]):
+    # write then rename, so a pack never has a half-written index
+    temp = path.with_suffix(".tmp")
+    with open(temp, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temp, path)
+
+
+def packed_names(folder: Path, listing: Optional[Iterable[str]] = None) -> Set[str]:
+    """Names of the files packed into tars in a folder.
+
+    Pass the folder's listing if it has already been read, to avoid listing it again.
+    """
+    if listing is None:
+        try:
+            listing = os.listdir(folder)
+        except (FileNotFoundError, NotADirectoryError):
+            return set()
+    names = set()
+    for name in listing:
+        if is_pack_index(name):
+            names.update(row["name"] for row in read_index(Path(folder) / name))
+    return names
+
+
+def next_pack_path(folder: Path) -> Path:
+    """The first unused pack name in a folder, counting unfinished packs as used."""
+    used = [0]
+    try:
+        for name in os.listdir(folder):
+            match = PACK_PATTERN.match(name.removesuffix(PARTIAL_SUFFIX))
+            if match:
+                used.append(int(match.group(1)))
+    except FileNotFoundError:
+        pass
+    return Path(folder) / f"{PACK_PREFIX}{max(used) + 1:04d}.tar"
+
+
+def reserve_pack_path(folder: Path) -> Path:
+    """Claim the next pack name by creating its .partial file.
+
+    Writers packing other source folders into the same folder may be
+    numbering at the same time, so the .partial is created exclusively and
+    the next number is tried if another writer got there first.
+    """
+    pack = next_pack_path(folder)
+    while True:
+        partial = pack.with_name(pack.name + PARTIAL_SUFFIX)
+        try:
+            os.close(os.open(partial, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            pass
+        else:
+            # a writer that finished since the listing renamed its .partial, but its tar keeps the number
+            if not pack.exists():
+                return pack
+            partial.unlink()
+        number = int(PACK_PATTERN.match(pack.name).group(1)) + 1
+        pack = pack.with_name(f"{PACK_PREFIX}{number:04d}.tar")
+
+
+def remove_partials(folder: Path) -> int:
+    """Delete unfinished packs an interrupted run left in a folder. Returns how many were removed."""
+    removed = 0
+    try:
+        names = os.listdir(folder)
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+    for name in names:
+        if name.endswith(PARTIAL_SUFFIX) and PACK_PATTERN.match(name.removesuffix(PARTIAL_SUFFIX)):
+            (Path(folder) / name).unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+class _ReadWatcher:
+    """File wrapper that hashes and throttles data as tarfile reads it."""
+
+    def __init__(self, f, hasher=None, throttle: Optional[Callable[[int], None]] = None):
+        self._f = f
+        self.hasher = hasher
+        self.throttle = throttle
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        if self.hasher:
+            self.hasher.update(data)
+        if self.throttle and data:
+            self.throttle(len(data))
+        return data
+
+
+class PackWriter:
+    """Streams files into tars in one destination folder, starting a new tar past `max_bytes`.
+
+    A tar is written under a .partial name and only renamed, with its index
+    written beside it, once it's complete, so an interrupted pack is never
+    mistaken for a finished one. `sources` lists the source of every file in
+    each finished pack.
+    """
+
+    def __init__(self, folder: Path, max_bytes: int = DEFAULT_PACK_BYTES, checksum: Optional[str] = None):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.checksum = checksum
+        self.packs: List[Path] = []
+        self.sources: Dict[Path, List[str]] = {}
+        self._tar: Optional[tarfile.TarFile] = None
+        self._rows: List[dict] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._tar is not None:
+            # leave nothing that looks finished behind
+            self._tar.close()
+            self._partial.unlink(missing_ok=True)
+            self._tar = None
+
+    def _open(self):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._pack = reserve_pack_path(self.folder)
+        self._partial = self._pack.with_name(self._pack.name + PARTIAL_SUFFIX)
+        self._tar = tarfile.open(self._partial, "w", format=tarfile.PAX_FORMAT)
+        self._rows = []
+
+    def _finish(self):
+        try:
+            self._tar.close()
+            os.replace(self._partial, self._pack)
+            write_index(index_path(self._pack), self._rows)
+        except BaseException:
+            # a pack without an index is never read, so don't leave one holding its number
+            self._partial.unlink(missing_ok=True)
+            self._pack.unlink(missing_ok=True)
+            raise
+        finally:
+            self._tar = None
+        self.packs.append(self._pack)
+        self.sources[self._pack] = [row["source"] for row in self._rows]
+
+    def add(self, src: Path, name: str, throttle: Optional[Callable[[int], None]] = None) -> Optional[str]:
+        """Append one file under `name`. Returns its checksum if one is being taken."""
+        if self._tar is not None and self._tar.offset >= self.max_bytes:
+            self._finish()
+        if self._tar is None:
+            self._open()
+
+        info = self._tar.gettarinfo(str(src), arcname=name)
+        hasher = fixity.new_hasher(self.checksum) if self.checksum else None
+        start = self._tar.offset
+        try:
+            with open(src, "rb") as f:
+                self._tar.addfile(info, _ReadWatcher(f, hasher, throttle))
+        except Exception:
+            # cut off the half-written member so the rest of the pack stays valid
+            self._tar.fileobj.seek(start)
+            self._tar.fileobj.truncate()
+            self._tar.offset = start
+            raise
+        digest = hasher.hexdigest() if hasher else None
+        # the data ends the member, padded out to a whole tar block
+        blocks = -(-info.size // tarfile.BLOCKSIZE)
+        self._rows.append({
+            "name": name,
+            "offset": self._tar.offset - blocks * tarfile.BLOCKSIZE,
+            "size": info.size,
+            "mtime": info.mtime,
+            "source": str(src),
+            "algorithm": self.checksum or "",
+            "hash": digest or "",
+        })
+        return digest
+
+    def close(self):
+        if self._tar is not None:
+            self._finish()
+
+
+def extract_member(index: Path, name: str, dst: Optional[Path] = None) -> Path:
+    """Copy one packed file out by seeking straight to its data.
+
+    Defaults to the path the file would have been copied to, beside the pack.
+    """
+    index = Path(index)
+    row = next((row for row in read_index(index) if row["name"] == name), None)
+    if row is None:
+        raise FileNotFoundError(f"{name} is not in {index}")
+    pack = index.with_name(index.name.removesuffix(INDEX_SUFFIX))
+    dst = Path(dst) if dst else index.parent / name
+    remaining = int(row["size"])
+    with open(pack, "rb") as fsrc, open(dst, "wb") as fdst:
+        fsrc.seek(int(row["offset"]))
+        while remaining:
+            chunk = fsrc.read(min(fixity.BUFFER_SIZE, remaining))
+            if not chunk:
+                raise EOFError(f"{pack} is truncated")
+            fdst.write(chunk)
+            remaining -= len(chunk)
+    os.utime(dst, (float(row["mtime"]), float(row["mtime"])))
+    return dst
+
+
+def unpack(pack: Path, remove: bool = False) -> List[Path]:
+    """Extract every file in a pack beside it, rebuilding the copied layout."""
+    pack = Path(pack)
+    with tarfile.open(pack) as tar:
+        names = tar.getnames()
+        tar.extractall(pack.parent, filter="data")
+    if remove:
+        pack.unlink()
+        index_path(pack).unlink(missing_ok=True)
+    return [pack.parent / name for name in names]
+
+
+def packed_hash(pack: Path, row: dict) -> Optional[str]:
+    """Hash of one packed file's data, or None if the pack is missing or truncated."""
+    hasher = fixity.new_hasher(row["algorithm"])
+    remaining = int(row["size"])
+    try:
+        with open(pack, "rb") as f:
+            f.seek(int(row["offset"]))
+            while remaining:
+                chunk = f.read(min(fixity.BUFFER_SIZE, remaining))
+                if not chunk:
+                    return None
+                hasher.update(chunk)
+                remaining -= len(chunk)
+    except FileNotFoundError:
+        return None
+    return hasher.hexdigest()
+
+
+def check_packed(pack: Path, row: dict) -> Optional[str]:
+    """Re-hash one packed file against its index row. Returns why it failed, or None if it matches."""
+    try:
+        digest = packed_hash(pack, row)
+    except OSError as e:
+        return str(e)
+    if digest is None:
+        return "pack is missing or truncated"
+    if digest != row["hash"]:
+        return "checksum does not match"
+    return None
+
+
+def verify_packs(root: Path, packs: Optional[Iterable[Path]] = None) -> Dict[Path, List[dict]]:
+    """Re-hash every packed file below root that has a checksum, or only those in `packs`.
+
+    Mismatched files are dropped from their pack's index so the next run
+    packs them again. Returns the dropped index rows for each index.
+    """
+    mismatched: Dict[Path, List[dict]] = {}
+    if packs is None:
+        indexes = Path(root).rglob(f"{PACK_PREFIX}*{INDEX_SUFFIX}")
+    else:
+        indexes = (index_path(pack) for pack in packs)
+    for index in indexes:
+        pack = index.with_name(index.name.removesuffix(INDEX_SUFFIX))
+        kept, bad = [], []
+        for row in read_index(index):
+            (kept if not row["hash"] or packed_hash(pack, row) == row["hash"] else bad).append(row)
+        if bad:
+            write_index(index, kept)
+            mismatched[index] = bad
+    return mismatched
@@ -1,4 +1,8 @@
-from typing import List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from fnmatch import fnmatchcase
+import mmap
+import os
+import re
 import warnings
 import xml.etree.ElementTree as et
 from urllib.parse import unquote, urlparse
@@ -43,7 +47,21 @@ def filepaths_from_aaf(aaf_path: str, ignore_paths: Optional[List[str]] = None)
     return list(set(filtered_files))
 
 def extract_files_from_aaf(aaf_path: str) -> List[str]:
-    """Extract and return all file paths from the AAF."""
+    """Extract and return all file paths from the AAF.
+
+    Locators are read straight from the memory-mapped compound file, falling
+    back to the aaf2 object model for anything the fast scanner can't read.
+    """
+    import aaf_locators
+
+    try:
+        files = [unquoted_path_from_url(url) for url in aaf_locators.locator_urls(str(aaf_path))]
+    except aaf_locators.UnsupportedAAF:
+        files = []
+    return files or extract_files_from_aaf2(aaf_path)
+
+def extract_files_from_aaf2(aaf_path: str) -> List[str]:
+    """Extract and return all file paths from the AAF using aaf2."""
 
     import aaf2
 
@@ -68,83 +86,293 @@ def unquoted_path_from_url(url: str) -> str:
 
     return path
 
-def filter_ignored_paths(files: List[str], 
-                         ignore_paths: List[str]) -> List[str]:
-    """Filter out files that start with any of the ignore paths."""
-    return [file for file in files 
-            if not any(file.startswith(ignore_path) 
-                       for ignore_path in ignore_paths)]
+GLOB_CHARS = re.compile(r"[*?\[]")
 
-def extract_pathurls_from_malformed_xml(xml_path: str) -> List[str]:
-    """Best-effort extraction of pathurl values from malformed XML content."""
-    start_tag = "<pathurl>"
-    end_tag = "</pathurl>"
+def path_parts(path: str) -> List[str]:
+    return [part for part in path.split("/") if part]
 
-    extracted_paths = []
-    collecting = False
-    current_value = ""
+class _IgnoreNode:
+    __slots__ = ("children", "globs", "end")
 
-    with open(xml_path, "r", encoding="utf-8", errors="ignore") as xml_file:
-        for line in xml_file:
-            cursor = 0
+    def __init__(self):
+        self.children: Dict[str, "_IgnoreNode"] = {}
+        self.globs: List[Tuple[str, "_IgnoreNode"]] = []
+        self.end = False
+
+class IgnoreMatcher:
+    """Ignore paths compiled into a trie over path components.
+
+    A file is ignored when a whole-component prefix of its path matches an
+    ignore path, so /Volumes/Media/Dailies excludes /Volumes/Media/Dailies/a.mov
+    but not /Volumes/Media/Dailies2/a.mov. Components may be glob patterns,
+    e.g. /Volumes/*/Camera Roll*/A00?. Matching costs one dict lookup per
+    path component rather than one comparison per ignore path.
+    """
+
+    def __init__(self, ignore_paths: Iterable[str]):
+        self.root = _IgnoreNode()
+        for ignore_path in ignore_paths:
+            node = self.root
+            for part in path_parts(str(ignore_path)):
+                if GLOB_CHARS.search(part):
+                    child = next((c for pattern, c in node.globs if pattern == part), None)
+                    if child is None:
+                        child = _IgnoreNode()
+                        node.globs.append((part, child))
+                else:
+                    child = node.children.setdefault(part, _IgnoreNode())
+                node = child
+            node.end = True
+
+    def matches(self, path: str) -> bool:
+        nodes = [self.root]
+        for part in path_parts(path):
+            next_nodes = []
+            for node in nodes:
+                if part in node.children:
+                    next_nodes.append(node.children[part])
+                next_nodes.extend(child for pattern, child in node.globs if fnmatchcase(part, pattern))
+            if not next_nodes:
+                return False
+            if any(node.end for node in next_nodes):
+                return True
+            nodes = next_nodes
+        return False
 
-            while cursor < len(line):
-                if collecting:
-                    end_index = line.find(end_tag, cursor)
-                    if end_index == -1:
-                        current_value += line[cursor:]
-                        break
+def filter_ignored_paths(files: Iterable[str], 
+                         ignore_paths: "List[str] | IgnoreMatcher") -> List[str]:
+    """Filter out files that are inside any of the ignore paths."""
+    matcher = ignore_paths if isinstance(ignore_paths, IgnoreMatcher) else IgnoreMatcher(ignore_paths)
+    return [file for file in files if not matcher.matches(file)]
 
-                    current_value += line[cursor:end_index]
-                    value = current_value.strip()
-                    if value:
-                        extracted_paths.append(unquoted_path_from_url(value))
+def iter_pathurls_from_malformed_xml(xml_path: str) -> Iterator[str]:
+    """Best-effort extraction of pathurl values from malformed XML content.
 
-                    current_value = ""
-                    collecting = False
-                    cursor = end_index + len(end_tag)
-                    continue
+    The file is memory-mapped and scanned for the raw tag bytes, so only the
+    captured values are ever decoded. Values are decoded the way reading the
+    file as UTF-8 text would, ignoring invalid bytes and normalising newlines.
+    """
+    start_tag = b"<pathurl>"
+    end_tag = b"</pathurl>"
 
-                start_index = line.find(start_tag, cursor)
+    with open(xml_path, "rb") as xml_file:
+        try:
+            data = mmap.mmap(xml_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return
+
+        with data:
+            cursor = 0
+            while True:
+                start_index = data.find(start_tag, cursor)
                 if start_index == -1:
                     break
 
                 value_start = start_index + len(start_tag)
-                end_index = line.find(end_tag, value_start)
-
+                end_index = data.find(end_tag, value_start)
                 if end_index == -1:
-                    collecting = True
-                    current_value = line[value_start:]
                     break
 
-                value = line[value_start:end_index].strip()
+                value = data[value_start:end_index].decode("utf-8", errors="ignore")
+                if "\r" in value:
+                    value = value.replace("\r\n", "\n").replace("\r", "\n")
+                value = value.strip()
                 if value:
-                    extracted_paths.append(unquoted_path_from_url(value))
+                    yield unquoted_path_from_url(value)
 
                 cursor = end_index + len(end_tag)
 
-    return extracted_paths
+def extract_pathurls_from_malformed_xml(xml_path: str) -> List[str]:
+    """Best-effort extraction of pathurl values from malformed XML content."""
+    return list(iter_pathurls_from_malformed_xml(xml_path))
+
+def iter_pathurls_from_xml(xml_path: str) -> Iterator[str]:
+    """Stream pathurls from the XML, discarding each element once it is closed.
+
+    Memory stays flat regardless of file size, apart from the set of paths
+    already yielded. If the XML turns out to be malformed, the best-effort
+    scanner yields every path that wasn't.
+    """
+    parser = et.XMLParser(encoding='utf-8')
+    # the scanner also finds pathurls in comments and CDATA, so match by value, not position
+    yielded: Set[str] = set()
+    open_elements = []
+    try:
+        for event, elem in et.iterparse(xml_path, events=("start", "end"), parser=parser):
+            if event == "start":
+                open_elements.append(elem)
+                continue
+
+            open_elements.pop()
+            if elem.tag == "pathurl" and elem.text:
+                path = unquoted_path_from_url(elem.text)
+                yielded.add(path)
+                yield path
+
+            # drop the finished subtree so the document never accumulates
+            elem.clear()
+            if open_elements:
+                open_elements[-1].remove(elem)
+    except et.ParseError as error:
+        warnings.warn(
+            f"XML parse failed ({error}). Falling back to best-effort pathurl extraction.",
+            RuntimeWarning,
+        )
+        for path in iter_pathurls_from_malformed_xml(xml_path):
+            if path not in yielded:
+                yielded.add(path)
+                yield path
 
 def extract_pathurls_from_xml(xml_path: str) -> List[str]:
     """Extract and return all pathurls from the XML."""
+    return list(iter_pathurls_from_xml(xml_path))
+
+# image sequence frame files, e.g. A001_C002_0001000.dpx
+SEQUENCE_FRAME = re.compile(
+    r"^(?P<prefix>.*?)(?P<frame>\d+)(?P<ext>\.(?:dpx|exr|tif|tiff|png|jpg|jpeg|tga|cin))$",
+    re.IGNORECASE,
+)
+
+def int_or_none(text: Optional[str]) -> Optional[int]:
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+# (path, in, out, media duration) of one clipitem
+ClipMedia = Tuple[str, Optional[int], Optional[int], Optional[int]]
+
+def iter_clip_media_from_xml(xml_path: str) -> Iterator[ClipMedia]:
+    """Stream (path, in, out, media duration) for every clipitem that uses a file.
+
+    Premiere only writes a file's pathurl the first time it is used; later
+    clipitems refer to it by id, so definitions are remembered as they are
+    parsed. Clipitems are discarded once they close. If the XML is malformed,
+    every pathurl the best-effort scanner finds is yielded without timing.
+    """
     parser = et.XMLParser(encoding='utf-8')
+    files: Dict[str, Tuple[str, Optional[int]]] = {}
+    open_elements = []
+    clip_depth = 0
     try:
-        xmlTree = et.parse(xml_path, parser)
-        pathurls = xmlTree.findall('.//pathurl')
-        return [unquoted_path_from_url(pathurl.text) for pathurl in pathurls if pathurl.text]
+        for event, elem in et.iterparse(xml_path, events=("start", "end"), parser=parser):
+            if event == "start":
+                open_elements.append(elem)
+                if elem.tag == "clipitem":
+                    clip_depth += 1
+                continue
+
+            open_elements.pop()
+            if elem.tag == "file":
+                pathurl = elem.findtext("pathurl")
+                if pathurl:
+                    files[elem.get("id")] = (
+                        unquoted_path_from_url(pathurl),
+                        int_or_none(elem.findtext("duration")),
+                    )
+            elif elem.tag == "clipitem":
+                clip_depth -= 1
+                file_elem = elem.find("file")
+                media = files.get(file_elem.get("id")) if file_elem is not None else None
+                if media:
+                    path, duration = media
+                    yield path, int_or_none(elem.findtext("in")), int_or_none(elem.findtext("out")), duration
+
+            # keep clipitems whole until they close, drop everything else as it finishes
+            if clip_depth == 0:
+                elem.clear()
+                if open_elements:
+                    open_elements[-1].remove(elem)
     except et.ParseError as error:
         warnings.warn(
             f"XML parse failed ({error}). Falling back to best-effort pathurl extraction.",
             RuntimeWarning,
         )
-        return extract_pathurls_from_malformed_xml(xml_path)
+        for path in iter_pathurls_from_malformed_xml(xml_path):
+            yield path, None, None, None
+
+def sequence_frame_path(prefix: str, frame: int, padding: int, ext: str) -> str:
+    return f"{prefix}{frame:0{padding}d}{ext}"
+
+def is_image_sequence(match: "re.Match[str]") -> bool:
+    """True if the frame after a SEQUENCE_FRAME match exists on disk.
+
+    Stills are often numbered too (IMG_1234.jpg), so a numbered name alone
+    doesn't make a sequence.
+    """
+    prefix, start, ext = match.group("prefix"), match.group("frame"), match.group("ext")
+    return os.path.exists(sequence_frame_path(prefix, int(start) + 1, len(start), ext))
+
+def iter_frames_from_xml(xml_path: str, handles: int = 0) -> Iterator[str]:
+    """Like iter_pathurls_from_xml, but image sequences only yield the frames the cut uses."""
+    return expand_frames(iter_clip_media_from_xml(xml_path), handles=handles)
+
+def expand_frames(clips: Iterable[ClipMedia], handles: int = 0) -> Iterator[str]:
+    """Media paths for (path, in, out, duration) clips, with image sequences narrowed to the frames used.
+
+    A sequence's pathurl points at its first frame. Each clipitem's in/out
+    (out is exclusive) are offsets from that frame, widened by `handles`
+    frames either side and kept inside the media's duration. Movie files,
+    stills, offline media whose next frame can't be found, and sequences
+    without usable timing, are yielded as they appear in the XML. Whether a
+    numbered file is a sequence is checked on disk here, so clips can be
+    cached but their expansion can't.
+    """
+    ranges: Dict[str, List[Tuple[int, int]]] = {}
+    sequences: Dict[str, bool] = {}
+    for path, clip_in, clip_out, duration in clips:
+        match = SEQUENCE_FRAME.match(path)
+        if match and path not in sequences:
+            sequences[path] = is_image_sequence(match)
+        if not match or not sequences[path]:
+            yield path
+            continue
+
+        if clip_in is None or clip_out is None or clip_in < 0 or clip_out <= clip_in:
+            if not duration:
+                yield path
+                continue
+            clip_in, clip_out = 0, duration
+
+        first = max(0, clip_in - handles)
+        last = clip_out - 1 + handles
+        if duration:
+            last = min(last, duration - 1)
+        ranges.setdefault(path, []).append((first, last))
+
+    for path, spans in ranges.items():
+        match = SEQUENCE_FRAME.match(path)
+        prefix, start, ext = match.group("prefix"), match.group("frame"), match.group("ext")
+        covered = -1
+        for first, last in sorted(spans):
+            for offset in range(max(first, covered + 1), last + 1):
+                yield sequence_frame_path(prefix, int(start) + offset, len(start), ext)
+            covered = max(covered, last)
+
+def extract_filepaths(timeline_path: str, frame_ranges: bool = False, handles: int = 0) -> List[str]:
+    """Unique media paths from an XML or AAF, before any ignore filtering."""
+    if str(timeline_path).lower().endswith(".aaf"):
+        return list(dict.fromkeys(extract_files_from_aaf(timeline_path)))
+    if frame_ranges:
+        return list(dict.fromkeys(iter_frames_from_xml(timeline_path, handles=handles)))
+    return list(dict.fromkeys(iter_pathurls_from_xml(timeline_path)))
 
 def filepaths_from_xml(xml_path: str, 
-                       ignore_paths: Optional[List[str]] = None) -> List[str]:
-    """Returns list of unique file paths from the Premiere XML."""
+                       ignore_paths: Optional[List[str]] = None,
+                       frame_ranges: bool = False,
+                       handles: int = 0) -> List[str]:
+    """Returns list of unique file paths from the Premiere XML.
+
+    With frame_ranges, image sequences are narrowed to the frames the cut
+    uses plus `handles` frames either side.
+    """
     ignore_paths = ignore_paths or []
 
-    src_files = extract_pathurls_from_xml(xml_path)
+    if frame_ranges:
+        src_files = iter_frames_from_xml(xml_path, handles=handles)
+    else:
+        src_files = iter_pathurls_from_xml(xml_path)
     filtered_files = filter_ignored_paths(src_files, ignore_paths)
     
     return list(set(filtered_files))
\ No newline at end of file
@@ -25,7 +25,7 @@ def test_parse_arguments_input_variables_are_cast_accurately():
              
              args = a.parse_arguments()
              
-             assert args.source == Path('some_source.xml')
+             assert args.source == [Path('some_source.xml')]
              assert args.destination == Path('/some/destination')
              assert '/path/to/exclude1' in args.exclude_directories
              assert '/path/to/exclude2' in args.exclude_directories
@@ -38,6 +38,22 @@ def test_parse_arguments_invalid_directory():
          pytest.raises(SystemExit):
              a.parse_arguments()
              
+def test_parse_arguments_rejects_unavailable_checksum(capsys):
+    argv = ['prog_name', '-s', 'some_source.xml', '-d', '/some/destination', '--checksum', 'xxhash64']
+    with patch('sys.argv', argv), \
+         patch('archive_nle.Path.is_file', return_value=True), \
+         patch('archive_nle.Path.is_dir', return_value=True), \
+         patch.dict('sys.modules', {'xxhash': None}):
+        with pytest.raises(SystemExit):
+            a.parse_arguments()
+    assert "pip install xxhash" in capsys.readouterr().err
+
+    # md5 needs nothing extra
+    with patch('sys.argv', argv[:-1] + ['md5']), \
+         patch('archive_nle.Path.is_file', return_value=True), \
+         patch('archive_nle.Path.is_dir', return_value=True):
+        assert a.parse_arguments().checksum == 'md5'
+
 def test_get_destination_path():
     x = a.destination_path(Path('/Volumes/raid1/dailies/test.mov'), 
                            Path('/Volumes/raid2/'))
@@ -48,7 +64,7 @@ def test_is_file_copied_not():
     
 def test_uncopied_files():
     
-    with patch('archive_nle.file_exists', return_value=True):
+    with patch('archive_nle.directory_listing', return_value={'test1.mov', 'test2.mov'}):
 
         srcs = [Path('/Volumes/raid1/dailies/test1.mov'), Path('/Volumes/raid1/dailies/test2.mov')]
         uncopied_files = a.uncopied_files(srcs, Path('/Volumes/raid2/'))
@@ -56,7 +72,7 @@ def test_uncopied_files():
     
         assert uncopied_files != compare
         
-    with patch('archive_nle.file_exists', return_value=False):
+    with patch('archive_nle.directory_listing', return_value=set()):
 
         srcs = [Path('/Volumes/raid1/dailies/test1.mov'), Path('/Volumes/raid1/dailies/test2.mov')]
         uncopied_files = a.uncopied_files(srcs, Path('/Volumes/raid2/'))
@@ -191,4 +207,1394 @@ def test_determine_destination_heiarchy(tmp_path: Path):
     assert result.name.endswith('2pop_24fps_MyProject.mov')
     
 def test_copy_files_shutil():
-    assert 1 == 1
\ No newline at end of file
+    assert 1 == 1
+def test_iter_pathurls_from_xml_matches_full_parse():
+    import xml.etree.ElementTree as et
+    tree = et.parse('tests/xmls/TEST_230918.xml')
+    expected = [s.unquoted_path_from_url(p.text) for p in tree.findall('.//pathurl') if p.text]
+    assert list(s.iter_pathurls_from_xml('tests/xmls/TEST_230918.xml')) == expected
+
+def test_iter_pathurls_from_xml_fallback_does_not_repeat(tmp_path: Path):
+    malformed_xml = tmp_path / "malformed.xml"
+    malformed_xml.write_text(
+        "<xmeml>\n"
+        "    <clipitem><pathurl>file://localhost/Volumes/Media/A.mov</pathurl></clipitem>\n"
+        "    <clipitem><pathurl>file://localhost/Volumes/Media/B.mov</pathurl>\n"
+        "    <broken>\n"
+        "</xmeml>\n",
+        encoding="utf-8",
+    )
+
+    with pytest.warns(RuntimeWarning):
+        result = list(s.iter_pathurls_from_xml(str(malformed_xml)))
+
+    assert result == ["/Volumes/Media/A.mov", "/Volumes/Media/B.mov"]
+
+def test_iter_pathurls_from_xml_fallback_matches_by_value(tmp_path: Path):
+    # the scanner drops the blank pathurl the parser yielded, so skipping by count would lose C.mov
+    malformed_xml = tmp_path / "malformed.xml"
+    malformed_xml.write_text(
+        "<xmeml>\n"
+        "    <clipitem><pathurl> </pathurl></clipitem>\n"
+        "    <clipitem><pathurl>file://localhost/Volumes/Media/A.mov</pathurl></clipitem>\n"
+        "    <broken></clipitem>\n"
+        "    <clipitem><pathurl>file://localhost/Volumes/Media/C.mov</pathurl></clipitem>\n"
+        "    <!-- <pathurl>file://localhost/Volumes/Media/A.mov</pathurl> -->\n"
+        "</xmeml>\n",
+        encoding="utf-8",
+    )
+
+    with pytest.warns(RuntimeWarning):
+        result = list(s.iter_pathurls_from_xml(str(malformed_xml)))
+
+    assert "/Volumes/Media/C.mov" in result
+    assert result.count("/Volumes/Media/A.mov") == 1
+
+def test_volume_name():
+    assert a.volume_name(Path('/Volumes/raid1/dailies/test.mov')) == 'raid1'
+    assert a.volume_name(Path('/Volumes/raid1')) == 'raid1'
+    assert a.volume_name(Path('/tmp/test.mov')) == '/'
+
+def test_volume_limit_argument():
+    assert a.volume_limit('RAID 1=4') == ('RAID 1', 4)
+    with pytest.raises(Exception):
+        a.volume_limit('RAID1')
+
+def test_copy_files_shutil_parallel(tmp_path: Path):
+    src_base = tmp_path / "src"
+    src_base.mkdir()
+    srcs = []
+    for i in range(8):
+        src = src_base / f"clip{i}.mov"
+        src.write_bytes(b"x" * (i + 1))
+        srcs.append(src)
+    dst_base = tmp_path / "dst"
+
+    with patch('archive_nle.datetime') as mock_datetime:
+        mock_datetime.now.return_value.strftime.return_value = "230918000000"
+        a.copy_files_shutil(srcs, dst_base, flat=True, jobs=4)
+
+    for src in srcs:
+        assert (dst_base / "230918000000" / src.name).read_bytes() == src.read_bytes()
+
+def test_volume_limiter_caps_streams():
+    limiter = a.VolumeLimiter(default=2, limits={'nas': 1})
+    active = {'raid1': 0, 'nas': 0}
+    peak = {'raid1': 0, 'nas': 0}
+    lock = a.threading.Lock()
+
+    def fake_copy(volume):
+        with limiter.streams(Path(f'/Volumes/{volume}/a'), Path(f'/Volumes/{volume}/b')):
+            with lock:
+                active[volume] += 1
+                peak[volume] = max(peak[volume], active[volume])
+            a.time.sleep(0.01)
+            with lock:
+                active[volume] -= 1
+
+    with a.ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(fake_copy, ['raid1', 'nas'] * 8))
+
+    assert peak['raid1'] <= 2
+    assert peak['nas'] == 1
+
+def test_copy_journal_plan(tmp_path: Path):
+    import sqlite3
+    from journal import CopyJournal, PlannedFile
+    journal = CopyJournal(tmp_path / "journal.sqlite", job="test")
+    xml_src, flat_src = Path("/Volumes/RAID/A001.mov"), Path("/Volumes/RAID/B001.mxf")
+    journal.plan([PlannedFile(xml_src, tmp_path / "RAID" / "A001.mov", 10, 1.5), PlannedFile(flat_src)])
+
+    def row(src):
+        with sqlite3.connect(tmp_path / "journal.sqlite") as conn:
+            return conn.execute("SELECT dst, size, mtime, state FROM files WHERE src=?", (str(src),)).fetchone()
+
+    assert row(xml_src) == (str(tmp_path / "RAID" / "A001.mov"), 10, 1.5, "planned")
+    assert row(flat_src) == (None, None, None, "planned")
+
+    # planning again updates the details, but a known destination isn't lost and a failure stays a failure
+    journal.fail(flat_src, tmp_path / "240101" / "B001.mxf", "I/O error")
+    journal.plan([PlannedFile(xml_src, tmp_path / "RAID" / "A001.mov", 12, 2.5), PlannedFile(flat_src, None, 20, 3.0)])
+    assert row(xml_src) == (str(tmp_path / "RAID" / "A001.mov"), 12, 2.5, "planned")
+    assert row(flat_src) == (str(tmp_path / "240101" / "B001.mxf"), 20, 3.0, "failed")
+
+    # completed rows keep what was actually copied
+    journal.complete(xml_src, tmp_path / "RAID" / "A001.mov", size=12, mtime=2.5)
+    journal.plan([PlannedFile(xml_src, tmp_path / "RAID" / "A001.mov", 99, 9.0)])
+    assert row(xml_src) == (str(tmp_path / "RAID" / "A001.mov"), 12, 2.5, "completed")
+    journal.close()
+
+def test_copy_journal_resume(tmp_path: Path):
+    from journal import CopyJournal, PlannedFile
+    src_base = tmp_path / "src"
+    src_base.mkdir()
+    srcs = [src_base / "clip1.mov", src_base / "clip2.mov"]
+    for src in srcs:
+        src.write_bytes(b"data")
+    dst_base = tmp_path / "dst"
+
+    journal = CopyJournal(tmp_path / "journal.sqlite", job="test")
+    journal.plan(PlannedFile(src, None, 4, src.stat().st_mtime) for src in srcs)
+    assert journal.state(srcs[0]) == "planned"
+
+    with patch('archive_nle.datetime') as mock_datetime:
+        mock_datetime.now.return_value.strftime.return_value = "230918000000"
+        a.copy_files_shutil(srcs[:1], dst_base, flat=True, journal=journal)
+
+    assert journal.completed() == {str(srcs[0])}
+
+    # simulate a copy that was interrupted halfway through
+    partial = dst_base / "230918000000" / "clip2.mov"
+    partial.write_bytes(b"da")
+    journal.start(srcs[1], partial)
+    journal.close()
+    unfinished_pack = dst_base / "230918000000" / "archive_nle_pack_0001.tar.partial"
+    unfinished_pack.write_bytes(b"tar")
+
+    resumed = CopyJournal(tmp_path / "journal.sqlite", job="test")
+    assert resumed.reset_interrupted() == 1
+    assert not partial.exists()
+    assert not unfinished_pack.exists()
+    assert resumed.state(srcs[1]) == "planned"
+    assert resumed.completed() == {str(srcs[0])}
+
+def test_copy_file_with_checksum(tmp_path: Path):
+    import hashlib
+    src = tmp_path / "src" / "clip.mov"
+    src.parent.mkdir()
+    src.write_bytes(b"frame" * 1000)
+    dst = tmp_path / "dst" / "clip.mov"
+
+    result = a.copy_file(src, dst, checksum="md5")
+
+    assert result.digest == hashlib.md5(src.read_bytes()).hexdigest()
+    assert dst.read_bytes() == src.read_bytes()
+    assert dst.stat().st_mtime == src.stat().st_mtime
+
+def test_verify_archive_catches_corruption(tmp_path: Path):
+    src_base = tmp_path / "src"
+    src_base.mkdir()
+    srcs = [src_base / "clip1.mov", src_base / "clip2.mov"]
+    for src in srcs:
+        src.write_bytes(src.name.encode() * 100)
+
+    with patch('archive_nle.datetime') as mock_datetime:
+        mock_datetime.now.return_value.strftime.return_value = "230918000000"
+        archive_root = a.copy_files_shutil(srcs, tmp_path / "dst", flat=True, checksum="sha1")
+
+    manifest = archive_root / "fixity.csv"
+    assert manifest.exists()
+    assert a.verify_archive(archive_root) == []
+
+    (archive_root / "clip2.mov").write_bytes(b"bit rot" * 100)
+    with patch('archive_nle.log_failed_copy'):
+        assert a.verify_archive(archive_root) == [archive_root / "clip2.mov"]
+    assert not (archive_root / "clip2.mov").exists()
+
+def test_verify_archive_only_checks_this_run(tmp_path: Path):
+    src_base = tmp_path / "src"
+    src_base.mkdir()
+    old, new, small = src_base / "old.mov", src_base / "new.mov", src_base / "new.xmp"
+    for src, size in ((old, 100), (new, 100), (small, 1)):
+        src.write_bytes(src.name.encode() * size)
+
+    with patch('archive_nle.datetime') as mock_datetime:
+        mock_datetime.now.return_value.strftime.return_value = "230918000000"
+        archive_root = a.copy_files_shutil([old], tmp_path / "dst", flat=True, checksum="md5")
+        written: List[Path] = []
+        a.copy_files_shutil(
+            [new, small], tmp_path / "dst", flat=True, checksum="md5", pack_threshold=100, written=written
+        )
+    assert sorted(path.name for path in written) == ["archive_nle_pack_0001.tar", "new.mov"]
+
+    # an earlier run's damage is left for the audit, this run's files are checked
+    (archive_root / "old.mov").write_bytes(b"bit rot" * 100)
+    assert a.verify_archive(archive_root, written=written) == []
+    (archive_root / "new.mov").write_bytes(b"bit rot" * 100)
+    with patch('archive_nle.log_failed_copy'):
+        assert a.verify_archive(archive_root, written=written) == [archive_root / "new.mov"]
+
+# these folders are all written moments before the refresh, so allow no mtime slack
+@patch('destination_index.MTIME_SLACK_NS', 0)
+def test_destination_index_refresh(tmp_path: Path):
+    from destination_index import DestinationIndex
+    files = [
+        tmp_path / "Avid MediaFiles" / "MXF" / "1" / "A010C318.MXF",
+        tmp_path / "Avid MediaFiles" / "MXF" / "2" / "A010C356.MXF",
+        tmp_path / "OMFI MediaFiles" / "1" / "A010C318.WAV",
+    ]
+    for file in files:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(b"media")
+
+    index = DestinationIndex(tmp_path)
+    assert index.refresh() == 7
+    assert index.names() == {f.name for f in files}
+    assert a.filenames_in_path(tmp_path, ["MXF"], index=index) == {"A010C318.MXF", "A010C356.MXF"}
+    assert a.filenames_in_path(tmp_path / "OMFI MediaFiles", ["*"], index=index) == {"A010C318.WAV"}
+
+    # a new file only re-lists the folder it was added to
+    new_file = tmp_path / "Avid MediaFiles" / "MXF" / "2" / "A010C357.MXF"
+    new_file.write_bytes(b"more media")
+    assert index.refresh() == 1
+    assert (new_file, 10) in set(index.files())
+    index.close()
+
+    # the index persists in the destination root
+    reopened = DestinationIndex(tmp_path)
+    assert reopened.refresh() == 0
+    assert "A010C357.MXF" in reopened.names()
+
+def test_destination_index_skips_unreadable_and_recent_folders(tmp_path: Path):
+    import os, time
+    from destination_index import DestinationIndex
+    for folder in ("readable", "locked"):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "clip.mov").write_bytes(b"media")
+    index = DestinationIndex(tmp_path)
+    old = time.time() - 60
+    for folder in (tmp_path / "readable", tmp_path / "locked", tmp_path):
+        os.utime(folder, (old, old))
+
+    real_scandir = os.scandir
+    def scandir(path):
+        if Path(path).name == "locked":
+            raise PermissionError(13, "Permission denied", str(path))
+        return real_scandir(path)
+
+    with patch('destination_index.os.scandir', side_effect=scandir):
+        assert index.refresh() == 2
+    assert index.names() == {"clip.mov"}
+    assert {path for path, _ in index.files()} == {tmp_path / "readable" / "clip.mov"}
+
+    # the locked folder wasn't cached, so it is listed once it can be read
+    assert index.refresh() == 1
+    assert {path for path, _ in index.files()} == {tmp_path / folder / "clip.mov" for folder in ("readable", "locked")}
+
+    # a folder changed moments ago is listed again on the next refresh
+    (tmp_path / "readable" / "new.mov").write_bytes(b"media")
+    assert index.refresh() == 1
+    assert index.refresh() == 1
+    index.close()
+
+def test_uncopied_files_lists_each_folder_once(tmp_path: Path):
+    srcs = [Path(f'/Volumes/raid1/dailies/day{d}/clip{c}.mov') for d in range(3) for c in range(4)]
+    copied = tmp_path / 'raid1' / 'dailies' / 'day1' / 'clip2.mov'
+    copied.parent.mkdir(parents=True)
+    copied.touch()
+
+    with patch('archive_nle.directory_listing', wraps=a.directory_listing) as listing:
+        result = a.uncopied_files(srcs, tmp_path)
+
+    assert listing.call_count == 3
+    assert result == [src for src in srcs if src != Path('/Volumes/raid1/dailies/day1/clip2.mov')]
+
+def test_stat_sources(tmp_path: Path):
+    present = tmp_path / "clip.mov"
+    present.write_bytes(b"12345")
+    missing = tmp_path / "gone.mov"
+
+    stats = a.stat_sources([str(present), present, missing], retries=2, delay=0)
+
+    assert set(stats) == {present, missing}
+    assert stats[present].size == 5
+    assert stats[present].exists
+    assert stats[present].mtime == present.stat().st_mtime
+    assert stats[missing] == a.MISSING
+    assert a.get_file_size_with_retry(str(present), 1, 0) == 5
+
+def test_stat_errors_from_a_flaky_share(tmp_path: Path):
+    import errno
+    present = tmp_path / "clip.mov"
+    present.write_bytes(b"12345")
+    real_stat = a.os.stat
+    calls = []
+
+    def flaky_stat(path, *args, **kwargs):
+        calls.append(str(path))
+        if str(path).endswith("denied.mov"):
+            raise PermissionError(errno.EACCES, "Permission denied")
+        if calls.count(str(path)) == 1:
+            raise OSError(errno.ETIMEDOUT, "Connection timed out")
+        return real_stat(path, *args, **kwargs)
+
+    # transient errors are retried, anything else counts as missing instead of stopping the run
+    missing = tmp_path / "gone.mov"
+    with patch('archive_nle.os.stat', side_effect=flaky_stat):
+        stats = a.stat_sources([present, tmp_path / "denied.mov", missing], delay=0)
+    assert stats[present].size == 5
+    assert stats[tmp_path / "denied.mov"] == a.MISSING
+    assert calls.count(str(tmp_path / "denied.mov")) == 1
+    # one retry after the timeout, none once the file turns out to be missing
+    assert calls.count(str(missing)) == 2
+
+    # offline media isn't waited on, however many retries are allowed
+    with patch('archive_nle.time.sleep') as sleep:
+        assert a.stat_with_retry(missing, retries=3, delay=10) == a.MISSING
+    sleep.assert_not_called()
+
+def test_fast_copy_strategies(tmp_path: Path):
+    import fastcopy
+    src = tmp_path / "clip.mov"
+    src.write_bytes(bytes(range(256)) * 4096)
+
+    dst = tmp_path / "dst" / "clip.mov"
+    result = a.copy_file(src, dst, buffer_size=64 * 1024)
+    assert result.strategy in fastcopy.STRATEGIES
+    assert dst.read_bytes() == src.read_bytes()
+    assert dst.stat().st_mtime == src.stat().st_mtime
+
+    # every strategy that is available here produces an identical copy
+    for name, strategy in fastcopy.STRATEGIES.items():
+        other = tmp_path / f"{name}.mov"
+        with open(src, "rb") as fsrc, open(other, "wb") as fdst:
+            try:
+                strategy(fsrc.fileno(), fdst.fileno(), src.stat().st_size, 64 * 1024)
+            except fastcopy.StrategyUnavailable:
+                continue
+        assert other.read_bytes() == src.read_bytes()
+
+def test_fast_copy_falls_back_to_buffered(tmp_path: Path):
+    import fastcopy
+    src = tmp_path / "clip.mov"
+    src.write_bytes(b"frame" * 1000)
+    dst = tmp_path / "copy.mov"
+
+    def unavailable(*args):
+        raise fastcopy.StrategyUnavailable("not here")
+
+    with patch.dict(fastcopy.STRATEGIES, {"reflink": unavailable, "copy_file_range": unavailable, "sendfile": unavailable}):
+        assert fastcopy.fast_copy(src, dst) == "buffered"
+    assert dst.read_bytes() == src.read_bytes()
+
+def test_buffered_copy_finishes_short_writes(tmp_path: Path):
+    import fastcopy
+    src = tmp_path / "clip.mov"
+    src.write_bytes(bytes(range(256)) * 64)
+    dst = tmp_path / "copy.mov"
+
+    class ShortWrites:
+        """Writes at most `limit` bytes per call, like a raw write to a pipe or network share."""
+        def __init__(self, file, limit):
+            self.file, self.limit = file, limit
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            self.file.close()
+        def readinto(self, buffer):
+            return self.file.readinto(buffer)
+        def write(self, data):
+            return self.file.write(data[:self.limit])
+
+    def short_open(limit):
+        return lambda fd, mode, **kwargs: ShortWrites(open(fd, mode, **kwargs), limit)
+
+    size = src.stat().st_size
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst, \
+         patch("fastcopy.open", short_open(100), create=True):
+        fastcopy.copy_buffered(fsrc.fileno(), fdst.fileno(), size, 4096)
+    assert dst.read_bytes() == src.read_bytes()
+
+    # a write that makes no progress is a short copy, not a silent truncation
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst, \
+         patch("fastcopy.open", short_open(0), create=True):
+        with pytest.raises(OSError, match="short copy"):
+            fastcopy.copy_buffered(fsrc.fileno(), fdst.fileno(), size, 4096)
+
+def test_fast_copy_when_the_kernel_copies_nothing(tmp_path: Path):
+    import fastcopy
+    src = tmp_path / "clip.mov"
+    src.write_bytes(b"frame" * 1000)
+    dst = tmp_path / "copy.mov"
+
+    def unavailable(*args):
+        raise fastcopy.StrategyUnavailable("not here")
+
+    # some FUSE and cross-filesystem paths return 0 instead of failing
+    with patch.dict(fastcopy.STRATEGIES, {"reflink": unavailable}), \
+         patch("os.copy_file_range", return_value=0, create=True), \
+         patch("os.sendfile", return_value=0):
+        assert fastcopy.fast_copy(src, dst) == "buffered"
+    assert dst.read_bytes() == src.read_bytes()
+
+    # stopping part way through is a failed copy, not a fallback
+    sent = iter([100, 0])
+    with patch("os.copy_file_range", side_effect=lambda *args: next(sent), create=True):
+        with pytest.raises(OSError, match="short copy"):
+            fastcopy.copy_range(0, 0, 5000, 1024)
+
+def test_iter_frames_from_xml(tmp_path: Path):
+    xml = tmp_path / "sequence.xml"
+    xml.write_text(
+        """<?xml version="1.0" encoding="UTF-8"?>
+<xmeml version="4">
+    <sequence>
+        <media><video><track>
+            <clipitem id="clipitem-1">
+                <in>10</in>
+                <out>13</out>
+                <file id="file-1">
+                    <pathurl>file://localhost/Volumes/VFX/shot010/shot010.1001.dpx</pathurl>
+                    <duration>100</duration>
+                </file>
+            </clipitem>
+            <clipitem id="clipitem-2">
+                <in>12</in>
+                <out>15</out>
+                <file id="file-1"/>
+            </clipitem>
+            <clipitem id="clipitem-3">
+                <in>98</in>
+                <out>100</out>
+                <file id="file-1"/>
+            </clipitem>
+            <clipitem id="clipitem-4">
+                <in>0</in>
+                <out>24</out>
+                <file id="file-2">
+                    <pathurl>file://localhost/Volumes/Media/A001.mov</pathurl>
+                    <duration>240</duration>
+                </file>
+            </clipitem>
+            <clipitem id="clipitem-5">
+                <in>0</in>
+                <out>120</out>
+                <file id="file-3">
+                    <pathurl>file://localhost/Volumes/Stills/IMG_1234.jpg</pathurl>
+                    <duration>1080000</duration>
+                </file>
+            </clipitem>
+            <clipitem id="clipitem-6">
+                <in>0</in>
+                <out>48</out>
+                <file id="file-4">
+                    <pathurl>file://localhost/Volumes/Offline/shot020.1001.exr</pathurl>
+                    <duration>100</duration>
+                </file>
+            </clipitem>
+        </track></video></media>
+    </sequence>
+</xmeml>
+""",
+        encoding="utf-8",
+    )
+
+    # the sequence is on disk, the still's neighbours aren't part of it, the EXRs are offline
+    on_disk = {f"/Volumes/VFX/shot010/shot010.{n}.dpx" for n in range(1001, 1101)}
+    on_disk |= {"/Volumes/Stills/IMG_1234.jpg", "/Volumes/Stills/IMG_1236.jpg"}
+    exists = patch("search.os.path.exists", side_effect=lambda path: path in on_disk)
+
+    with exists:
+        frames = list(s.iter_frames_from_xml(str(xml)))
+    assert "/Volumes/Media/A001.mov" in frames
+    assert sorted(f for f in frames if f.endswith(".dpx")) == [
+        f"/Volumes/VFX/shot010/shot010.{n}.dpx" for n in [1011, 1012, 1013, 1014, 1015, 1099, 1100]
+    ]
+    # numbered stills, and media whose next frame can't be found, are archived as they are
+    assert [f for f in frames if f.endswith(".jpg")] == ["/Volumes/Stills/IMG_1234.jpg"]
+    assert [f for f in frames if f.endswith(".exr")] == ["/Volumes/Offline/shot020.1001.exr"]
+
+    # handles widen each range but stay inside the media
+    with exists:
+        with_handles = s.filepaths_from_xml(str(xml), frame_ranges=True, handles=2)
+    assert "/Volumes/VFX/shot010/shot010.1009.dpx" in with_handles
+    assert "/Volumes/VFX/shot010/shot010.1017.dpx" in with_handles
+    assert "/Volumes/VFX/shot010/shot010.1101.dpx" not in with_handles
+
+def test_timeline_paths(tmp_path: Path):
+    reels = tmp_path / "reels"
+    reels.mkdir()
+    for name in ["R1.xml", "R2.XML", "R3.aaf", "notes.txt"]:
+        (reels / name).touch()
+    extra = tmp_path / "R0.xml"
+    extra.touch()
+
+    result = a.timeline_paths([extra, reels / "R1.xml"], [str(reels)])
+
+    assert result == [extra, reels / "R1.xml", reels / "R2.XML", reels / "R3.aaf"]
+
+def test_plan_timelines_parses_in_parallel(tmp_path: Path):
+    xml = Path('tests/xmls/TEST_230918.xml')
+    copy = tmp_path / "REEL2.xml"
+    copy.write_bytes(xml.read_bytes())
+
+    timelines = a.plan_timelines([xml, copy], processes=2)
+
+    assert set(timelines) == {xml, copy}
+    assert sorted(timelines[xml]) == sorted(timelines[copy])
+    assert sorted(timelines[xml]) == sorted(s.filepaths_from_xml(str(xml)))
+
+def test_ignore_matcher_whole_components():
+    matcher = s.IgnoreMatcher(['/Volumes/Media/Dailies', '/Volumes/Media/Sound/'])
+    assert matcher.matches('/Volumes/Media/Dailies/A001.mov')
+    assert matcher.matches('/Volumes/Media/Sound/mix.wav')
+    assert not matcher.matches('/Volumes/Media/Dailies2/A001.mov')
+    assert not matcher.matches('/Volumes/Media/A001.mov')
+
+def test_ignore_matcher_globs():
+    files = [
+        '/Volumes/Media/Day01/Camera Roll A/A001.mov',
+        '/Volumes/Media/Day02/Camera Roll B/B001.mov',
+        '/Volumes/Media/Day02/Sound/S001.wav',
+        '/Volumes/Archive/Day01/Camera Roll A/A001.mov',
+    ]
+    result = s.filter_ignored_paths(files, ['/Volumes/Media/*/Camera Roll ?'])
+    assert result == ['/Volumes/Media/Day02/Sound/S001.wav', '/Volumes/Archive/Day01/Camera Roll A/A001.mov']
+
+def write_test_aaf(aaf_path: Path, urls: List[List[str]]):
+    aaf2 = pytest.importorskip('aaf2')
+    with aaf2.open(str(aaf_path), 'w') as f:
+        for i, mob_urls in enumerate(urls):
+            mob = f.create.SourceMob()
+            mob.name = f"clip{i}"
+            desc = f.create.CDCIDescriptor()
+            desc['ComponentWidth'].value = 8
+            desc['HorizontalSubsampling'].value = 2
+            desc['ImageAspectRatio'].value = '16/9'
+            desc['StoredWidth'].value = 1920
+            desc['StoredHeight'].value = 1080
+            desc['FrameLayout'].value = 'FullFrame'
+            desc['VideoLineMap'].value = [42, 0]
+            desc['SampleRate'].value = 25
+            desc['Length'].value = 10
+            for url in mob_urls:
+                loc = f.create.NetworkLocator()
+                loc['URLString'].value = url
+                desc['Locator'].append(loc)
+            mob.descriptor = desc
+            f.content.mobs.append(mob)
+        # a composition mob has no descriptor and must be skipped
+        f.content.mobs.append(f.create.CompositionMob())
+
+def test_fast_aaf_scanner_matches_aaf2(tmp_path: Path):
+    import aaf_locators
+    aaf_path = tmp_path / "bin.aaf"
+    urls = [
+        [f"file:///Volumes/Avid%20Media/Avid%20MediaFiles/MXF/1/clip{i}_{j}.mxf" for j in range(i % 3)]
+        for i in range(200)
+    ]
+    # long enough to be stored outside the mini stream
+    urls.append(["file:///Volumes/Media/" + "deep/" * 1000 + "clip.mxf"])
+    write_test_aaf(aaf_path, urls)
+
+    fast = [s.unquoted_path_from_url(url) for url in aaf_locators.locator_urls(str(aaf_path))]
+
+    assert sorted(fast) == sorted(s.extract_files_from_aaf2(str(aaf_path)))
+    assert sorted(s.extract_files_from_aaf(str(aaf_path))) == sorted(fast)
+
+def test_fast_aaf_scanner_rejects_non_aaf(tmp_path: Path):
+    import aaf_locators
+    not_aaf = tmp_path / "bin.aaf"
+    not_aaf.write_bytes(b"not a compound file" * 100)
+    with pytest.raises(aaf_locators.UnsupportedAAF):
+        list(aaf_locators.locator_urls(str(not_aaf)))
+
+def test_damaged_aaf_falls_back_to_aaf2(tmp_path: Path):
+    import aaf_locators
+    aaf_path = tmp_path / "bin.aaf"
+    write_test_aaf(aaf_path, [["file:///Volumes/Media/A001.mxf"], ["file:///Volumes/Media/B001.mxf"]])
+    expected = sorted(s.extract_files_from_aaf2(str(aaf_path)))
+
+    bad_utf16 = UnicodeDecodeError("utf-16-le", b"\x00", 0, 1, "truncated data")
+    damaged = [
+        patch("aaf_locators.CompoundFile.read_stream", return_value=b""),
+        patch("aaf_locators.CompoundFile.children", side_effect=IndexError("list index out of range")),
+        patch("aaf_locators.url_string", side_effect=bad_utf16),
+    ]
+    for damage in damaged:
+        with damage:
+            with pytest.raises(aaf_locators.UnsupportedAAF):
+                list(aaf_locators.locator_urls(str(aaf_path)))
+            assert sorted(s.extract_files_from_aaf(str(aaf_path))) == expected
+
+def test_timeline_cache(tmp_path: Path):
+    from timeline_cache import TimelineCache
+    xml = tmp_path / "REEL1.xml"
+    xml.write_bytes(Path('tests/xmls/TEST_230918.xml').read_bytes())
+    cache_path = tmp_path / "cache.sqlite"
+
+    first = a.timeline_filepaths(xml, cache_path=cache_path)
+    assert sorted(first) == sorted(s.filepaths_from_xml(str(xml)))
+
+    # a second run is served from the cache, with ignore paths applied on top
+    ignore = ['/Volumes/Media/MyMovie/Media/Dailies - ProResHQ']
+    with patch('search.extract_filepaths') as extract:
+        cached = a.timeline_filepaths(xml, ignore_paths=ignore, cache_path=cache_path)
+    extract.assert_not_called()
+    assert sorted(cached) == sorted(s.filepaths_from_xml(str(xml), ignore_paths=ignore))
+
+    # editing the timeline invalidates its entry
+    xml.write_bytes(xml.read_bytes().replace(b"2pop_24fps", b"3pop_24fps"))
+    edited = a.timeline_filepaths(xml, cache_path=cache_path)
+    assert any("3pop_24fps" in path for path in edited)
+
+def test_timeline_cache_expands_frames_after_lookup(tmp_path: Path):
+    xml = tmp_path / "VFX.xml"
+    xml.write_text(
+        """<?xml version="1.0" encoding="UTF-8"?>
+<xmeml version="4"><sequence><media><video><track>
+    <clipitem id="clipitem-1">
+        <in>10</in>
+        <out>12</out>
+        <file id="file-1">
+            <pathurl>file://localhost/Volumes/VFX/shot|010/shot010.1001.dpx</pathurl>
+            <duration>100</duration>
+        </file>
+    </clipitem>
+</track></video></media></sequence></xmeml>
+""",
+        encoding="utf-8",
+    )
+    cache_path = tmp_path / "cache.sqlite"
+    first_frame = "/Volumes/VFX/shot|010/shot010.1001.dpx"
+
+    # while the sequence is offline its first frame is all there is to archive
+    with patch("search.os.path.exists", return_value=False):
+        assert a.timeline_filepaths(xml, frame_ranges=True, cache_path=cache_path) == [first_frame]
+
+    # once it's online the cached clips expand to the frames used, without parsing again
+    with patch("search.os.path.exists", return_value=True), \
+         patch("search.iter_clip_media_from_xml") as parse:
+        frames = a.timeline_filepaths(xml, frame_ranges=True, handles=1, cache_path=cache_path)
+    parse.assert_not_called()
+    assert sorted(frames) == [f"/Volumes/VFX/shot|010/shot010.{n}.dpx" for n in range(1010, 1014)]
+
+def test_timeline_cache_eviction(tmp_path: Path):
+    from timeline_cache import TimelineCache
+    cache = TimelineCache(tmp_path / "cache.sqlite", max_entries=2)
+    sources = []
+    for i in range(3):
+        source = tmp_path / f"REEL{i}.xml"
+        source.write_text(f"<xmeml>{i}</xmeml>")
+        sources.append(source)
+        cache.put(source, [f"/Volumes/Media/{i}.mov"])
+        a.time.sleep(0.01)
+
+    assert cache.get(sources[0]) is None
+    assert cache.get(sources[2]) == ["/Volumes/Media/2.mov"]
+    cache.close()
+
+def test_extract_pathurls_from_malformed_xml_edge_cases(tmp_path: Path):
+    malformed_xml = tmp_path / "malformed.xml"
+    malformed_xml.write_bytes(
+        b"<xmeml><pathurl>file://localhost/Volumes/Media/A.mov</pathurl><pathurl> </pathurl>"
+        b"<pathurl>file://localhost/Volumes/Media/B%20\xc3\xa9.mov</pathurl>\r\n"
+        b"<pathurl>\r\n  file://localhost/Volumes/Media/C\xff.mov\r\n</pathurl>\n"
+        b"<pathurl>file://localhost/Volumes/Media/unterminated.mov\n<broken>"
+    )
+
+    assert s.extract_pathurls_from_malformed_xml(str(malformed_xml)) == [
+        "/Volumes/Media/A.mov",
+        "/Volumes/Media/B é.mov",
+        "/Volumes/Media/C.mov",
+    ]
+
+    empty_xml = tmp_path / "empty.xml"
+    empty_xml.touch()
+    assert s.extract_pathurls_from_malformed_xml(str(empty_xml)) == []
+
+def test_benchmark_generators(tmp_path: Path):
+    from benchmarks import generators
+    media = generators.make_media_tree(tmp_path / "Volumes" / "Bench", files=30, dirs=4, file_size=1024)
+    assert len({path.parent for path in media}) == 4
+    assert all(path.stat().st_size == 1024 for path in media)
+
+    xml = tmp_path / "bench.xml"
+    generators.write_premiere_xml(xml, media, clips=100, nesting=2)
+    parsed = list(s.iter_pathurls_from_xml(str(xml)))
+    assert len(parsed) == 30
+    assert len(list(s.iter_clip_media_from_xml(str(xml)))) == 100
+
+    generators.write_premiere_xml(xml, media, clips=100, malformed=True)
+    with pytest.warns(RuntimeWarning):
+        assert len(s.extract_pathurls_from_xml(str(xml))) == 30
+
+def test_copy_metrics(tmp_path: Path):
+    from metrics import Metrics
+    src_base = tmp_path / "src"
+    src_base.mkdir()
+    srcs = []
+    for i in range(4):
+        src = src_base / f"clip{i}.mov"
+        src.write_bytes(b"x" * 1000)
+        srcs.append(src)
+    srcs.append(src_base / "missing.mov")
+
+    metrics = Metrics(json_path=tmp_path / "metrics.json", prometheus_path=tmp_path / "metrics.prom")
+    metrics.begin_copy(total_bytes=4000, total_files=5)
+    with metrics.phase("copy"), patch('archive_nle.log_failed_copy'):
+        a.copy_files_shutil(srcs, tmp_path / "dst", flat=True, jobs=2, metrics=metrics, verbose=False)
+    metrics.export()
+
+    assert metrics.files_copied == 4
+    assert metrics.files_failed == 1
+    assert metrics.bytes_done == 4000
+    assert metrics.eta() == 0
+    assert "[5/5 files]" in metrics.progress_line()
+
+    import json
+    snapshot = json.loads((tmp_path / "metrics.json").read_text())
+    assert snapshot["files_copied"] == 4
+    assert len(snapshot["recent_files"]) == 4
+    assert "copy" in snapshot["phases_seconds"]
+    prom = (tmp_path / "metrics.prom").read_text()
+    assert "archive_nle_bytes_done 4000" in prom
+    assert 'archive_nle_phase_seconds{phase="copy"}' in prom
+
+
+def test_token_bucket_holds_rate():
+    import time
+    from throttle import TokenBucket
+    bucket = TokenBucket(rate=1_000_000)
+    bucket.tokens = 0
+    started = time.monotonic()
+    for _ in range(4):
+        bucket.consume(50_000)
+    assert time.monotonic() - started >= 0.18
+
+    unlimited = TokenBucket(rate=0)
+    started = time.monotonic()
+    unlimited.consume(10 ** 12)
+    assert time.monotonic() - started < 0.1
+
+
+def test_bandwidth_schedule_and_control_file(tmp_path: Path):
+    from datetime import datetime
+    import os
+    import throttle
+    schedule = [
+        throttle.parse_schedule_rule("09:00-19:00=100"),
+        throttle.parse_schedule_rule("EDIT_SAN@19:00-07:00=off"),
+    ]
+    now = datetime(2024, 5, 1, 12, 0)
+    control = tmp_path / "bandwidth.txt"
+    limiter = throttle.BandwidthLimiter(
+        rate=0,
+        volume_rates={"EDIT_SAN": 20 * throttle.MB},
+        schedule=schedule,
+        control_file=control,
+        now=lambda: now,
+    )
+    assert limiter.rate("*") == 100 * throttle.MB
+    assert limiter.rate("EDIT_SAN") == 20 * throttle.MB
+
+    now = datetime(2024, 5, 1, 23, 30)
+    assert limiter.rate("*") == 0
+    assert limiter.rate("EDIT_SAN") == 0
+
+    # the control file overrides everything and is picked up mid-run
+    control.write_text("# overnight\n* = 400\nEDIT_SAN=5\n")
+    limiter.refresh()
+    assert limiter.rate("*") == 400 * throttle.MB
+    assert limiter.bucket("EDIT_SAN").rate == 5 * throttle.MB
+
+    control.write_text("EDIT_SAN=unlimited\n")
+    os.utime(control, ns=(1, 1))
+    limiter.refresh()
+    assert limiter.rate("EDIT_SAN") == 0
+    assert limiter.rate("*") == 0
+
+    with pytest.raises(ValueError):
+        throttle.parse_schedule_rule("9-17=100")
+
+
+def test_copy_with_bandwidth_cap(tmp_path: Path):
+    import time
+    import throttle
+    src_base = tmp_path / "src"
+    src_base.mkdir()
+    srcs = []
+    for i in range(2):
+        src = src_base / f"clip{i}.mov"
+        src.write_bytes(bytes(range(250)) * 600)
+        srcs.append(src)
+
+    bandwidth = throttle.BandwidthLimiter(rate=1_000_000)
+    bandwidth.bucket("*").tokens = 0
+    started = time.monotonic()
+    root = a.copy_files_shutil(srcs, tmp_path / "dst", flat=True, jobs=2, bandwidth=bandwidth, verbose=False)
+    assert time.monotonic() - started >= 0.25
+    for src in srcs:
+        assert (root / src.name).read_bytes() == src.read_bytes()
+
+    assert a.volume_bandwidth("EDIT_SAN=80") == ("EDIT_SAN", 80 * throttle.MB)
+    with pytest.raises(a.argparse.ArgumentTypeError):
+        a.volume_bandwidth("EDIT_SAN")
+
+
+def test_order_copies():
+    stats = {
+        Path('/Volumes/RAID/B/b2.mov'): a.SourceStat(300, 0.0, True, inode=20),
+        Path('/Volumes/RAID/B/b1.mov'): a.SourceStat(100, 0.0, True, inode=10),
+        Path('/Volumes/RAID/A/a1.mov'): a.SourceStat(200, 0.0, True, inode=30),
+        Path('/Volumes/NAS/n1.mov'): a.SourceStat(50, 0.0, True, inode=5),
+        Path('/Volumes/NAS/n2.mov'): a.SourceStat(500, 0.0, True, inode=4),
+    }
+    srcs = list(stats)
+
+    assert a.order_copies(srcs, stats, "locality") == [
+        Path('/Volumes/NAS/n2.mov'),
+        Path('/Volumes/RAID/A/a1.mov'),
+        Path('/Volumes/NAS/n1.mov'),
+        Path('/Volumes/RAID/B/b1.mov'),
+        Path('/Volumes/RAID/B/b2.mov'),
+    ]
+    assert [stats[src].size for src in a.order_copies(srcs, stats, "largest")] == [500, 300, 200, 100, 50]
+    assert a.order_copies(srcs, stats, "none") == srcs
+    with pytest.raises(ValueError):
+        a.order_copies(srcs, stats, "random")
+
+
+def test_order_copies_by_extent(tmp_path: Path):
+    srcs = []
+    for i in range(5):
+        src = tmp_path / f"clip{i}.mov"
+        src.write_bytes(b"x" * 8192)
+        srcs.append(src)
+    stats = a.stat_sources(srcs)
+    assert stats[srcs[0]].inode == srcs[0].stat().st_ino
+
+    ordered = a.order_copies(srcs, stats, "extent")
+    assert sorted(ordered) == sorted(srcs)
+    offsets = [a.fastcopy.physical_offset(src) for src in ordered]
+    if None not in offsets:
+        assert offsets == sorted(offsets)
+
+
+def test_pack_small_files(tmp_path: Path):
+    import packing
+    src_base = tmp_path / "src"
+    (src_base / "stems").mkdir(parents=True)
+    smalls = []
+    for i in range(5):
+        src = src_base / "stems" / f"stem{i}.wav"
+        src.write_bytes(bytes([i]) * (100 + i))
+        smalls.append(src)
+    large = src_base / "A001.mov"
+    large.write_bytes(b"m" * 5000)
+
+    root = a.copy_files_shutil(
+        smalls + [large], tmp_path / "dst", flat=True, checksum="md5", pack_threshold=1000, pack_bytes=300, verbose=False
+    )
+    assert (root / "A001.mov").read_bytes() == large.read_bytes()
+    assert not (root / "stem0.wav").exists()
+    packs = sorted(root.glob("archive_nle_pack_*.tar"))
+    assert len(packs) > 1
+    assert not list(root.glob("*.partial"))
+
+    # packed files count as copied
+    assert a.packing.packed_names(root) == {src.name for src in smalls}
+    assert a.directory_listing(root) >= {src.name for src in smalls}
+    assert a.uncopiedfiles_directoryagnostic(smalls + [large], tmp_path / "dst") == []
+
+    out = packing.extract_member(packing.index_path(packs[0]), "stem0.wav", tmp_path / "stem0.wav")
+    assert out.read_bytes() == smalls[0].read_bytes()
+    assert out.stat().st_mtime == pytest.approx(smalls[0].stat().st_mtime)
+
+    restored = [path for pack in packs for path in packing.unpack(pack, remove=True)]
+    assert sorted(path.name for path in restored) == sorted(src.name for src in smalls)
+    for src in smalls:
+        assert (root / src.name).read_bytes() == src.read_bytes()
+
+
+def test_parallel_packs_into_one_folder(tmp_path: Path):
+    import time
+    import packing
+    # flat mode packs each source folder on its own, all into the same dated folder
+    srcs = []
+    for i in range(24):
+        src = tmp_path / "src" / f"roll{i}" / f"clip{i}.xmp"
+        src.parent.mkdir(parents=True)
+        src.write_bytes(f"sidecar {i}".encode())
+        srcs.append(src)
+
+    real_next = packing.next_pack_path
+
+    def slow_next(folder):
+        # widen the gap between numbering and creating the tar
+        path = real_next(folder)
+        time.sleep(0.01)
+        return path
+
+    with patch("packing.next_pack_path", side_effect=slow_next):
+        root = a.copy_files_shutil(srcs, tmp_path / "dst", flat=True, jobs=8, checksum="md5", pack_threshold=1024 * 1024, verbose=False)
+
+    assert packing.packed_names(root) == {src.name for src in srcs}
+    assert len(list(root.glob("archive_nle_pack_*.tar"))) == 24
+    assert not list(root.glob("*.partial"))
+    assert a.verify_archive(root) == []
+
+
+def test_verify_packs_drops_mismatches(tmp_path: Path):
+    import packing
+    srcs = []
+    for i in range(3):
+        src = tmp_path / f"sub{i}.srt"
+        src.write_bytes(f"subtitle {i}".encode())
+        srcs.append(src)
+    folder = tmp_path / "dst"
+    with packing.PackWriter(folder, checksum="md5") as writer:
+        for src in srcs:
+            writer.add(src, src.name)
+        # a source that fails part way leaves the pack intact
+        with pytest.raises(FileNotFoundError):
+            writer.add(tmp_path / "missing.srt", "missing.srt")
+    pack = writer.packs[0]
+    assert packing.verify_packs(folder) == {}
+
+    row = next(row for row in packing.read_index(packing.index_path(pack)) if row["name"] == "sub1.srt")
+    with open(pack, "r+b") as f:
+        f.seek(int(row["offset"]))
+        f.write(b"X")
+    mismatched = packing.verify_packs(folder)
+    assert [row["name"] for row in mismatched[packing.index_path(pack)]] == ["sub1.srt"]
+    assert packing.packed_names(folder) == {"sub0.srt", "sub2.srt"}
+
+
+def test_content_store_dedupes_across_runs(tmp_path: Path):
+    from content_store import ContentStore
+    src_base = tmp_path / "src"
+    src_base.mkdir()
+    first = src_base / "A001.mxf"
+    first.write_bytes(b"a" * 4096)
+    renamed = src_base / "A001_v2.mxf"
+    renamed.write_bytes(b"a" * 4096)
+    same_size = src_base / "B001.mxf"
+    same_size.write_bytes(b"b" * 4096)
+
+    dst = tmp_path / "dst"
+    store = ContentStore(dst, algorithm="md5")
+    run1 = a.copy_files_shutil([first], dst, flat=True, store=store, checksum="md5", verbose=False)
+    (run1.parent / "run1").mkdir()
+    run1 = run1.rename(run1.parent / "run1" / run1.name)
+
+    with patch('fixity.copy_with_checksum', wraps=a.fixity.copy_with_checksum) as copied:
+        run2 = a.copy_files_shutil([renamed, same_size], dst, flat=True, store=store, verbose=False)
+    # only the new content is copied into the store
+    assert [call.args[0] for call in copied.call_args_list] == [same_size]
+
+    linked = run2 / "A001_v2.mxf"
+    assert linked.read_bytes() == first.read_bytes()
+    assert linked.stat().st_ino == (run1 / "A001.mxf").stat().st_ino
+    assert (run2 / "B001.mxf").read_bytes() == same_size.read_bytes()
+    assert len(list(store.objects.rglob("*-4096"))) == 2
+    assert fixity_rows(run1)[0]["hash"] == a.fixity.hash_file(first, "md5")
+
+    # unchanged sources aren't hashed again
+    with patch('fixity.hash_file') as hashed:
+        assert store.place(renamed, tmp_path / "again.mxf").strategy == "linked"
+    hashed.assert_not_called()
+
+    # the space check only counts media the store is known to hold as free, not anything the same size
+    unseen = src_base / "C001.mxf"
+    unseen.write_bytes(b"c" * 4096)
+    plan, _ = a.plan_space([first, unseen], a.stat_sources([first, unseen]), dst, store=store)
+    assert plan.total.bytes == 4096 and plan.total.files == 2
+
+    # an existing store keeps the algorithm it was created with
+    with pytest.raises(ValueError):
+        ContentStore(dst, algorithm="sha1")
+
+
+def fixity_rows(root: Path):
+    import csv
+    with open(root / a.fixity.MANIFEST_NAME, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_prune(tmp_path: Path):
+    from destination_index import DestinationIndex
+    dst = tmp_path / "dst"
+    keep = dst / "RAID" / "Project" / "A001.mov"
+    stale = dst / "RAID" / "Project" / "Old" / "B001.mov"
+    other_volume = dst / "NAS" / "C001.mov"
+    flat_run = dst / "240101120000" / "D001.mxf"
+    manifest = dst / "RAID" / "fixity.csv"
+    for path in (keep, stale, other_volume, flat_run, manifest):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * 10)
+
+    index = DestinationIndex(dst)
+    index.refresh()
+    sources = ['/Volumes/RAID/Project/A001.mov', '/Volumes/RAID/Project/Missing.mov']
+    candidates = a.prune_candidates(index, sources)
+    index.close()
+    assert candidates == [('RAID/Project/Old/B001.mov', 10)]
+
+    import fixity
+    from journal import CopyJournal
+    root_manifest = fixity.FixityManifest(dst / fixity.MANIFEST_NAME)
+    journal = CopyJournal(tmp_path / "journal.sqlite", job=str(dst))
+    for path in (keep, stale):
+        src = Path("/Volumes") / path.relative_to(dst)
+        root_manifest.add(path, src, 10, "md5", "0" * 32)
+        journal.complete(src, path)
+
+    assert a.prune_files(dst, candidates, journal=journal) == 10
+    assert not stale.exists()
+    assert not stale.parent.exists()
+    for path in (keep, other_volume, flat_run, manifest):
+        assert path.exists()
+
+    # a later cut that uses the pruned media again copies it again, and verify doesn't miss it
+    assert journal.completed() == {'/Volumes/RAID/Project/A001.mov'}
+    assert list(root_manifest.entries()) == ['RAID/Project/A001.mov']
+    journal.close()
+
+
+def test_prune_leaves_excluded_and_shared_media(tmp_path: Path):
+    import os
+    from destination_index import DestinationIndex
+    dst = tmp_path / "dst"
+    keep = dst / "RAID" / "Project" / "A001.mov"
+    excluded = dst / "RAID" / "Project" / "Dailies" / "B001.mov"
+    stale = dst / "RAID" / "Project" / "Old" / "C001.mov"
+    shared = dst / "RAID" / "Project" / "Old" / "D001.mov"
+    for path in (keep, excluded, stale):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * 10)
+    # like a tree entry linked from the content store
+    stored = dst / ".archive_nle_store" / "objects" / "10-d001"
+    stored.parent.mkdir(parents=True)
+    stored.write_bytes(b"y" * 10)
+    os.link(stored, shared)
+
+    index = DestinationIndex(dst)
+    index.refresh()
+    # the excluded folder is used by the timelines but filtered out of the plan
+    candidates = a.prune_candidates(index, ['/Volumes/RAID/Project/A001.mov'], ["/Volumes/RAID/Project/Dailies"])
+    index.close()
+    assert sorted(candidates) == [('RAID/Project/Old/C001.mov', 10), ('RAID/Project/Old/D001.mov', 10)]
+
+    assert a.reclaimable_size(dst, candidates) == 10
+    assert a.prune_files(dst, candidates) == 10
+    assert not stale.exists() and not shared.exists()
+    assert excluded.exists() and stored.exists()
+
+
+def test_classify_failures():
+    import errno
+    import failures
+    assert failures.classify(OSError(errno.EIO, "I/O error")) == failures.TRANSIENT
+    assert failures.classify(OSError(errno.ESTALE, "Stale file handle")) == failures.TRANSIENT
+    assert failures.classify(TimeoutError()) == failures.TRANSIENT
+    assert failures.classify(OSError(errno.ENOSPC, "No space left on device")) == failures.SPACE
+    assert failures.classify(PermissionError(errno.EACCES, "Permission denied")) == failures.PERMANENT
+    assert failures.classify("destination does not match source checksum") == failures.PERMANENT
+
+
+def make_sources(tmp_path: Path, names: List[str]) -> List[Path]:
+    srcs = []
+    for name in names:
+        src = tmp_path / "src" / name
+        src.parent.mkdir(exist_ok=True)
+        src.write_bytes(name.encode())
+        srcs.append(src)
+    return srcs
+
+
+def test_transient_errors_are_retried(tmp_path: Path):
+    import errno
+    from failures import FailureReport
+    srcs = make_sources(tmp_path, ["flaky.mov", "denied.mov", "fine.mov"])
+    attempts = {}
+    real_copy_file = a.copy_file
+
+    def copy_file(src, dst, **kwargs):
+        attempts[src.name] = attempts.get(src.name, 0) + 1
+        a.ensure_folder_exists(dst.parent)
+        if src.name == "flaky.mov" and attempts[src.name] < 3:
+            dst.write_bytes(b"partial")
+            raise OSError(errno.ETIMEDOUT, "Connection timed out")
+        if src.name == "denied.mov":
+            raise PermissionError(errno.EACCES, "Permission denied")
+        return real_copy_file(src, dst, **kwargs)
+
+    report = FailureReport(tmp_path / "failed.jsonl")
+    with patch('archive_nle.copy_file', side_effect=copy_file), patch('archive_nle.failure_report', report):
+        root = a.copy_files_shutil(srcs, tmp_path / "dst", flat=True, jobs=2, retries=3, retry_delay=0.01, verbose=False)
+
+    assert attempts == {"flaky.mov": 3, "denied.mov": 1, "fine.mov": 1}
+    assert (root / "flaky.mov").read_bytes() == b"flaky.mov"
+    assert not (root / "denied.mov").exists()
+    assert [failure["kind"] for failure in report.failures] == ["permanent"]
+    assert report.failures[0]["source"] == str(srcs[1])
+
+    report.write(tmp_path / "report.json")
+    import json
+    written = json.loads((tmp_path / "report.json").read_text())
+    assert written["counts"] == {"permanent": 1}
+    assert len((tmp_path / "failed.jsonl").read_text().splitlines()) == 1
+
+
+def test_space_errors_pause_the_job(tmp_path: Path):
+    import errno
+    from failures import FailureReport, JobPaused
+    srcs = make_sources(tmp_path, [f"clip{i}.mov" for i in range(5)])
+
+    def copy_file(src, dst, **kwargs):
+        if src.name == "clip1.mov":
+            raise OSError(errno.ENOSPC, "No space left on device")
+        a.ensure_folder_exists(dst.parent)
+        return a.CopyResult(a.fastcopy.fast_copy(src, dst))
+
+    report = FailureReport(None)
+    with patch('archive_nle.copy_file', side_effect=copy_file), patch('archive_nle.failure_report', report):
+        with pytest.raises(JobPaused) as paused:
+            a.copy_files_shutil(srcs, tmp_path / "dst", flat=True, jobs=1, retries=3, verbose=False)
+
+    assert paused.value.remaining == srcs[2:]
+    assert sorted(p.name for p in paused.value.archive_root.iterdir()) == ["clip0.mov"]
+    assert report.counts() == {"space": 1}
+
+
+def test_pack_failures_are_retried_or_paused(tmp_path: Path):
+    import errno
+    import packing
+    from failures import FailureReport, JobPaused
+    srcs = make_sources(tmp_path, ["a.xmp", "b.xmp", "c.xmp", "d.xmp"])
+    real_add = packing.PackWriter.add
+    attempts = {}
+
+    def flaky_add(writer, src, name, throttle=None):
+        attempts[name] = attempts.get(name, 0) + 1
+        if name == "b.xmp" and attempts[name] == 1:
+            raise OSError(errno.ETIMEDOUT, "Connection timed out")
+        return real_add(writer, src, name, throttle)
+
+    # a transient error while packing is retried, and the retry is copied on its own
+    report = FailureReport(None)
+    with patch.object(packing.PackWriter, "add", autospec=True, side_effect=flaky_add), \
+         patch('archive_nle.failure_report', report):
+        root = a.copy_files_shutil(
+            srcs, tmp_path / "dst", flat=True, pack_threshold=100, retries=2, retry_delay=0.01, verbose=False
+        )
+    assert report.failures == []
+    assert (root / "b.xmp").read_bytes() == b"b.xmp"
+    assert sorted(packing.packed_names(root)) == ["a.xmp", "c.xmp", "d.xmp"]
+
+    # running out of space stops the group, and the rest wait for the next run
+    def full_add(writer, src, name, throttle=None):
+        if name == "b.xmp":
+            raise OSError(errno.ENOSPC, "No space left on device")
+        return real_add(writer, src, name, throttle)
+
+    with patch.object(packing.PackWriter, "add", autospec=True, side_effect=full_add), \
+         patch('archive_nle.failure_report', report):
+        with pytest.raises(JobPaused) as paused:
+            a.copy_files_shutil(srcs, tmp_path / "dst2", flat=True, pack_threshold=100, retries=2, verbose=False)
+    assert paused.value.remaining == srcs[2:]
+    assert report.counts() == {"space": 1}
+    assert packing.packed_names(paused.value.archive_root) == {"a.xmp"}
+
+
+def test_failed_pack_leaves_nothing_behind(tmp_path: Path):
+    import errno
+    import packing
+    srcs = make_sources(tmp_path, ["a.xmp", "b.xmp"])
+    folder = tmp_path / "dst"
+
+    with patch("packing.write_index", side_effect=OSError(errno.EIO, "Input/output error")):
+        with pytest.raises(OSError):
+            with packing.PackWriter(folder) as writer:
+                for src in srcs:
+                    writer.add(src, src.name)
+    assert list(folder.iterdir()) == []
+    assert writer.packs == [] and writer.sources == {}
+    assert packing.next_pack_path(folder).name == "archive_nle_pack_0001.tar"
+
+    # files lost with a pack that couldn't be finished are retried like any other
+    with patch("packing.write_index", side_effect=OSError(errno.EIO, "Input/output error")):
+        root = a.copy_files_shutil(srcs, folder, flat=True, pack_threshold=100, retries=1, retry_delay=0.01, verbose=False)
+    assert sorted(path.name for path in root.iterdir()) == ["a.xmp", "b.xmp"]
+
+
+def test_adaptive_concurrency_aimd():
+    from adaptive import AdaptiveConcurrency
+    now = [0.0]
+    gate = AdaptiveConcurrency("nas", start=2, maximum=8, interval=1.0, clock=lambda: now[0])
+
+    def window(rate: float):
+        # every copy slot is busy while the window is measured
+        gate.in_flight = gate.limit
+        now[0] += 1.0
+        gate.record(int(rate))
+
+    # throughput keeps improving, so one more stream is added each window
+    for rate in (100, 200, 300):
+        window(rate)
+    assert gate.limit == 5
+
+    # no real gain holds the level, a drop cuts it back
+    window(305)
+    window(300)
+    assert gate.limit == 5
+    window(150)
+    assert gate.limit == 3
+
+    # a window where the limit wasn't reached doesn't move it
+    gate.in_flight = 1
+    now[0] += 1.0
+    gate.record(10_000)
+    assert gate.limit == 3
+    assert gate.settled() == 5
+    assert gate.peak_rate == 305
+
+    # a limit raised past what ever ran isn't reported as the level it settled on
+    capped = AdaptiveConcurrency("nas", start=2, maximum=8, interval=1.0, clock=lambda: now[0])
+    capped.in_flight = 2
+    now[0] += 1.0
+    capped.record(100)
+    assert capped.limit == 3
+    now[0] += 100.0
+    assert capped.settled() == 2
+
+
+def test_adaptive_gate_owns_destination_streams(tmp_path: Path):
+    from adaptive import AdaptiveScheduler
+    # the destination volume isn't held by the static limit when the gate manages it
+    limiter = a.VolumeLimiter(default=1)
+    with limiter.streams(Path("/Volumes/RAID/A.mov"), Path("/Volumes/ARCHIVE/A.mov"), destination=False):
+        assert limiter.semaphore("ARCHIVE")._value == 1
+        assert limiter.semaphore("RAID")._value == 0
+
+    # but an explicit limit for the destination's volume still caps the gate
+    capped = AdaptiveScheduler(maximum=16, cap=lambda dst: 3)
+    assert capped.for_destination(tmp_path / "A.mov").maximum == 3
+    uncapped = AdaptiveScheduler(maximum=16, cap=lambda dst: None)
+    assert uncapped.for_destination(tmp_path / "A.mov").maximum == 16
+
+
+def test_copy_with_adaptive_streams(tmp_path: Path, capsys):
+    from adaptive import AdaptiveScheduler, mount_point
+    srcs = make_sources(tmp_path, [f"clip{i}.mov" for i in range(8)])
+    adaptive = AdaptiveScheduler(maximum=4, interval=0.0)
+    root = a.copy_files_shutil(srcs, tmp_path / "dst", flat=True, jobs=4, adaptive=adaptive, verbose=False)
+
+    for src in srcs:
+        assert (root / src.name).read_bytes() == src.read_bytes()
+    assert list(adaptive.mounts) == [mount_point(tmp_path)]
+    assert "settled on" in capsys.readouterr().out
+    assert a.chunk_callbacks(None, None) is None
+
+
+def test_audit_select_files():
+    import random
+    from audit import DAY, select_files
+    entries = {f"clip{i}.mov": {"size": "100"} for i in range(10)}
+    now = 100 * DAY
+    last = {f"clip{i}.mov": now - i * DAY for i in range(1, 10)}
+
+    # never verified first, then oldest first
+    due = select_files(entries, last, max_age_days=7, now=now)
+    assert due == ["clip0.mov", "clip9.mov", "clip8.mov", "clip7.mov"]
+    assert select_files(entries, last, max_age_days=7, budget_bytes=250, now=now) == ["clip0.mov", "clip9.mov"]
+
+    sampled = select_files(entries, last, max_age_days=7, sample=50, now=now, rng=random.Random(1))
+    assert sampled[:4] == due
+    assert len(sampled) == 7
+    assert len(select_files(entries, last, max_age_days=0, now=now)) == 10
+
+
+def test_audit(tmp_path: Path):
+    import audit
+    srcs = make_sources(tmp_path, [f"clip{i}.mov" for i in range(4)])
+    archive = tmp_path / "archive"
+    root = a.copy_files_shutil(srcs, archive, flat=True, checksum="md5", verbose=False)
+
+    checked, failed = audit.audit(archive, processes=2)
+    assert sorted(checked) == sorted(f"{root.name}/{src.name}" for src in srcs)
+    assert failed == {}
+
+    # everything was just verified, so nothing is due
+    (root / "clip2.mov").write_bytes(b"rotten")
+    checked, failed = audit.audit(archive, max_age_days=30, processes=2)
+    assert checked == [] and failed == {}
+
+    checked, failed = audit.audit(archive, max_age_days=30, sample=100, processes=2)
+    assert failed == {f"{root.name}/clip2.mov": "size does not match"}
+
+    # a failed file stays due until it passes
+    log = audit.AuditLog(archive)
+    assert list(log.failures()) == [f"{root.name}/clip2.mov"]
+    log.close()
+    checked, _ = audit.audit(archive, max_age_days=30, processes=2)
+    assert checked == [f"{root.name}/clip2.mov"]
+
+    assert audit.main([str(archive), "--max_age", "30"]) == 2
+
+
+def test_audit_packed_files(tmp_path: Path):
+    import audit
+    import packing
+    srcs = make_sources(tmp_path, ["a.xmp", "b.xmp", "clip.mov"])
+    srcs[2].write_bytes(b"frame" * 100)
+    archive = tmp_path / "archive"
+    root = a.copy_files_shutil(srcs, archive, flat=True, checksum="md5", pack_threshold=100, verbose=False)
+    pack = root / "archive_nle_pack_0001.tar"
+
+    checked, failed = audit.audit(archive, processes=2)
+    assert sorted(checked) == [
+        f"{root.name}/archive_nle_pack_0001.tar/a.xmp",
+        f"{root.name}/archive_nle_pack_0001.tar/b.xmp",
+        f"{root.name}/clip.mov",
+    ]
+    assert failed == {}
+
+    # rot inside the tar is found by seeking to the member's data
+    row = next(row for row in packing.read_index(packing.index_path(pack)) if row["name"] == "b.xmp")
+    with open(pack, "r+b") as f:
+        f.seek(int(row["offset"]))
+        f.write(b"X")
+    checked, failed = audit.audit(archive, processes=2)
+    assert failed == {f"{root.name}/archive_nle_pack_0001.tar/b.xmp": "checksum does not match"}
+
+
+def test_capacity_plan(tmp_path: Path):
+    from capacity import allocated_size, free_space
+    srcs = [
+        Path("/Volumes/RAID/Show/A001.mov"),
+        Path("/Volumes/RAID/Show/audio/A001.wav"),
+        Path("/Volumes/RAID/Extras/B001.mov"),
+        Path("/Volumes/NAS/C001.mov"),
+    ]
+    stats = {src: a.SourceStat(size, 0.0, True) for src, size in zip(srcs, [10000, 1, 5000, 0])}
+    assert [a.top_folder(src) for src in srcs] == ["RAID/Show", "RAID/Show", "RAID/Extras", "NAS"]
+
+    # small files still take whole blocks, packed ones round to tar blocks
+    assert allocated_size(1, 4096) == 4096
+    assert allocated_size(0, 4096) == 0
+    assert allocated_size(8192, 4096) == 8192
+    assert allocated_size(1, 4096, packed=True) == 1024
+
+    plan, split = a.plan_space(srcs, stats, tmp_path)
+    block = plan.block_size
+    assert plan.volumes["RAID"].files == 3 and plan.volumes["RAID"].bytes == 15001
+    assert plan.folders["RAID/Show"].allocated == allocated_size(10000, block) + block
+    assert plan.total.files == 4 and plan.total.bytes == 15001
+    assert plan.fits and split == {tmp_path: srcs}
+
+    # reserving all the free space leaves no room, and without overflow there's no split
+    free, _ = free_space(tmp_path)
+    plan, split = a.plan_space(srcs, stats, tmp_path, reserve=free)
+    assert not plan.fits and plan.shortfall >= plan.total.allocated
+    assert split is None
+
+
+def test_split_across_destinations():
+    from capacity import split_across
+    show = [Path(f"/Volumes/RAID/Show/{i}.mov") for i in range(3)]
+    extras = [Path(f"/Volumes/RAID/Extras/{i}.mov") for i in range(2)]
+    allocated = {**{src: 40 for src in show}, **{src: 30 for src in extras}}
+    first, second = Path("/archive1"), Path("/archive2")
+
+    # folders stay together, biggest first, each in the first destination with room
+    split = split_across(show + extras, allocated, a.top_folder, [(first, 130), (second, 70)])
+    assert split == {first: show, second: extras}
+
+    # a folder too big for any one destination is split file by file
+    split = split_across(show + extras, allocated, a.top_folder, [(first, 100), (second, 100)])
+    assert sorted(map(len, split.values())) == [2, 3]
+    assert sum(allocated[src] for src in split[first]) <= 100
+
+    assert split_across(show + extras, allocated, a.top_folder, [(first, 50), (second, 50)]) is None
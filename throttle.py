@@ -0,0 +1,201 @@
+from typing import Callable, Dict, List, NamedTuple, Optional
+from datetime import datetime, time as clock
+from pathlib import Path
+import os
+import threading
+import time
+
+MB = 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+REFRESH_INTERVAL = 1.0
+GLOBAL = "*"
+
+
+class TokenBucket:
+    """Token bucket shared by every copy thread.
+
+    A rate of 0 means unlimited. Callers may take more than the bucket holds;
+    the debt is paid off by sleeping, so large chunks are still capped to the
+    rate on average.
+    """
+
+    def __init__(self, rate: float = 0, burst: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.rate = 0.0
+        self.burst = 0.0
+        self.tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: Optional[float] = None):
+        with self._lock:
+            self._fill()
+            self.rate = max(0.0, rate)
+            # one second of data unless told otherwise
+            self.burst = burst if burst is not None else self.rate
+            self.tokens = min(self.tokens, self.burst)
+
+    def _fill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, amount: int):
+        """Take `amount` tokens, sleeping until the bucket has paid for them."""
+        with self._lock:
+            if not self.rate:
+                return
+            self._fill()
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class ScheduleRule(NamedTuple):
+    """A rate in bytes per second for a volume ("*" for all) between two times of day."""
+    volume: str
+    start: clock
+    end: clock
+    rate: float
+
+    def active(self, now: clock) -> bool:
+        if self.start <= self.end:
+            return self.start <= now < self.end
+        # windows such as 19:00-07:00 wrap past midnight
+        return now >= self.start or now < self.end
+
+
+def parse_rate(string: str) -> float:
+    """MB/s as given on the command line or in the control file, in bytes per second."""
+    string = string.strip().lower()
+    if string in ("", "off", "unlimited"):
+        return 0.0
+    rate = float(string)
+    if rate < 0:
+        raise ValueError(f"rate can't be negative: {string}")
+    return rate * MB
+
+
+def parse_schedule_rule(string: str) -> ScheduleRule:
+    """Parse [VOLUME@]HH:MM-HH:MM=MBPS, e.g. 09:00-19:00=100 or RAID1@09:00-19:00=40."""
+    volume, _, rule = string.rpartition("@")
+    window, sep, rate = rule.partition("=")
+    start, dash, end = window.partition("-")
+    if not sep or not dash:
+        raise ValueError(f"expected [VOLUME@]HH:MM-HH:MM=MBPS, got: {string}")
+    return ScheduleRule(
+        volume or GLOBAL,
+        datetime.strptime(start, "%H:%M").time(),
+        datetime.strptime(end, "%H:%M").time(),
+        parse_rate(rate),
+    )
+
+
+def read_control_file(path: Path) -> Dict[str, float]:
+    """Rates from a control file of VOLUME=MBPS lines, "*" being the overall cap.
+
+    Blank lines and lines starting with # are ignored.
+    """
+    rates = {}
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            volume, sep, rate = line.rpartition("=")
+            if not sep or not volume.strip():
+                raise ValueError(f"expected VOLUME=MBPS, got: {line}")
+            rates[volume.strip()] = parse_rate(rate)
+    return rates
+
+
+class BandwidthLimiter:
+    """Caps copy throughput overall and per source volume.
+
+    Rates are in bytes per second and 0 means unlimited. The fixed rates are
+    overridden by any schedule rule active at the time, and both are
+    overridden by the control file, which is re-read whenever it changes so
+    the caps can be adjusted while a run is in progress.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0,
+        volume_rates: Optional[Dict[str, float]] = None,
+        schedule: Optional[List[ScheduleRule]] = None,
+        control_file: Optional[Path] = None,
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        self.rates = {GLOBAL: rate, **(volume_rates or {})}
+        self.schedule = schedule or []
+        self.control_file = Path(control_file) if control_file else None
+        self.now = now
+        self.control: Dict[str, float] = {}
+        self._control_mtime: Optional[int] = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._refreshed = 0.0
+        self.refresh()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rates[GLOBAL] or len(self.rates) > 1 or self.schedule or self.control_file)
+
+    def rate(self, volume: str) -> float:
+        """The cap that applies to a volume ("*" for the overall cap) right now."""
+        if volume in self.control:
+            return self.control[volume]
+        now = self.now().time()
+        for rule in self.schedule:
+            if rule.volume == volume and rule.active(now):
+                return rule.rate
+        return self.rates.get(volume, 0.0)
+
+    def _read_control(self):
+        try:
+            mtime = os.stat(self.control_file).st_mtime_ns
+        except FileNotFoundError:
+            self.control, self._control_mtime = {}, None
+            return
+        if mtime == self._control_mtime:
+            return
+        try:
+            self.control = read_control_file(self.control_file)
+        except (OSError, ValueError) as e:
+            # keep the last good rates rather than stopping the copy
+            print(f"Ignoring bandwidth control file {self.control_file}: {e}")
+        self._control_mtime = mtime
+
+    def refresh(self, force: bool = True):
+        """Re-apply the schedule and control file, at most once per REFRESH_INTERVAL."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._refreshed < REFRESH_INTERVAL:
+                return
+            self._refreshed = now
+            if self.control_file:
+                self._read_control()
+            for volume in set(self._buckets) | {GLOBAL}:
+                rate = self.rate(volume)
+                bucket = self._buckets.setdefault(volume, TokenBucket(rate))
+                if bucket.rate != rate:
+                    bucket.set_rate(rate)
+
+    def bucket(self, volume: str) -> TokenBucket:
+        with self._lock:
+            if volume not in self._buckets:
+                self._buckets[volume] = TokenBucket(self.rate(volume))
+            return self._buckets[volume]
+
+    def throttle(self, volume: str) -> Callable[[int], None]:
+        """A callback for the copy loop that blocks until `n` bytes may be copied from `volume`."""
+        volume_bucket = self.bucket(volume)
+
+        def consume(n: int):
+            self.refresh(force=False)
+            self._buckets[GLOBAL].consume(n)
+            volume_bucket.consume(n)
+
+        return consume
@@ -0,0 +1,117 @@
+from typing import Callable, List, Optional, Tuple
+from pathlib import Path
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+
+SAMPLE_SIZE = 1024 * 1024
+DEFAULT_PATH = Path.home() / ".cache" / "archive_nle" / "timelines.sqlite"
+
+
+def content_hash(path: Path, sample_size: int = SAMPLE_SIZE) -> str:
+    """Fast fingerprint of a file from its size and samples of its start, middle and end."""
+    size = os.path.getsize(path)
+    hasher = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= sample_size * 3:
+            hasher.update(f.read())
+        else:
+            for offset in (0, size // 2 - sample_size // 2, size - sample_size):
+                f.seek(offset)
+                hasher.update(f.read(sample_size))
+    return hasher.hexdigest()
+
+
+def encode_clip(clip: Tuple[str, Optional[int], Optional[int], Optional[int]]) -> str:
+    """One (path, in, out, duration) clip as a cache entry, path last so it may contain anything."""
+    path, *timing = clip
+    return "|".join("" if value is None else str(value) for value in timing) + "|" + path
+
+
+def decode_clip(entry: str) -> Tuple[str, Optional[int], Optional[int], Optional[int]]:
+    clip_in, clip_out, duration, path = entry.split("|", 3)
+    return (path, *(int(value) if value else None for value in (clip_in, clip_out, duration)))
+
+
+class TimelineCache:
+    """On-disk cache of the media paths extracted from each timeline.
+
+    Entries are keyed on the timeline's path, size, mtime and content hash,
+    plus a variant string for extraction options. Ignore filtering is not
+    cached, so exclude lists can change without re-parsing. The least
+    recently used entries are evicted beyond `max_entries` or `max_bytes`.
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_PATH, max_entries: int = 50, max_bytes: int = 1024 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # timelines may be parsed from several processes at once
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS timelines (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                paths BLOB NOT NULL,
+                bytes INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def key(source: Path, variant: str = "") -> str:
+        stat = os.stat(source)
+        parts = [str(Path(source).resolve()), str(stat.st_size), str(stat.st_mtime_ns), content_hash(source), variant]
+        return hashlib.sha1("\0".join(parts).encode()).hexdigest()
+
+    def get(self, source: Path, variant: str = "") -> Optional[List[str]]:
+        return self._get(self.key(source, variant))
+
+    def put(self, source: Path, paths: List[str], variant: str = ""):
+        self._put(self.key(source, variant), source, paths)
+
+    def _get(self, key: str) -> Optional[List[str]]:
+        row = self._conn.execute("SELECT paths FROM timelines WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE timelines SET last_used=? WHERE key=?", (time.time(), key))
+        self._conn.commit()
+        data = zlib.decompress(row[0]).decode("utf-8")
+        return data.split("\0") if data else []
+
+    def _put(self, key: str, source: Path, paths: List[str]):
+        blob = zlib.compress("\0".join(paths).encode("utf-8"))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO timelines (key, source, paths, bytes, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, str(source), blob, len(blob), time.time()),
+        )
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used entries until the cache is within its limits."""
+        rows = self._conn.execute("SELECT key, bytes FROM timelines ORDER BY last_used DESC").fetchall()
+        kept_bytes = 0
+        expired = []
+        for count, (key, size) in enumerate(rows, start=1):
+            kept_bytes += size
+            if count > self.max_entries or kept_bytes > self.max_bytes:
+                expired.append((key,))
+        self._conn.executemany("DELETE FROM timelines WHERE key=?", expired)
+        self._conn.commit()
+
+    def paths(self, source: Path, extract: Callable[[], List[str]], variant: str = "") -> List[str]:
+        """Cached paths for a timeline, extracting and storing them on a miss."""
+        key = self.key(source, variant)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        paths = extract()
+        self._put(key, source, paths)
+        return paths